@@ -0,0 +1,133 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import time
+
+from bench.generate_fleet import fleet_size, generate
+from bench.loadtest import ensure_config
+
+logger = logging.getLogger(__name__)
+
+
+def sample_ids(db_path, query, count, rng):
+    conn = sqlite3.connect(db_path)
+    ids = [row[0] for row in conn.execute(query)]
+    conn.close()
+    return [rng.choice(ids) for _ in range(count)] if ids else []
+
+
+def time_calls(func, args_list):
+    timings = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'calls': len(timings),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+    }
+
+
+def run_scale(bot, db_path, iterations, rng):
+    bot.DB_PATH = db_path
+
+    driver_ids = sample_ids(
+        db_path, "SELECT id FROM drivers WHERE status = 'active' AND current_truck_id IS NOT NULL", iterations, rng)
+    reporter_ids = sample_ids(db_path, 'SELECT DISTINCT driver_id FROM completed_checks LIMIT 5000', iterations, rng)
+    truck_ids = sample_ids(db_path, 'SELECT DISTINCT truck_id FROM completed_checks LIMIT 5000', iterations, rng)
+
+    def reports_page(truck_id, offset):
+        conn = bot.get_connection()
+        bot.fetch_reports_page(conn.cursor(), truck_id, offset)
+        conn.close()
+
+    # Страницы уже в REPORT_PAGES: остается чтение версии фуры
+    for truck_id in truck_ids:
+        bot.get_reports_page(truck_id, 0)
+
+    # Список водителей возвращает все строки, поэтому вызовов меньше
+    heavy = max(1, iterations // 10)
+    return {
+        'get_driver_tasks': time_calls(bot.get_driver_tasks, [(i,) for i in driver_ids]),
+        # Промах кэша главного экрана водителя (DRIVER_CACHE)
+        'load_driver_context': time_calls(bot.load_driver_context, [(i,) for i in driver_ids]),
+        'get_pending_reports': time_calls(bot.get_pending_reports, [()] * iterations),
+        'reports_page_first': time_calls(reports_page, [(t, 0) for t in truck_ids]),
+        'reports_page_deep': time_calls(reports_page, [(t, 200) for t in truck_ids]),
+        'reports_page_cached': time_calls(bot.get_reports_page, [(t, 0) for t in truck_ids]),
+        'get_driver_reports': time_calls(bot.get_driver_reports, [(i,) for i in reporter_ids]),
+        'get_drivers_with_trucks': time_calls(bot.get_drivers_with_trucks, [()] * heavy),
+    }
+
+
+def compare(baseline, result, tolerance):
+    regressions = []
+    for scale, queries in result['scales'].items():
+        for name, stats in queries.items():
+            before = baseline.get('scales', {}).get(scale, {}).get(name)
+            if not before or not before['p50_ms']:
+                continue
+            ratio = stats['p50_ms'] / before['p50_ms']
+            stats['p50_vs_baseline'] = round(ratio, 2)
+            if ratio > 1 + tolerance:
+                regressions.append(f"{scale} {name}: {before['p50_ms']} -> {stats['p50_ms']} мс (x{ratio:.2f})")
+    return regressions
+
+
+# Пример: python -m bench.bench_queries --scales 0.001,0.01,0.1 --output queries.json
+#         python -m bench.bench_queries --scales 0.01 --baseline queries.json
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк запросов бота на синтетическом парке")
+    parser.add_argument('--scales', default='0.001,0.01', help="доли полного масштаба через запятую")
+    parser.add_argument('--workdir', default=os.path.join('bench', 'data'))
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--regenerate', action='store_true', help="пересоздать базы даже если они есть")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="допустимый рост p50")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ensure_config([])
+    import bot
+    bot.ARCHIVE_DIR = os.path.join(args.workdir, 'archive')
+
+    result = {'sqlite': sqlite3.sqlite_version, 'iterations': args.iterations, 'fleets': {}, 'scales': {}}
+    for scale in args.scales.split(','):
+        size = fleet_size(float(scale))
+        db_path = os.path.join(args.workdir, f"fleet_{scale}.db")
+        if args.regenerate or not os.path.exists(db_path):
+            generate(db_path, seed=args.seed, **size)
+        result['fleets'][scale] = size
+        result['scales'][scale] = run_scale(bot, db_path, args.iterations, random.Random(args.seed))
+        logger.info(f"Масштаб {scale} готов")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), result, args.tolerance)
+        result['regressions'] = regressions
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+    for line in regressions:
+        logger.warning(f"Регрессия: {line}")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
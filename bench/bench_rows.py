@@ -0,0 +1,150 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench.generate_fleet import generate
+from bench.loadtest import ensure_config
+
+
+# Прежняя реализация страницы отчетов: кортежи и словари списков словарей.
+# Оставлена здесь только для сравнения.
+def legacy_fetch(bot, cursor, truck_id, limit):
+    cursor.execute(
+        bot.REPORTS_PAGE_SELECT.format(schema='main', version='cc.version') + 'ORDER BY tt.id DESC, cc.completion_ts DESC LIMIT ? OFFSET 0',
+        (truck_id, limit)
+    )
+    reports_data = []
+    for report in cursor.fetchall():
+        cursor.execute('''
+        SELECT type, comment, voice_message_id, timestamp_ts
+        FROM main.check_comments WHERE check_id = ? ORDER BY timestamp_ts
+        ''', (report[0],))
+        comments = {'comment': [], 'skip_reason': []}
+        for comment in cursor.fetchall():
+            if comment[0] in comments:
+                comments[comment[0]].append({'text': comment[1], 'voice': comment[2], 'time': bot.format_ts(comment[3])})
+        cursor.execute('SELECT file_id, file_type FROM main.report_media WHERE report_id = ? ORDER BY id', (report[0],))
+        reports_data.append({'info': report, 'comments': comments, 'media': cursor.fetchall()})
+    return reports_data
+
+
+def legacy_caption(bot, report):
+    info = report['info']
+    caption = (
+        f"🚛 Фура: {info[1]}\n"
+        f"👤 Водитель: {info[2]} (@{info[3]})\n"
+        f"📌 Задача: {info[4]}\n"
+        f"🕒 Время проверки: {bot.format_ts(info[5])}\n"
+        f"🔮 Статус: {info[6].capitalize()}\n"
+    )
+    if report['comments']['comment']:
+        caption += "\n💬 Комментарии:\n"
+        for idx, comment in enumerate(report['comments']['comment'], 1):
+            if comment['text']:
+                caption += f"{idx}. 📝 {comment['text']} ({comment['time']})\n"
+            elif comment['voice']:
+                caption += f"{idx}. 🎧 Голосовой комментарий ({comment['time']})\n"
+    if report['comments']['skip_reason']:
+        caption += "\n⏭ Причины пропуска:\n"
+        for idx, reason in enumerate(report['comments']['skip_reason'], 1):
+            if reason['text']:
+                caption += f"{idx}. 📝 {reason['text']} ({reason['time']})\n"
+            elif reason['voice']:
+                caption += f"{idx}. 🎧 Голосовое объяснение ({reason['time']})\n"
+    return caption
+
+
+def measure(fetch, render, repeats):
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        reports = fetch()
+        fetched = time.perf_counter()
+        captions = [render(report) for report in reports]
+        timings.append((fetched - started, time.perf_counter() - fetched))
+
+    # Память отдельным прогоном: tracemalloc сам замедляет выполнение
+    gc.collect()
+    tracemalloc.start()
+    reports = fetch()
+    retained, peak = tracemalloc.get_traced_memory()
+    blocks = len(tracemalloc.take_snapshot().traces)
+    tracemalloc.stop()
+
+    fetch_times = sorted(t[0] for t in timings)
+    render_times = sorted(t[1] for t in timings)
+    return {
+        'reports': len(reports),
+        'captions_chars': sum(map(len, captions)),
+        'fetch_ms_min': round(fetch_times[0] * 1000, 2),
+        'fetch_ms_median': round(fetch_times[len(fetch_times) // 2] * 1000, 2),
+        'render_ms_min': round(render_times[0] * 1000, 2),
+        'render_ms_median': round(render_times[len(render_times) // 2] * 1000, 2),
+        'retained_kb': round(retained / 1024, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'live_blocks': blocks,
+    }
+
+
+# Пример: python -m bench.bench_rows --reports 1000 --output rows.json
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение кортежей и типизированных строк на выгрузке отчетов")
+    parser.add_argument('--reports', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    ensure_config([])
+    import bot
+
+    workdir = tempfile.mkdtemp(prefix='truck_bot_rows_')
+    db_path = os.path.join(workdir, 'rows.db')
+    # Одна фура, чтобы все отчеты попали в одну выгрузку
+    generate(db_path, trucks=1, drivers=5, tasks=8, checks=args.reports)
+    bot.DB_PATH = db_path
+    bot.ARCHIVE_DIR = os.path.join(workdir, 'archive')
+
+    conn = bot.get_connection()
+    cursor = conn.cursor()
+    typed_conn = bot.get_connection()
+    typed_cursor = typed_conn.cursor()
+
+    result = {
+        'legacy': measure(
+            lambda: legacy_fetch(bot, cursor, 1, args.reports),
+            lambda report: legacy_caption(bot, report),
+            args.repeats,
+        ),
+        'typed': measure(
+            lambda: bot.fetch_reports_page(typed_cursor, 1, 0, limit=args.reports),
+            bot.format_report_caption,
+            args.repeats,
+        ),
+    }
+    conn.close()
+    typed_conn.close()
+
+    legacy, typed = result['legacy'], result['typed']
+    result['savings'] = {
+        'retained_kb': round(legacy['retained_kb'] - typed['retained_kb'], 1),
+        'live_blocks': legacy['live_blocks'] - typed['live_blocks'],
+        'fetch_speedup': round(legacy['fetch_ms_median'] / typed['fetch_ms_median'], 2),
+        'render_speedup': round(legacy['render_ms_median'] / typed['render_ms_median'], 2),
+    }
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
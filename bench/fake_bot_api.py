@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    'id': 100000,
+    'is_bot': True,
+    'first_name': 'LoadTestBot',
+    'username': 'loadtest_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+# Методы, которые считаются ответом бота пользователю
+REPLY_METHODS = {
+    'sendMessage', 'editMessageText', 'sendMediaGroup', 'sendPhoto',
+    'sendVideo', 'sendVoice', 'sendDocument',
+}
+
+
+# Локальная замена api.telegram.org для тестов и бенчмарков.
+# Отдает апдейты через getUpdates из очереди, отвечает на исходящие вызовы
+# правдоподобными объектами Message и записывает все вызовы для проверки.
+class FakeBotAPI:
+    # latency - задержка ответа на исходящие вызовы, как у настоящего api.telegram.org
+    def __init__(self, host='127.0.0.1', port=0, files=None, latency=0.0):
+        self.host = host
+        self.port = port
+        self.files = files or {}
+        self.latency = latency
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.calls = []
+        self.calls_by_method = defaultdict(int)
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def push_update(self, payload):
+        update = dict(payload, update_id=self.next_update_id)
+        self.next_update_id += 1
+        self.updates.append(update)
+        self.new_updates.set()
+        return update['update_id']
+
+    def message(self, chat_id, **fields):
+        message = {
+            'message_id': self.next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': BOT_USER,
+        }
+        self.next_message_id += 1
+        message.update(fields)
+        return message
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        timeout = float(params.get('timeout', 0) or 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit', 100) or 100)
+        return self.updates[:limit]
+
+    async def call(self, method, params):
+        self.calls_by_method[method] += 1
+        if method != 'getUpdates':
+            self.calls.append((time.monotonic(), method, params))
+
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'sendMessage':
+            return self.message(params['chat_id'], text=params.get('text', ''))
+        if method == 'editMessageText':
+            return self.message(params.get('chat_id', 0), text=params.get('text', ''))
+        if method == 'sendMediaGroup':
+            media = json.loads(params['media']) if isinstance(params['media'], str) else params['media']
+            return [self.message(params['chat_id']) for _ in media]
+        if method in ('sendPhoto', 'sendVideo', 'sendVoice', 'sendDocument'):
+            return self.message(params['chat_id'], caption=params.get('caption'))
+        if method == 'getFile':
+            file_id = params['file_id']
+            return {
+                'file_id': file_id,
+                'file_unique_id': f"u_{file_id}",
+                'file_size': len(self.files.get(file_id, b'')),
+                'file_path': file_id,
+            }
+        return True
+
+    def parse_params(self, headers, body):
+        content_type = headers.get('content-type', '')
+        if not body:
+            return {}
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+        # multipart (загрузка файлов) тестам не нужна, разбираются только простые поля
+        params = {}
+        for part in body.split(b'--'):
+            if b'name="' in part and b'\r\n\r\n' in part:
+                head, value = part.split(b'\r\n\r\n', 1)
+                name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+                params[name] = value.rstrip(b'\r\n').decode(errors='replace')
+        return params
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                path = request_line.split()[1].decode()
+
+                if path.startswith('/file/'):
+                    file_id = path.rsplit('/', 1)[-1]
+                    data = self.files.get(file_id)
+                    status = '200 OK' if data is not None else '404 Not Found'
+                    payload = data or b''
+                    content_type = 'application/octet-stream'
+                else:
+                    method = path.rsplit('/', 1)[-1]
+                    params = self.parse_params(headers, body)
+                    if self.latency and method != 'getUpdates':
+                        await asyncio.sleep(self.latency)
+                    result = await self.call(method, params)
+                    payload = json.dumps({'ok': True, 'result': result}).encode()
+                    status = '200 OK'
+                    content_type = 'application/json'
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            # CancelledError не пробрасывается: иначе asyncio при остановке
+            # печатает трассировку для каждого открытого long polling
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка фейкового Bot API: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,178 @@
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import time
+from itertools import islice
+
+from bench.loadtest import ensure_config
+
+logger = logging.getLogger(__name__)
+
+# Полный масштаб парка; --scale 0.01 дает сотую часть каждой таблицы
+FULL_SCALE = {
+    'trucks': 5_000,
+    'drivers': 20_000,
+    'tasks': 50_000,
+    'checks': 10_000_000,
+}
+HISTORY_DAYS = 365
+COMMENT_RATIO = 0.4
+SKIP_RATIO = 0.05
+PENDING_RATIO = 0.01
+MAX_MEDIA_PER_CHECK = 3
+
+MODELS = ['Volvo FH16', 'Scania R450', 'MAN TGX', 'DAF XF', 'Mercedes Actros', 'КАМАЗ 54901']
+TASKS = ['Проверка давления в шинах', 'Уровень масла', 'Тормозная система', 'Осветительные приборы',
+         'Крепление груза', 'Тахограф', 'Омывающая жидкость', 'Аптечка и огнетушитель']
+COMMENTS = ['Все в порядке', 'Подкачал колесо', 'Долил масло', 'Заменил лампу', 'Нужен сервис',
+            'Замечаний нет', 'Небольшая течь, слежу']
+SKIP_REASONS = ['Нет времени, срочный рейс', 'Стоянка без освещения', 'Проверю на базе']
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def fleet_size(scale, **overrides):
+    size = {name: max(1, int(count * scale)) for name, count in FULL_SCALE.items()}
+    size.update({name: value for name, value in overrides.items() if value is not None})
+    return size
+
+
+def generate(db_path, trucks, drivers, tasks, checks, seed=42, batch_size=50_000):
+    ensure_config([])
+    import bot
+
+    rng = random.Random(seed)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    bot.DB_PATH = db_path
+    bot.init_db()
+
+    # Генерация идет без журнала и fsync: база одноразовая
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -200000')
+    started = time.perf_counter()
+
+    conn.executemany(
+        'INSERT INTO trucks (id, truck_number, model, year, status) VALUES (?, ?, ?, ?, ?)',
+        ((i, f"{i:06d}AB02", rng.choice(MODELS), rng.randint(2008, 2024),
+          'active' if rng.random() > 0.03 else 'inactive')
+         for i in range(1, trucks + 1))
+    )
+
+    # Задачи равномерно по фурам, у каждой фуры хотя бы одна
+    task_trucks = [i % trucks + 1 for i in range(tasks)]
+    conn.executemany(
+        'INSERT INTO truck_tasks (id, truck_id, description, frequency, is_active) VALUES (?, ?, ?, ?, ?)',
+        ((i + 1, truck_id, rng.choice(TASKS), 'daily', 1 if rng.random() > 0.05 else 0)
+         for i, truck_id in enumerate(task_trucks))
+    )
+    tasks_by_truck = {}
+    for task_id, truck_id in enumerate(task_trucks, 1):
+        tasks_by_truck.setdefault(truck_id, []).append(task_id)
+
+    driver_ids = [100_000_000 + i for i in range(drivers)]
+    driver_trucks = [i % trucks + 1 if rng.random() > 0.1 else None for i in range(drivers)]
+    conn.executemany(
+        'INSERT INTO drivers (id, first_name, username, current_truck_id, status) VALUES (?, ?, ?, ?, ?)',
+        ((driver_id, f"Водитель {i}", f"driver{i}", driver_trucks[i],
+          'active' if rng.random() > 0.05 else 'inactive')
+         for i, driver_id in enumerate(driver_ids))
+    )
+    drivers_by_truck = {}
+    for driver_id, truck_id in zip(driver_ids, driver_trucks):
+        if truck_id:
+            drivers_by_truck.setdefault(truck_id, []).append(driver_id)
+    conn.commit()
+
+    now = int(time.time())
+    history = HISTORY_DAYS * 86400
+    check_id = 0
+    for batch in batched(range(checks), batch_size):
+        check_rows, comment_rows, media_rows = [], [], []
+        for _ in batch:
+            check_id += 1
+            truck_id = rng.randint(1, trucks)
+            driver_id = rng.choice(drivers_by_truck.get(truck_id) or driver_ids)
+            task_id = rng.choice(tasks_by_truck[truck_id])
+            # id растут вместе со временем, как в рабочей базе
+            ts = now - history + int(history * check_id / checks) - rng.randint(0, 3600)
+            skipped = rng.random() < SKIP_RATIO
+            roll = rng.random()
+            status = 'pending' if roll < PENDING_RATIO else 'rejected' if roll < 0.08 else 'approved'
+
+            media_count = 0 if skipped else rng.randint(1, MAX_MEDIA_PER_CHECK)
+            first_file = f"AgAC{check_id:010d}_0" if media_count else None
+            check_rows.append((check_id, truck_id, driver_id, task_id, first_file,
+                               'photo' if media_count else None, ts, status, skipped))
+            for n in range(media_count):
+                media_rows.append((check_id, f"AgAC{check_id:010d}_{n}", 'photo', f"AQAD{check_id:010d}{n}"))
+
+            if skipped:
+                comment_rows.append((check_id, driver_id, rng.choice(SKIP_REASONS), 'skip_reason', ts + 30))
+            if rng.random() < COMMENT_RATIO:
+                comment_rows.append((check_id, driver_id, rng.choice(COMMENTS), 'comment', ts + 60))
+
+        # Даты пишутся сразу в столбцы эпохи (completion_ts, timestamp_ts),
+        # поэтому фоновому переносу дат (backfill_epoch_columns) делать нечего
+        conn.executemany(
+            'INSERT INTO completed_checks (id, truck_id, driver_id, task_id, telegram_file_id, file_type, '
+            'completion_ts, status, skipped) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            check_rows
+        )
+        conn.executemany(
+            'INSERT INTO check_comments (check_id, driver_id, comment, type, timestamp_ts) VALUES (?, ?, ?, ?, ?)',
+            comment_rows
+        )
+        conn.executemany(
+            'INSERT INTO report_media (report_id, file_id, file_type, file_unique_id) VALUES (?, ?, ?, ?)',
+            media_rows
+        )
+        conn.commit()
+        logger.info(f"Сгенерировано отчетов: {check_id}/{checks}")
+
+    # Отметка дайджеста - последний сгенерированный отчет, иначе первый
+    # дайджест объявит всю синтетическую историю как новые отчеты
+    conn.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES ('digest_last_check_id', ?)", (str(check_id),))
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"База {db_path}: {trucks} фур, {drivers} водителей, {tasks} задач, "
+        f"{checks} отчетов за {elapsed:.1f} с"
+    )
+    return {'trucks': trucks, 'drivers': drivers, 'tasks': tasks, 'checks': checks, 'seconds': round(elapsed, 1)}
+
+
+# Пример: python -m bench.generate_fleet --db /tmp/fleet.db --scale 0.01
+def main():
+    parser = argparse.ArgumentParser(description="Генератор тестовой базы парка")
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--scale', type=float, default=0.01, help="доля от полного масштаба (1.0 = 10 млн отчетов)")
+    parser.add_argument('--trucks', type=int)
+    parser.add_argument('--drivers', type=int)
+    parser.add_argument('--tasks', type=int)
+    parser.add_argument('--checks', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    size = fleet_size(args.scale, trucks=args.trucks, drivers=args.drivers, tasks=args.tasks, checks=args.checks)
+    generate(args.db, seed=args.seed, **size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from bench.fake_bot_api import FakeBotAPI
+
+TOKEN = '123456:LOADTEST'
+DRIVER_ID_BASE = 1_000_000
+ADMIN_ID_BASE = 900_000
+
+
+# bot.py импортирует config.py с токеном. В CI его нет, поэтому для теста
+# подставляется модуль с фиктивными значениями.
+def ensure_config(admin_ids):
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        config = types.ModuleType('config')
+        config.ADMIN_IDS = admin_ids
+        config.BOT_TOKEN = TOKEN
+        sys.modules['config'] = config
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class LockCounter(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record):
+        if 'locked' in record.getMessage():
+            self.count += 1
+
+
+class Harness:
+    def __init__(self, api, step_timeout=30.0):
+        self.api = api
+        self.step_timeout = step_timeout
+        self.pending = {}
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        self.updates_sent = 0
+        self.next_message_id = 1
+
+    # Обработчик в последней группе: апдейт прошел все обработчики бота
+    async def mark_done(self, update, context):
+        future = self.pending.pop(update.update_id, None)
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+
+    def user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+    def incoming_message(self, user_id, **fields):
+        message = {
+            'message_id': self.next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+        }
+        self.next_message_id += 1
+        message.update(fields)
+        return message
+
+    def text(self, user_id, text):
+        fields = {'text': text}
+        if text.startswith('/'):
+            fields['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'message': self.incoming_message(user_id, **fields)}
+
+    def photo(self, user_id, file_key, media_group_id=None):
+        fields = {'photo': [{
+            'file_id': f"photo_{file_key}",
+            'file_unique_id': f"u_{file_key}",
+            'width': 1280,
+            'height': 720,
+        }]}
+        if media_group_id:
+            fields['media_group_id'] = media_group_id
+        return {'message': self.incoming_message(user_id, **fields)}
+
+    def callback(self, user_id, data):
+        return {'callback_query': {
+            'id': str(self.next_message_id),
+            'from': self.user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': self.api.message(user_id, text='...'),
+        }}
+
+    async def send(self, flow, step, payload):
+        future = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        update_id = self.api.push_update(payload)
+        self.pending[update_id] = future
+        self.updates_sent += 1
+        try:
+            finished = await asyncio.wait_for(future, self.step_timeout)
+            self.latencies[(flow, step)].append(finished - started)
+        except asyncio.TimeoutError:
+            self.pending.pop(update_id, None)
+            self.timeouts[(flow, step)] += 1
+
+    async def driver_flow(self, driver_id, tasks_per_truck, album_size, rounds):
+        for round_idx in range(rounds):
+            await self.send('driver', 'start', self.text(driver_id, '/start'))
+            await self.send('driver', 'start_report', self.text(driver_id, '📸 Начать отчет'))
+            for task_idx in range(tasks_per_truck):
+                media_group_id = f"{driver_id}_{round_idx}_{task_idx}" if album_size > 1 else None
+                for photo_idx in range(album_size):
+                    file_key = f"{driver_id}_{round_idx}_{task_idx}_{photo_idx}"
+                    await self.send('driver', 'proof', self.photo(driver_id, file_key, media_group_id))
+                await self.send('driver', 'comment', self.text(driver_id, 'Все в порядке'))
+
+    async def admin_flow(self, admin_id, truck_ids, pages, rounds):
+        for round_idx in range(rounds):
+            truck_id = truck_ids[(admin_id + round_idx) % len(truck_ids)]
+            await self.send('admin', 'start', self.text(admin_id, '/start'))
+            await self.send('admin', 'reports_menu', self.text(admin_id, '📊 Просмотр отчетов'))
+            await self.send('admin', 'trucks_list', self.text(admin_id, '📊 Отчеты по фурам'))
+            await self.send('admin', 'open_truck', self.callback(admin_id, f"view_truck_{truck_id}"))
+            for page in range(1, pages + 1):
+                await self.send('admin', 'next_page', self.callback(admin_id, f"rp_{truck_id}_{page * 5}"))
+            await self.send('admin', 'cancel', self.text(admin_id, '/cancel'))
+
+
+def seed_database(bot, trucks, drivers, tasks_per_truck):
+    conn = bot.get_connection()
+    conn.executemany(
+        'INSERT INTO trucks (id, truck_number, model) VALUES (?, ?, ?)',
+        [(i, f"LT{i:05d}", 'Volvo FH16') for i in range(1, trucks + 1)]
+    )
+    conn.executemany(
+        'INSERT INTO truck_tasks (truck_id, description) VALUES (?, ?)',
+        [(t, f"Проверка {n + 1}") for t in range(1, trucks + 1) for n in range(tasks_per_truck)]
+    )
+    conn.executemany(
+        "INSERT INTO drivers (id, first_name, username, current_truck_id, status) VALUES (?, ?, ?, ?, 'active')",
+        [(DRIVER_ID_BASE + i, f"User{DRIVER_ID_BASE + i}", f"user{DRIVER_ID_BASE + i}", i % trucks + 1)
+         for i in range(drivers)]
+    )
+    conn.commit()
+    conn.close()
+    return list(range(1, trucks + 1))
+
+
+def db_summary(metrics):
+    summary = {}
+    for (kind,), series in metrics.DB_SECONDS.values.items():
+        count = sum(series[:-1])
+        summary[kind] = {'count': count, 'total_ms': round(series[-1] * 1000, 1)}
+    return summary
+
+
+def pool_summary(metrics):
+    summary = {}
+    for (pool,), series in metrics.API_POOL_WAIT_SECONDS.values.items():
+        count = sum(series[:-1])
+        # Запросы, ждавшие соединение дольше 10 мс
+        slow = sum(series[metrics.API_POOL_WAIT_SECONDS.buckets.index(0.01) + 1:-1])
+        summary[pool] = {
+            'requests': count,
+            'wait_total_ms': round(series[-1] * 1000, 1),
+            'wait_avg_ms': round(series[-1] * 1000 / count, 3) if count else None,
+            'waited_over_10ms': slow,
+            'timeouts': metrics.API_POOL_TIMEOUTS.values.get((pool,), 0),
+        }
+    return summary
+
+
+def setup_bot(admin_ids, db_source=None):
+    ensure_config(admin_ids)
+    import bot
+
+    workdir = tempfile.mkdtemp(prefix='truck_bot_loadtest_')
+    bot.DB_PATH = os.path.join(workdir, 'truck_tasks_v2.db')
+    bot.MEDIA_ARCHIVE_DIR = os.path.join(workdir, 'media')
+    bot.BACKUP_DIR = os.path.join(workdir, 'backups')
+    bot.ARCHIVE_DIR = os.path.join(workdir, 'archive')
+    bot.METRICS_PORT = None
+    bot.UPDATE_LOG_PATH = None
+    bot.ADMIN_IDS = admin_ids
+    if db_source:
+        shutil.copyfile(db_source, bot.DB_PATH)
+    bot.init_db()
+    return bot
+
+
+@contextlib.asynccontextmanager
+async def running_application(bot, api, harness, concurrency):
+    application = bot.build_application(
+        token=TOKEN, base_url=api.base_url, concurrent_updates=concurrency
+    )
+    application.add_handler(TypeHandler(Update, harness.mark_done), group=99)
+
+    async with application:
+        await bot.on_startup(application)
+        await application.updater.start_polling(poll_interval=0.0, timeout=1)
+        await application.start()
+        try:
+            yield application
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            application.bot_data['loop_monitor'].stop()
+
+
+def latency_summary(harness):
+    flows = {}
+    for (flow, step), values in sorted(harness.latencies.items()):
+        flows[f"{flow}.{step}"] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            'max_ms': round(max(values) * 1000, 2),
+            'timeouts': harness.timeouts.get((flow, step), 0),
+        }
+    for (flow, step), count in harness.timeouts.items():
+        if (flow, step) not in harness.latencies:
+            flows[f"{flow}.{step}"] = {'count': 0, 'timeouts': count}
+    return flows
+
+
+def db_report(lock_counter):
+    import metrics
+    import sql_stats
+
+    return {
+        'db': db_summary(metrics),
+        'db_top_statements': [
+            {'sql': stats.sql[:200], 'count': stats.count, 'total_ms': round(stats.total * 1000, 1)}
+            for stats in sql_stats.top_statements(5)
+        ],
+        'db_locked_errors': lock_counter.count,
+        'handler_errors': sum(metrics.HANDLER_ERRORS.values.values()),
+        'api_pools': pool_summary(metrics),
+    }
+
+
+async def run(args):
+    admin_ids = [ADMIN_ID_BASE + i for i in range(args.admins)]
+    bot = setup_bot(admin_ids)
+    if args.pool_size:
+        bot.TELEGRAM_POOL_SIZE = args.pool_size
+    if args.pool_timeout:
+        bot.TELEGRAM_POOL_TIMEOUT = args.pool_timeout
+    bot.TELEGRAM_HTTP2 = args.http2
+    truck_ids = seed_database(bot, args.trucks, args.drivers, args.tasks)
+
+    api = await FakeBotAPI(latency=args.api_latency).start()
+    harness = Harness(api, step_timeout=args.step_timeout)
+    lock_counter = LockCounter()
+    logging.getLogger().addHandler(lock_counter)
+
+    async with running_application(bot, api, harness, args.concurrency) as application:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(harness.driver_flow(DRIVER_ID_BASE + i, args.tasks, args.album, args.rounds)
+              for i in range(args.drivers)),
+            *(harness.admin_flow(admin_id, truck_ids, args.pages, args.rounds) for admin_id in admin_ids),
+        )
+        elapsed = time.perf_counter() - started
+
+    await api.stop()
+
+    return {
+        'params': vars(args),
+        'updates': harness.updates_sent,
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(harness.updates_sent / elapsed, 1) if elapsed else None,
+        'flows': latency_summary(harness),
+        'api_calls': dict(api.calls_by_method),
+        **db_report(lock_counter),
+        'event_loop_lag': application.bot_data['loop_monitor'].percentiles(),
+    }
+
+
+# Пример: python -m bench.loadtest --drivers 50 --admins 3 --concurrency 16 --output result.json
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота против фейкового Bot API")
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--trucks', type=int, default=10)
+    parser.add_argument('--tasks', type=int, default=3, help="задач на фуру")
+    parser.add_argument('--album', type=int, default=1, help="фото в одном подтверждении")
+    parser.add_argument('--pages', type=int, default=3, help="страниц отчетов, которые листает админ")
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1, help="concurrent_updates приложения")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка ответа фейкового Bot API, секунды")
+    parser.add_argument('--pool-size', type=int, help="соединений в пуле отправки (TELEGRAM_POOL_SIZE)")
+    parser.add_argument('--pool-timeout', type=float, help="ожидание соединения из пула (TELEGRAM_POOL_TIMEOUT)")
+    parser.add_argument('--http2', action='store_true', help="HTTP/2 к Bot API (нужен пакет h2)")
+    parser.add_argument('--step-timeout', type=float, default=30.0)
+    parser.add_argument('--output')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+
+from bench.fake_bot_api import FakeBotAPI, REPLY_METHODS
+from bench.loadtest import (
+    Harness, LockCounter, db_report, ensure_config, latency_summary, running_application, setup_bot
+)
+from update_log import read_updates
+
+
+# Шаг для статистики задержек: команда, тип сообщения или callback без чисел
+def update_step(update):
+    if 'callback_query' in update:
+        return 'callback:' + re.sub(r'\d+', 'N', update['callback_query'].get('data') or '')
+    message = update.get('message') or update.get('edited_message') or {}
+    text = message.get('text')
+    if text:
+        return 'command:' + text.split()[0] if text.startswith('/') else 'text'
+    for kind in ('photo', 'video', 'voice', 'document'):
+        if kind in message:
+            return kind
+    return 'other'
+
+
+# Ответы бота по чатам. Числа заменены, чтобы время и id не давали ложных различий
+def transcripts(api):
+    chats = {}
+    for _, method, params in api.calls:
+        if method not in REPLY_METHODS:
+            continue
+        text = params.get('text') or params.get('caption') or ''
+        chats.setdefault(str(params.get('chat_id')), []).append(f"{method}: {re.sub(r'[0-9]+', '#', text)[:120]}")
+    return chats
+
+
+async def replay(harness, entries, speed):
+    loop = asyncio.get_running_loop()
+    first_ts = entries[0][0]
+    started = loop.time()
+    sends = []
+    for ts, update in entries:
+        if speed:
+            delay = (ts - first_ts) / speed - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        sends.append(asyncio.create_task(harness.send('replay', update_step(update), update)))
+    await asyncio.gather(*sends)
+
+
+def compare(baseline, result, tolerance):
+    report = {'latency': {}, 'regressions': [], 'changed_chats': {}}
+    for step, stats in result['flows'].items():
+        before = baseline['flows'].get(step)
+        if not before or not before.get('p50_ms') or not stats.get('p50_ms'):
+            continue
+        ratio = stats['p95_ms'] / before['p95_ms'] if before['p95_ms'] else 1.0
+        report['latency'][step] = {
+            'p50_ms': [before['p50_ms'], stats['p50_ms']],
+            'p95_ms': [before['p95_ms'], stats['p95_ms']],
+        }
+        if ratio > 1 + tolerance:
+            report['regressions'].append(f"{step}: p95 {before['p95_ms']} -> {stats['p95_ms']} мс")
+
+    for chat_id, replies in result['transcripts'].items():
+        old_replies = baseline['transcripts'].get(chat_id, [])
+        if replies != old_replies:
+            position = next(
+                (i for i, (a, b) in enumerate(zip(old_replies, replies)) if a != b),
+                min(len(old_replies), len(replies))
+            )
+            report['changed_chats'][chat_id] = {
+                'position': position,
+                'before': old_replies[position] if position < len(old_replies) else None,
+                'after': replies[position] if position < len(replies) else None,
+            }
+    return report
+
+
+async def run(args):
+    ensure_config([])
+    import config
+    admin_ids = [int(i) for i in args.admins.split(',')] if args.admins else list(getattr(config, 'ADMIN_IDS', []))
+    bot = setup_bot(admin_ids, db_source=args.db)
+
+    entries = list(read_updates(args.log))
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        raise SystemExit(f"В {args.log} нет апдейтов")
+
+    api = await FakeBotAPI().start()
+    harness = Harness(api, step_timeout=args.step_timeout)
+    lock_counter = LockCounter()
+    logging.getLogger().addHandler(lock_counter)
+
+    async with running_application(bot, api, harness, args.concurrency):
+        started = time.perf_counter()
+        await replay(harness, entries, args.speed)
+        elapsed = time.perf_counter() - started
+        # Даем отработать отложенным ответам (подтверждения альбомов и т.п.)
+        await asyncio.sleep(args.settle)
+
+    await api.stop()
+
+    chats = transcripts(api)
+    return {
+        'params': vars(args),
+        'updates': harness.updates_sent,
+        'recorded_seconds': round(entries[-1][0] - entries[0][0], 3),
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(harness.updates_sent / elapsed, 1) if elapsed else None,
+        'flows': latency_summary(harness),
+        'api_calls': dict(api.calls_by_method),
+        **db_report(lock_counter),
+        'transcripts': chats,
+        'transcripts_digest': hashlib.sha1(json.dumps(chats, sort_keys=True).encode()).hexdigest(),
+    }
+
+
+# Пример: python -m bench.replay --log data/updates.ndjson --db backup.db --speed 10 --output new.json
+#         python -m bench.replay --log data/updates.ndjson --db backup.db --speed 0 --baseline old.json
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов против фейкового Bot API")
+    parser.add_argument('--log', required=True, help="NDJSON, записанный при UPDATE_LOG_PATH")
+    parser.add_argument('--db', help="снимок базы на момент начала записи (копируется)")
+    parser.add_argument('--speed', type=float, default=1.0, help="ускорение; 0 - без пауз")
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--admins', help="id администраторов через запятую (по умолчанию из config)")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--step-timeout', type=float, default=30.0)
+    parser.add_argument('--settle', type=float, default=2.0)
+    parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="допустимый рост p95")
+    parser.add_argument('--output')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    result = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline) as f:
+            result['comparison'] = compare(json.load(f), result, args.tolerance)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    summary = {key: result[key] for key in ('updates', 'seconds', 'updates_per_sec', 'transcripts_digest')}
+    if 'comparison' in result:
+        summary['regressions'] = result['comparison']['regressions']
+        summary['changed_chats'] = len(result['comparison']['changed_chats'])
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if summary.get('regressions') or summary.get('changed_chats'):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -8,13 +9,38 @@ from telegram.ext import (
     ConversationHandler,
     filters,
     ContextTypes,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    TypeHandler
 )
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
+from zoneinfo import ZoneInfo
 import os
+import re
+import time
+import config
 from config import ADMIN_IDS, BOT_TOKEN
 from telegram import InputMediaPhoto, InputMediaVideo
+from db_backup import run_backup
+from media_archive import MediaArchiver
+from loop_monitor import LoopMonitor
+from update_log import UpdateRecorder
+from sessions import FlowConversationHandler, sweep_sessions, touch_session
+from notifications import NotificationQueue
+from profiles import profile_cached, save_profile
+from driver_cache import DriverCache
+from report_pages import ReportPageCache
+from metrics import InstrumentedRequest, TimedConnection, instrument_conversation, instrument_job, start_metrics_server
+import sql_stats
+from fleet_import import import_fleet
+import task_templates
+from captions import CAPTION_LIMIT, MESSAGE_LIMIT, CaptionCache, fit_caption
+from rows import (
+    Check, Comment, Driver, DriverContext, DriverTask, Media, RenderedReport, Report, ReportPage, Task, Truck,
+    factory, typed_cursor,
+)
+from report_archive import archive_old_reports, attach_archives, find_report_schema, prepare_archive_summary
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,6 +49,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
+
+# Дополнительные настройки (можно переопределить в config.py)
+DIGEST_INTERVAL = getattr(config, 'DIGEST_INTERVAL', 300)
+DIGEST_MAX_TRUCKS = getattr(config, 'DIGEST_MAX_TRUCKS', 20)
+MEDIA_GROUP_DEBOUNCE = getattr(config, 'MEDIA_GROUP_DEBOUNCE', 1.5)
+MEDIA_ARCHIVE_DIR = getattr(config, 'MEDIA_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'data', 'media'))
+MEDIA_ARCHIVE_INTERVAL = getattr(config, 'MEDIA_ARCHIVE_INTERVAL', 900)
+MEDIA_ARCHIVE_WORKERS = getattr(config, 'MEDIA_ARCHIVE_WORKERS', 4)
+# Часовой пояс для отображения времени: имя зоны (например, 'Asia/Almaty')
+# или смещение от UTC в часах, если TIMEZONE не задан
+TIMEZONE = getattr(config, 'TIMEZONE', None)
+TIMEZONE_OFFSET_HOURS = getattr(config, 'TIMEZONE_OFFSET_HOURS', 6)
+BACKFILL_BATCH_SIZE = getattr(config, 'BACKFILL_BATCH_SIZE', 5000)
+# Проверенные отчеты старше ARCHIVE_RETENTION_DAYS переносятся в архивные базы
+ARCHIVE_DIR = getattr(config, 'ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'data', 'archive'))
+ARCHIVE_RETENTION_DAYS = getattr(config, 'ARCHIVE_RETENTION_DAYS', 180)
+ARCHIVE_INTERVAL = getattr(config, 'ARCHIVE_INTERVAL', 24 * 60 * 60)
+ARCHIVE_VACUUM_PAGES = getattr(config, 'ARCHIVE_VACUUM_PAGES', 2000)
+BACKUP_DIR = getattr(config, 'BACKUP_DIR', os.path.join(os.path.dirname(__file__), 'data', 'backups'))
+BACKUP_INTERVAL = getattr(config, 'BACKUP_INTERVAL', 6 * 60 * 60)
+BACKUP_KEEP = getattr(config, 'BACKUP_KEEP', 7)
+BACKUP_PAGES_PER_STEP = getattr(config, 'BACKUP_PAGES_PER_STEP', 256)
+BACKUP_STEP_SLEEP = getattr(config, 'BACKUP_STEP_SLEEP', 0.05)
+# Сколько раз копирование может начаться заново из-за записи в базу и сколько
+# секунд оно может длиться, прежде чем база будет скопирована за один шаг
+BACKUP_MAX_RESTARTS = getattr(config, 'BACKUP_MAX_RESTARTS', 3)
+BACKUP_MAX_SECONDS = getattr(config, 'BACKUP_MAX_SECONDS', 10 * 60)
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (None - выключено)
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')
+METRICS_PORT = getattr(config, 'METRICS_PORT', 9100)
+# Запросы дольше порога (в секундах) пишутся в лог вместе с EXPLAIN QUERY PLAN
+SLOW_QUERY_THRESHOLD = getattr(config, 'SLOW_QUERY_THRESHOLD', 0.05)
+# Блокировки event loop дольше порога (в секундах) пишутся в лог со стеком
+LOOP_LAG_THRESHOLD = getattr(config, 'LOOP_LAG_THRESHOLD', 0.25)
+# Запись входящих апдейтов (с обезличенными именами) для bench/replay.py; None - выключено
+UPDATE_LOG_PATH = getattr(config, 'UPDATE_LOG_PATH', None)
+# Незавершенный отчет или правка (TIMED_STATES) сбрасывается через
+# CONVERSATION_TIMEOUT секунд простоя, а данные сессии удаляются через
+# SESSION_IDLE_TIMEOUT (должен быть больше). В меню разговор не сбрасывается
+CONVERSATION_TIMEOUT = getattr(config, 'CONVERSATION_TIMEOUT', 30 * 60)
+SESSION_IDLE_TIMEOUT = getattr(config, 'SESSION_IDLE_TIMEOUT', 6 * 60 * 60)
+SESSION_SWEEP_INTERVAL = getattr(config, 'SESSION_SWEEP_INTERVAL', 10 * 60)
+# Ограничения на файл импорта фур и задач (CSV/XLSX)
+IMPORT_MAX_ROWS = getattr(config, 'IMPORT_MAX_ROWS', 50000)
+IMPORT_MAX_FILE_SIZE = getattr(config, 'IMPORT_MAX_FILE_SIZE', 20 * 1024 * 1024)
+# Скорость отправки уведомлений водителям (сообщений в секунду на бота)
+NOTIFY_RATE = getattr(config, 'NOTIFY_RATE', 25)
+# Сколько ожидающих отчетов и групп (фура, день) показывать на экране проверки
+REVIEW_PAGE_SIZE = getattr(config, 'REVIEW_PAGE_SIZE', 10)
+# Открытый администратором отчет закреплен за ним на REVIEW_LEASE_SECONDS,
+# другие администраторы его не видят и не могут открыть
+REVIEW_LEASE_SECONDS = getattr(config, 'REVIEW_LEASE_SECONDS', 10 * 60)
+# Кэш фуры и задач водителя для его главного экрана; TTL - на случай правок базы вручную
+DRIVER_CACHE_SIZE = getattr(config, 'DRIVER_CACHE_SIZE', 10000)
+DRIVER_CACHE_TTL = getattr(config, 'DRIVER_CACHE_TTL', 10 * 60)
+# Кэш готовых страниц отчетов фуры: число страниц и примерный объем текста в байтах
+REPORT_PAGE_CACHE_SIZE = getattr(config, 'REPORT_PAGE_CACHE_SIZE', 1000)
+REPORT_PAGE_CACHE_BYTES = getattr(config, 'REPORT_PAGE_CACHE_BYTES', 16 * 1024 * 1024)
+# Пулы соединений с Bot API: getUpdates держит одно соединение в long polling,
+# отправка сообщений и альбомов идет через отдельный пул
+TELEGRAM_POOL_SIZE = getattr(config, 'TELEGRAM_POOL_SIZE', 32)
+TELEGRAM_POLLING_POOL_SIZE = getattr(config, 'TELEGRAM_POLLING_POOL_SIZE', 1)
+# Сколько секунд держать простаивающее соединение открытым
+TELEGRAM_KEEPALIVE_EXPIRY = getattr(config, 'TELEGRAM_KEEPALIVE_EXPIRY', 30.0)
+# Таймауты запросов, секунды. POOL - ожидание свободного соединения,
+# MEDIA_WRITE - отправка фото и альбомов
+TELEGRAM_CONNECT_TIMEOUT = getattr(config, 'TELEGRAM_CONNECT_TIMEOUT', 5.0)
+TELEGRAM_READ_TIMEOUT = getattr(config, 'TELEGRAM_READ_TIMEOUT', 5.0)
+TELEGRAM_WRITE_TIMEOUT = getattr(config, 'TELEGRAM_WRITE_TIMEOUT', 5.0)
+TELEGRAM_POOL_TIMEOUT = getattr(config, 'TELEGRAM_POOL_TIMEOUT', 10.0)
+TELEGRAM_MEDIA_WRITE_TIMEOUT = getattr(config, 'TELEGRAM_MEDIA_WRITE_TIMEOUT', 20.0)
+# HTTP/2 требует пакета h2 (pip install "httpx[http2]"), без него - HTTP/1.1
+TELEGRAM_HTTP2 = getattr(config, 'TELEGRAM_HTTP2', False)
+
 # Состояния бота
 (
     ADMIN_MENU, TRUCK_MENU, DRIVER_MENU, TASK_MENU, REPORT_MENU,
@@ -30,17 +131,33 @@ logger = logging.getLogger(__name__)
     VIEW_TRUCK_REPORTS, SELECT_TRUCK_FOR_ASSIGNMENT, SELECT_DRIVER_FOR_TRUCK, MANAGE_DRIVERS,
     DELETE_DRIVER, CONFIRM_DELETE_DRIVER, REVIEW_REPORTS, APPROVE_REPORT,
     MULTI_PHOTO_UPLOAD, WAITING_MORE_PHOTOS, TASK_PROOF, SKIP_REASON, TASK_COMMENT, 
-    VIEW_TRUCK_REPORTS_DETAILS, TASK_DESCRIPTION, WAITING_COMMENT, DELETE_TRUCK, CONFIRM_DELETE_TRUCK
-) = range(29)
+    VIEW_TRUCK_REPORTS_DETAILS, TASK_DESCRIPTION, WAITING_COMMENT, DELETE_TRUCK, CONFIRM_DELETE_TRUCK,
+    IMPORT_FLEET, TEMPLATE_MENU, TEMPLATE_EDIT
+) = range(32)
+
+# Состояния с черновиком в user_data: только в них разговор завершается по таймауту
+TIMED_STATES = (
+    TASK_PROOF, SKIP_REASON, TASK_COMMENT, MULTI_PHOTO_UPLOAD, WAITING_MORE_PHOTOS, WAITING_COMMENT,
+    ADD_TRUCK, TASK_DESCRIPTION, TEMPLATE_MENU, TEMPLATE_EDIT, IMPORT_FLEET,
+    REVIEW_REPORTS, APPROVE_REPORT
+)
+
+def get_connection(timeout=5.0):
+    return sqlite3.connect(DB_PATH, timeout=timeout, factory=TimedConnection)
 
 def init_db():
-    db_dir = os.path.join(os.path.dirname(__file__), 'data')
-    os.makedirs(db_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     
-    db_path = os.path.join(db_dir, 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
 
+    # Нужен для возврата места после архивации без полного VACUUM.
+    # Для существующей базы режим включается однократным VACUUM при запуске.
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+        logger.info("Включен режим auto_vacuum = INCREMENTAL")
 
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS trucks (
@@ -48,9 +165,16 @@ def init_db():
         truck_number TEXT UNIQUE NOT NULL,
         model TEXT,
         year INTEGER,
-        status TEXT DEFAULT 'active'
+        status TEXT DEFAULT 'active',
+        reports_version INTEGER DEFAULT 0
     )
     ''')
+    cursor.execute("PRAGMA table_info(trucks)")
+    columns = [column[1] for column in cursor.fetchall()]
+    # Версия данных отчетов фуры для кэша страниц (REPORT_PAGES)
+    if 'reports_version' not in columns:
+        cursor.execute('ALTER TABLE trucks ADD COLUMN reports_version INTEGER DEFAULT 0')
+        logger.info("Добавлен столбец reports_version в таблицу trucks")
     
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS drivers (
@@ -70,7 +194,51 @@ def init_db():
         description TEXT NOT NULL,
         frequency TEXT,
         is_active BOOLEAN DEFAULT 1,
-        FOREIGN KEY(truck_id) REFERENCES trucks(id)
+        template_id INTEGER,
+        adopted_active BOOLEAN,
+        FOREIGN KEY(truck_id) REFERENCES trucks(id),
+        FOREIGN KEY(template_id) REFERENCES task_templates(id)
+    )
+    ''')
+    cursor.execute("PRAGMA table_info(truck_tasks)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'template_id' not in columns:
+        cursor.execute('ALTER TABLE truck_tasks ADD COLUMN template_id INTEGER')
+        logger.info("Добавлен столбец template_id в таблицу truck_tasks")
+    # Для задач, добавленных вручную и перешедших под шаблон: была ли задача
+    # активна до этого. NULL - задачу создал сам шаблон
+    if 'adopted_active' not in columns:
+        cursor.execute('ALTER TABLE truck_tasks ADD COLUMN adopted_active BOOLEAN')
+        logger.info("Добавлен столбец adopted_active в таблицу truck_tasks")
+
+    # Шаблоны задач: общий список проверок, применяемый к нескольким фурам.
+    # truck_templates хранит, к каким фурам применен шаблон, чтобы изменения
+    # шаблона доходили до них (task_templates.sync_template)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS task_templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS task_template_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        template_id INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        frequency TEXT,
+        UNIQUE(template_id, description),
+        FOREIGN KEY(template_id) REFERENCES task_templates(id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS truck_templates (
+        truck_id INTEGER NOT NULL,
+        template_id INTEGER NOT NULL,
+        PRIMARY KEY(truck_id, template_id),
+        FOREIGN KEY(truck_id) REFERENCES trucks(id),
+        FOREIGN KEY(template_id) REFERENCES task_templates(id)
     )
     ''')
 
@@ -83,8 +251,12 @@ def init_db():
         telegram_file_id TEXT,
         file_type TEXT,
         completion_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+        completion_ts INTEGER,
         status TEXT DEFAULT 'pending',
         skipped BOOLEAN DEFAULT FALSE,
+        version INTEGER DEFAULT 0,
+        lease_owner INTEGER,
+        lease_expires INTEGER,
         FOREIGN KEY(truck_id) REFERENCES trucks(id),
         FOREIGN KEY(driver_id) REFERENCES drivers(id),
         FOREIGN KEY(task_id) REFERENCES truck_tasks(id)
@@ -98,6 +270,17 @@ def init_db():
             ADD COLUMN completion_date DATETIME DEFAULT CURRENT_TIMESTAMP
         ''')
         logger.info("Добавлен столбец completion_date в таблицу completed_checks")
+    if 'completion_ts' not in columns:
+        cursor.execute('ALTER TABLE completed_checks ADD COLUMN completion_ts INTEGER')
+        logger.info("Добавлен столбец completion_ts в таблицу completed_checks")
+    if 'version' not in columns:
+        cursor.execute('ALTER TABLE completed_checks ADD COLUMN version INTEGER DEFAULT 0')
+        logger.info("Добавлен столбец version в таблицу completed_checks")
+    # Аренда отчета на время проверки: кто из администраторов его открыл и до какого времени
+    if 'lease_owner' not in columns:
+        cursor.execute('ALTER TABLE completed_checks ADD COLUMN lease_owner INTEGER')
+        cursor.execute('ALTER TABLE completed_checks ADD COLUMN lease_expires INTEGER')
+        logger.info("Добавлены столбцы lease_owner и lease_expires в таблицу completed_checks")
     
     
     cursor.execute('''
@@ -109,10 +292,16 @@ def init_db():
         voice_message_id TEXT,
         type TEXT NOT NULL,
         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        timestamp_ts INTEGER,
         FOREIGN KEY(check_id) REFERENCES completed_checks(id),
         FOREIGN KEY(driver_id) REFERENCES drivers(id)
     )
     ''')
+    cursor.execute("PRAGMA table_info(check_comments)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'timestamp_ts' not in columns:
+        cursor.execute('ALTER TABLE check_comments ADD COLUMN timestamp_ts INTEGER')
+        logger.info("Добавлен столбец timestamp_ts в таблицу check_comments")
     
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS report_media (
@@ -120,9 +309,36 @@ def init_db():
         report_id INTEGER NOT NULL,
         file_id TEXT NOT NULL,
         file_type TEXT NOT NULL,
+        file_unique_id TEXT,
         FOREIGN KEY(report_id) REFERENCES completed_checks(id)
     )
     ''')
+    cursor.execute("PRAGMA table_info(report_media)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'file_unique_id' not in columns:
+        cursor.execute('ALTER TABLE report_media ADD COLUMN file_unique_id TEXT')
+        logger.info("Добавлен столбец file_unique_id в таблицу report_media")
+    
+    # Каталог файлов: один и тот же файл Telegram хранится один раз,
+    # use_count показывает, в скольких отчетах он встречался
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS media_catalog (
+        file_unique_id TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        file_type TEXT NOT NULL,
+        first_report_id INTEGER NOT NULL,
+        use_count INTEGER DEFAULT 1,
+        first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(first_report_id) REFERENCES completed_checks(id)
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bot_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
     
     cursor.execute('''
     CREATE INDEX IF NOT EXISTS idx_drivers_current_truck 
@@ -133,16 +349,135 @@ def init_db():
     CREATE INDEX IF NOT EXISTS idx_trucks_status 
     ON trucks(status)
     ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_completed_checks_truck_ts 
+    ON completed_checks(truck_id, completion_ts)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_completed_checks_status_ts 
+    ON completed_checks(status, completion_ts)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_completed_checks_driver_ts 
+    ON completed_checks(driver_id, completion_ts)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_check_comments_check_ts 
+    ON check_comments(check_id, timestamp_ts)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_report_media_report 
+    ON report_media(report_id)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_report_media_unique 
+    ON report_media(file_unique_id)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_truck_tasks_truck_description 
+    ON truck_tasks(truck_id, description)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_truck_tasks_template 
+    ON truck_tasks(template_id)
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_truck_templates_template 
+    ON truck_templates(template_id)
+    ''')
+
+    prepare_archive_summary(cursor, ARCHIVE_DIR)
+
+    # Любое изменение, видимое на странице отчетов фуры, увеличивает
+    # trucks.reports_version - в том числе архивация и правки в обход бота.
+    # Аренда отчета при проверке (lease_*) версию не меняет. Страница также
+    # показывает описание задачи и имя водителя, поэтому их правка и удаление
+    # задачи тоже меняют версию. Имя водителя обновляет версию фур, где есть
+    # его отчеты в основной базе: архивы из триггера недоступны.
+    for name, event, table, when, truck_ids in (
+        ('checks_insert', 'AFTER INSERT', 'completed_checks', '', 'NEW.truck_id'),
+        ('checks_delete', 'AFTER DELETE', 'completed_checks', '', 'OLD.truck_id'),
+        ('checks_status', 'AFTER UPDATE OF status', 'completed_checks', '', 'NEW.truck_id'),
+        ('comments_insert', 'AFTER INSERT', 'check_comments', '',
+         'SELECT truck_id FROM completed_checks WHERE id = NEW.check_id'),
+        ('comments_delete', 'AFTER DELETE', 'check_comments', '',
+         'SELECT truck_id FROM completed_checks WHERE id = OLD.check_id'),
+        ('media_insert', 'AFTER INSERT', 'report_media', '',
+         'SELECT truck_id FROM completed_checks WHERE id = NEW.report_id'),
+        ('media_delete', 'AFTER DELETE', 'report_media', '',
+         'SELECT truck_id FROM completed_checks WHERE id = OLD.report_id'),
+        ('tasks_delete', 'AFTER DELETE', 'truck_tasks', '', 'OLD.truck_id'),
+        ('tasks_description', 'AFTER UPDATE OF description', 'truck_tasks',
+         'WHEN OLD.description IS NOT NEW.description', 'NEW.truck_id'),
+        ('drivers_name', 'AFTER UPDATE OF first_name, username', 'drivers',
+         'WHEN OLD.first_name IS NOT NEW.first_name OR OLD.username IS NOT NEW.username',
+         'SELECT DISTINCT truck_id FROM completed_checks WHERE driver_id = NEW.id'),
+    ):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reports_version_{name} {event} ON {table} {when}
+        BEGIN
+            UPDATE trucks SET reports_version = reports_version + 1 WHERE id IN ({truck_ids});
+        END
+        ''')
     conn.commit()
     conn.close()
 
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
+REPORT_TZ = ZoneInfo(TIMEZONE) if TIMEZONE else timezone(timedelta(hours=TIMEZONE_OFFSET_HOURS))
+
+@lru_cache(maxsize=4096)
+def format_minute(minute):
+    return datetime.fromtimestamp(minute * 60, REPORT_TZ).strftime('%d.%m.%Y %H:%M')
+
+def format_ts(ts):
+    if ts is None:
+        return "—"
+    return format_minute(ts // 60)
+
+# Переносит старые текстовые даты в целочисленные столбцы порциями по id,
+# чтобы не держать блокировку записи на всей таблице
+def backfill_epoch_batch(table, text_column, ts_column):
+    state_key = f"backfill_{table}_id"
+    
+    with get_connection(timeout=10) as conn:
+        cursor = conn.cursor()
+        last_id = int(get_bot_state(cursor, state_key, 0))
+        cursor.execute(f'SELECT MAX(id) FROM {table}')
+        max_id = cursor.fetchone()[0] or 0
+        if last_id >= max_id:
+            return True
+        
+        upper_id = min(last_id + BACKFILL_BATCH_SIZE, max_id)
+        cursor.execute(f'''
+        UPDATE {table}
+        SET {ts_column} = CAST(strftime('%s', {text_column}) AS INTEGER)
+        WHERE id > ? AND id <= ? AND {ts_column} IS NULL
+        ''', (last_id, upper_id))
+        set_bot_state(cursor, state_key, upper_id)
+        conn.commit()
+        return upper_id >= max_id
+
+async def backfill_epoch_columns(context: ContextTypes.DEFAULT_TYPE):
+    checks_done = backfill_epoch_batch('completed_checks', 'completion_date', 'completion_ts')
+    comments_done = backfill_epoch_batch('check_comments', 'timestamp', 'timestamp_ts')
+    if checks_done and comments_done:
+        logger.info("Перенос дат в целочисленные столбцы завершен")
+        context.job.schedule_removal()
+
 def get_trucks(only_active=True):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = typed_cursor(conn, Truck)
     
     query = 'SELECT id, truck_number, model FROM trucks'
     if only_active:
@@ -155,9 +490,8 @@ def get_trucks(only_active=True):
     return trucks
 
 def get_drivers(only_active=True):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = typed_cursor(conn, Driver)
     
     query = 'SELECT id, first_name, username FROM drivers'
     if only_active:
@@ -169,10 +503,28 @@ def get_drivers(only_active=True):
     conn.close()
     return drivers
 
+# Водители вместе с номером назначенной фуры одним запросом
+def get_drivers_with_trucks(only_active=True):
+    conn = get_connection()
+    cursor = typed_cursor(conn, Driver)
+    
+    query = '''
+    SELECT d.id, d.first_name, d.username, t.truck_number
+    FROM drivers d
+    LEFT JOIN trucks t ON t.id = d.current_truck_id
+    '''
+    if only_active:
+        query += " WHERE d.status = 'active'"
+    query += ' ORDER BY d.first_name'
+    
+    cursor.execute(query)
+    drivers = cursor.fetchall()
+    conn.close()
+    return drivers
+
 def get_truck_tasks(truck_id, only_active=True):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = typed_cursor(conn, Task)
     
     query = 'SELECT id, description, is_active FROM truck_tasks WHERE truck_id = ?'
     if only_active:
@@ -184,10 +536,18 @@ def get_truck_tasks(truck_id, only_active=True):
     conn.close()
     return tasks
 
+def get_task(task_id):
+    conn = get_connection()
+    cursor = typed_cursor(conn, Task)
+    
+    cursor.execute('SELECT id, description, is_active FROM truck_tasks WHERE id = ?', (task_id,))
+    task = cursor.fetchone()
+    conn.close()
+    return task
+
 def get_driver_tasks(driver_id):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = get_connection()
+    cursor = typed_cursor(conn, DriverTask)
     
     cursor.execute('''
     SELECT tt.id, tt.description, t.truck_number 
@@ -205,62 +565,262 @@ def get_driver_tasks(driver_id):
     conn.close()
     return tasks
 
-def get_pending_reports():
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+# Фура водителя и ее активные задачи одним соединением (для DRIVER_CACHE)
+def load_driver_context(driver_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+    SELECT t.id, t.truck_number, t.model 
+    FROM trucks t
+    JOIN drivers d ON t.id = d.current_truck_id
+    WHERE d.id = ? 
+      AND d.status = 'active' 
+      AND t.status = 'active'
+    ''', (driver_id,))
+    truck = cursor.fetchone()
+    
+    context = None
+    if truck:
+        cursor = typed_cursor(conn, DriverTask)
+        cursor.execute('''
+        SELECT id, description, ? FROM truck_tasks
+        WHERE truck_id = ? AND is_active = 1
+        ORDER BY id
+        ''', (truck[1], truck[0]))
+        context = DriverContext(*truck, tuple(cursor.fetchall()))
+    conn.close()
+    return context
+
+DRIVER_CACHE = DriverCache(maxsize=DRIVER_CACHE_SIZE, ttl=DRIVER_CACHE_TTL)
+
+def get_driver_context(driver_id):
+    return DRIVER_CACHE.get(driver_id, load_driver_context)
+
+def get_driver_reports(driver_id, limit=10):
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
-    SELECT cc.id, t.truck_number, d.first_name, tt.description, cc.completion_date
+    SELECT cc.id, t.truck_number, tt.description, 
+           cc.completion_ts, cc.status
+    FROM completed_checks cc
+    JOIN trucks t ON cc.truck_id = t.id
+    JOIN truck_tasks tt ON cc.task_id = tt.id
+    WHERE cc.driver_id = ?
+    ORDER BY cc.completion_ts DESC
+    LIMIT ?
+    ''', (driver_id, limit))
+    
+    reports = cursor.fetchall()
+    conn.close()
+    return reports
+
+# Отчет свободен, если его аренда истекла или принадлежит этому администратору
+LEASE_FREE = '(lease_expires IS NULL OR lease_expires < ? OR lease_owner = ?)'
+
+# Ожидающие отчеты без отчетов, которые сейчас проверяют другие администраторы
+def get_pending_reports(limit=10, admin_id=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(f'''
+    SELECT cc.id, t.truck_number, d.first_name, tt.description, cc.completion_ts
     FROM completed_checks cc
     JOIN trucks t ON cc.truck_id = t.id
     JOIN drivers d ON cc.driver_id = d.id
     JOIN truck_tasks tt ON cc.task_id = tt.id
-    WHERE cc.status = 'pending'
-    ORDER BY cc.completion_date DESC
-    LIMIT 10
-    ''')
+    WHERE cc.status = 'pending' AND {LEASE_FREE}
+    ORDER BY cc.completion_ts DESC
+    LIMIT ?
+    ''', (int(time.time()), admin_id, limit))
     
     reports = cursor.fetchall()
     conn.close()
     return reports
 
-def get_report_media(report_id):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+# Смещение часового пояса отчетов на текущий момент: по нему отчеты
+# раскладываются по дням прямо в SQL
+def report_day_offset():
+    return int(REPORT_TZ.utcoffset(datetime.now()).total_seconds())
+
+# Ожидающие отчеты, сгруппированные по фуре и дню: (truck_id, truck_number, день, количество)
+# (отчеты, которые сейчас проверяют другие администраторы, не считаются)
+def get_pending_groups(limit=10, admin_id=None):
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-    SELECT file_id, file_type FROM report_media
+    cursor.execute(f'''
+    SELECT cc.truck_id, t.truck_number, (cc.completion_ts + ?) / 86400 AS day, COUNT(*)
+    FROM completed_checks cc
+    JOIN trucks t ON cc.truck_id = t.id
+    WHERE cc.status = 'pending' AND cc.completion_ts IS NOT NULL AND {LEASE_FREE}
+    GROUP BY cc.truck_id, day
+    ORDER BY day DESC, t.truck_number
+    LIMIT ?
+    ''', (report_day_offset(), int(time.time()), admin_id, limit))
+    
+    groups = cursor.fetchall()
+    conn.close()
+    return groups
+
+# Закрепляет отчет за администратором: report_id или, если он не указан,
+# самый свежий свободный отчет. Проверка и захват - один UPDATE, поэтому
+# два администратора не получат один и тот же отчет. Следующий отчет ищется
+# по idx_completed_checks_status_ts: просматриваются только занятые сверху.
+# Возвращает (id, version) или None, если отчет занят или уже проверен.
+def claim_report(admin_id, report_id=None):
+    now = int(time.time())
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    if report_id is None:
+        target = f'''(
+            SELECT id FROM completed_checks
+            WHERE status = 'pending' AND {LEASE_FREE}
+            ORDER BY completion_ts DESC LIMIT 1
+        )'''
+        target_params = (now, admin_id)
+    else:
+        target, target_params = '?', (report_id,)
+    
+    cursor.execute(f'''
+    UPDATE completed_checks SET lease_owner = ?, lease_expires = ?
+    WHERE id = {target} AND status = 'pending' AND {LEASE_FREE}
+    RETURNING id, version
+    ''', (admin_id, now + REVIEW_LEASE_SECONDS, *target_params, now, admin_id))
+    claimed = cursor.fetchone()
+    
+    # У администратора одновременно открыт только один отчет
+    if claimed:
+        cursor.execute('''
+        UPDATE completed_checks SET lease_owner = NULL, lease_expires = NULL
+        WHERE lease_owner = ? AND status = 'pending' AND id != ?
+        ''', (admin_id, claimed[0]))
+    conn.commit()
+    conn.close()
+    return claimed
+
+def release_reports(admin_id):
+    conn = get_connection()
+    conn.execute('''
+    UPDATE completed_checks SET lease_owner = NULL, lease_expires = NULL
+    WHERE lease_owner = ? AND status = 'pending'
+    ''', (admin_id,))
+    conn.commit()
+    conn.close()
+
+# Меняет статус всех ожидающих отчетов, подходящих под условие, одним UPDATE.
+# Отчеты, которые проверяет другой администратор, не затрагиваются.
+# Возвращает (driver_id, truck_number, description) измененных отчетов.
+def set_reports_status(status, condition, params, admin_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(f'''
+    UPDATE completed_checks
+    SET status = ?, version = version + 1, lease_owner = NULL, lease_expires = NULL
+    WHERE status = 'pending' AND {LEASE_FREE} AND {condition}
+    RETURNING id
+    ''', (status, int(time.time()), admin_id, *params))
+    report_ids = [row[0] for row in cursor.fetchall()]
+    
+    changed = []
+    if report_ids:
+        cursor.execute(f'''
+        SELECT d.id, t.truck_number, tt.description
+        FROM completed_checks cc
+        JOIN drivers d ON cc.driver_id = d.id
+        JOIN trucks t ON cc.truck_id = t.id
+        JOIN truck_tasks tt ON cc.task_id = tt.id
+        WHERE cc.id IN ({','.join('?' * len(report_ids))})
+        ORDER BY d.id, t.truck_number, cc.completion_ts
+        ''', report_ids)
+        changed = cursor.fetchall()
+    conn.commit()
+    conn.close()
+    return changed
+
+def fetch_report_media(cursor, report_id, schema='main'):
+    if cursor.row_factory is not factory(Media):
+        cursor = typed_cursor(cursor.connection, Media)
+    cursor.execute(f'''
+    SELECT file_id, file_type FROM {schema}.report_media
     WHERE report_id = ?
     ORDER BY id
     ''', (report_id,))
+    return cursor.fetchall()
+
+def get_report_media(report_id):
+    conn = get_connection()
+    cursor = conn.cursor()
     
-    media = cursor.fetchall()
+    media = fetch_report_media(cursor, report_id)
     conn.close()
     return media
 
+def get_bot_state(cursor, key, default=None):
+    cursor.execute('SELECT value FROM bot_state WHERE key = ?', (key,))
+    row = cursor.fetchone()
+    return row[0] if row else default
+
+def set_bot_state(cursor, key, value):
+    cursor.execute('''
+    INSERT INTO bot_state (key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (key, str(value)))
+
+def get_reused_media_reports(report_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+    SELECT DISTINCT mc.first_report_id
+    FROM report_media rm
+    JOIN media_catalog mc ON mc.file_unique_id = rm.file_unique_id
+    WHERE rm.report_id = ? AND mc.first_report_id != rm.report_id
+    ORDER BY mc.first_report_id
+    ''', (report_id,))
+    
+    reports = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return reports
+
+def reused_media_note(report_id):
+    reports = get_reused_media_reports(report_id)
+    if not reports:
+        return ""
+    return "♻️ Файлы уже отправлялись в отчетах: " + ", ".join(f"#{r}" for r in reports) + "\n"
+
+def store_report_media(cursor, report_id, media):
+    cursor.executemany('''
+        INSERT INTO report_media 
+        (report_id, file_id, file_type, file_unique_id)
+        VALUES (?, ?, ?, ?)
+    ''', [(report_id, file_id, file_type, file_unique_id) for file_id, file_type, file_unique_id in media])
+    
+    # use_count - число отчетов, поэтому файл, повторенный в одном
+    # альбоме, учитывается один раз
+    unique = {}
+    for file_id, file_type, file_unique_id in media:
+        if file_unique_id:
+            unique.setdefault(file_unique_id, (file_unique_id, file_id, file_type, report_id))
+    cursor.executemany('''
+        INSERT INTO media_catalog 
+        (file_unique_id, file_id, file_type, first_report_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(file_unique_id) DO UPDATE SET use_count = use_count + 1
+    ''', list(unique.values()))
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
     logger.info(f"User {user.id} started the bot")
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT current_truck_id FROM drivers WHERE id = ?', (user.id,))
-            result = cursor.fetchone()
-            current_truck_id = result[0] if result else None
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO drivers 
-                (id, first_name, username, current_truck_id, status)
-                VALUES (?, ?, ?, ?, 'active')
-            ''', (user.id, user.first_name, user.username, current_truck_id))
-            
-            conn.commit()
+        # Обычно профиль не менялся, и /start обходится без базы
+        if not profile_cached(user):
+            with get_connection(timeout=10) as conn:
+                save_profile(conn, user)
 
     except sqlite3.OperationalError as e:
         logger.error(f"Database error: {e}")
@@ -300,6 +860,7 @@ async def show_truck_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [KeyboardButton("➕ Добавить фуру"), KeyboardButton("📋 Список фур")],
         [KeyboardButton("👥 Назначить водителя"), KeyboardButton("🗑 Удалить фуру")],
+        [KeyboardButton("📥 Импорт из файла")],
         [KeyboardButton("🔙 Назад")]
     ]
     
@@ -363,8 +924,7 @@ async def complete_truck_deletion(update: Update, context: ContextTypes.DEFAULT_
     
     truck_id = int(query.data.split('_')[-1])
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -378,6 +938,7 @@ async def complete_truck_deletion(update: Update, context: ContextTypes.DEFAULT_
         
         # Удаляем связанные задачи
         cursor.execute('DELETE FROM truck_tasks WHERE truck_id = ?', (truck_id,))
+        cursor.execute('DELETE FROM truck_templates WHERE truck_id = ?', (truck_id,))
         
         # Обнуляем current_truck_id у водителей
         cursor.execute('''
@@ -390,6 +951,7 @@ async def complete_truck_deletion(update: Update, context: ContextTypes.DEFAULT_
         cursor.execute('DELETE FROM trucks WHERE id = ?', (truck_id,))
         
         conn.commit()
+        DRIVER_CACHE.invalidate_truck(truck_id)
         
         await query.edit_message_text(
             f"✅ Фура {truck_info[0]} ({truck_info[1]}) и все связанные задачи удалены")
@@ -405,34 +967,20 @@ async def complete_truck_deletion(update: Update, context: ContextTypes.DEFAULT_
 
 async def show_driver_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT t.truck_number, t.model 
-    FROM trucks t
-    JOIN drivers d ON t.id = d.current_truck_id
-    WHERE d.id = ? 
-      AND d.status = 'active' 
-      AND t.status = 'active'
-    ''', (user_id,))
-    
-    truck = cursor.fetchone()
-    conn.close()
+    truck = get_driver_context(user_id)
     
     if not truck:
         await update.message.reply_text("❌ Вам не назначена фура. Обратитесь к администратору.")
         return ConversationHandler.END
     
-    tasks = get_driver_tasks(user_id)
+    tasks = truck.tasks
     if not tasks:
         await update.message.reply_text("✅ Все задачи выполнены!")
         return ConversationHandler.END
     
     tasks_list = "\n".join([f"• {task[1]}" for task in tasks])
     await update.message.reply_text(
-        f"🚛 Фура: {truck[0]} ({truck[1]})\n\nАктивные задачи:\n{tasks_list}",
+        f"🚛 Фура: {truck.truck_number} ({truck.model})\n\nАктивные задачи:\n{tasks_list}",
         reply_markup=ReplyKeyboardMarkup([[KeyboardButton("📸 Начать отчет")]], resize_keyboard=True)
     )
     return DRIVER_MENU
@@ -441,6 +989,7 @@ async def show_task_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [KeyboardButton("📋 Список задач"), KeyboardButton("➕ Добавить задачу")],
         [KeyboardButton("✏️ Редактировать задачи"), KeyboardButton("🗑 Удалить задачи")],
+        [KeyboardButton("🧩 Шаблоны задач")],
         [KeyboardButton("🔙 Назад")]
     ]
     
@@ -459,13 +1008,20 @@ async def show_task_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return TASK_MENU
 
+# Кнопка "Назад" под inline-списками: без ответа на callback у админа
+# крутится индикатор загрузки на кнопке
+async def back_to_task_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    return await show_task_menu(update, context)
+
 async def show_report_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
-        [KeyboardButton("📊 Отчеты по фурам")],
+        [KeyboardButton("📊 Отчеты по фурам"), KeyboardButton("📝 Проверка отчетов")],
         [KeyboardButton("🔙 Назад")]
     ]
     
-    await update.message.reply_text(
+    message = update.message or update.callback_query.message
+    await message.reply_text(
         "📊 Просмотр отчетов:",
         reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     )
@@ -510,8 +1066,7 @@ async def save_truck(update: Update, context: ContextTypes.DEFAULT_TYPE):
         truck_number = parts[0].strip()
         model = parts[1].strip()
         
-        db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('SELECT id FROM trucks WHERE truck_number = ?', (truck_number,))
@@ -541,6 +1096,53 @@ async def save_truck(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return TRUCK_MENU
 
+async def start_fleet_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Отправьте файл CSV или XLSX. Одна строка - фура и, при необходимости, одна ее задача.\n"
+        "Столбцы: номер, модель, год, задача, периодичность (первая строка может быть заголовком).\n"
+        "Существующие фуры и задачи обновляются, новые добавляются.",
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Назад")]], resize_keyboard=True)
+    )
+    return IMPORT_FLEET
+
+async def handle_fleet_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    back_markup = ReplyKeyboardMarkup([[KeyboardButton("🔙 Назад")]], resize_keyboard=True)
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await update.message.reply_text("❌ Файл слишком большой", reply_markup=back_markup)
+        return IMPORT_FLEET
+
+    try:
+        telegram_file = await document.get_file()
+        data = bytes(await telegram_file.download_as_bytearray())
+        # Разбор и запись в отдельном потоке, чтобы не блокировать event loop
+        result = await asyncio.to_thread(
+            import_fleet, DB_PATH, data, document.file_name, max_rows=IMPORT_MAX_ROWS
+        )
+        DRIVER_CACHE.clear()
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}", reply_markup=back_markup)
+        return IMPORT_FLEET
+    except Exception as e:
+        logger.error(f"Ошибка импорта {document.file_name}: {e}")
+        await update.message.reply_text(
+            "❌ Ошибка при импорте. Изменения не сохранены.", reply_markup=back_markup
+        )
+        return IMPORT_FLEET
+
+    summary = (
+        f"✅ Импорт завершен за {result['seconds']} с\n\n"
+        f"🚛 Фуры: добавлено {result['trucks_created']}, обновлено {result['trucks_updated']}\n"
+        f"📌 Задачи: добавлено {result['tasks_created']}, обновлено {result['tasks_updated']}\n"
+        f"📄 Строк принято: {result['rows']}, отклонено: {result['rejected']}"
+    )
+    if result['errors']:
+        summary += "\n\n⚠️ Отклоненные строки:\n" + "\n".join(result['errors'])
+        if result['rejected'] > len(result['errors']):
+            summary += f"\n… и еще {result['rejected'] - len(result['errors'])}"
+    await update.message.reply_text(summary, reply_markup=back_markup)
+    return TRUCK_MENU
+
 async def list_trucks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     trucks = get_trucks()
     if not trucks:
@@ -565,7 +1167,7 @@ async def assign_driver(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return TRUCK_MENU
         
         keyboard = [
-            [InlineKeyboardButton(f"{truck[1]} ({truck[2]})", callback_data=f"assign_truck_{truck[0]}")]
+            [InlineKeyboardButton(f"{truck[1]} ({truck[2]})", callback_data=f"pick_truck_{truck[0]}")]
             for truck in trucks
         ]
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_truck_menu")])
@@ -604,7 +1206,6 @@ async def select_driver_for_truck(update: Update, context: ContextTypes.DEFAULT_
             return TRUCK_MENU
         
         truck_id = int(query.data.split('_')[-1])
-        context.user_data['truck_menu_assign_truck_id'] = truck_id
         
         drivers = get_drivers()
         if not drivers:
@@ -612,7 +1213,7 @@ async def select_driver_for_truck(update: Update, context: ContextTypes.DEFAULT_
             return SELECT_TRUCK_FOR_ASSIGNMENT
         
         keyboard = [
-            [InlineKeyboardButton(f"{driver[1]} (@{driver[2]})", callback_data=f"assign_driver_{driver[0]}")]
+            [InlineKeyboardButton(f"{driver[1]} (@{driver[2]})", callback_data=f"assign_driver_{truck_id}_{driver[0]}")]
             for driver in drivers
         ]
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_assign")])
@@ -636,14 +1237,10 @@ async def confirm_assignment(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if query.data == "back_to_assign":
             return await assign_driver(update, context)
         
-        driver_id = int(query.data.split('_')[-1])
-        truck_id = context.user_data.get('truck_menu_assign_truck_id')
-        
-        if not truck_id:
-            raise KeyError("Не найден ID фуры")
+        # assign_driver_<truck_id>_<driver_id>
+        truck_id, driver_id = map(int, query.data.split('_')[-2:])
         
-        db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -667,14 +1264,14 @@ async def confirm_assignment(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         conn.commit()
         conn.close()
+        # Водитель сменил фуру, а сама фура могла стать активной для других водителей
+        DRIVER_CACHE.invalidate(driver_id)
+        DRIVER_CACHE.invalidate_truck(truck_id)
         
         await query.edit_message_text(
             f"✅ Водитель {driver[0]} (@{driver[1]}) назначен на фуру {truck[0]} ({truck[1]})"
         )
         
-        if 'truck_menu_assign_truck_id' in context.user_data:
-            del context.user_data['truck_menu_assign_truck_id']
-            
         await show_truck_menu(update, context)
         return TRUCK_MENU
         
@@ -730,8 +1327,7 @@ async def save_task_description(update: Update, context: ContextTypes.DEFAULT_TY
     truck_id = context.user_data['task_truck_id']
     description = update.message.text
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
@@ -739,6 +1335,7 @@ async def save_task_description(update: Update, context: ContextTypes.DEFAULT_TY
         (truck_id, description)
     )
     conn.commit()
+    DRIVER_CACHE.invalidate_truck(truck_id)
     
     cursor.execute('SELECT truck_number FROM trucks WHERE id = ?', (truck_id,))
     truck_number = cursor.fetchone()[0]
@@ -807,11 +1404,10 @@ async def edit_task_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await edit_tasks(update, context)
     
     task_id = int(query.data.split('_')[-1])
-    context.user_data['edit_task_id'] = task_id
     
     keyboard = [
-        [InlineKeyboardButton("Активировать", callback_data="set_active_1")],
-        [InlineKeyboardButton("Деактивировать", callback_data="set_active_0")],
+        [InlineKeyboardButton("Активировать", callback_data=f"set_active_{task_id}_1")],
+        [InlineKeyboardButton("Деактивировать", callback_data=f"set_active_{task_id}_0")],
         [InlineKeyboardButton("🔙 Назад", callback_data="back_to_edit_menu")]
     ]
     
@@ -828,11 +1424,10 @@ async def save_task_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query.data == "back_to_edit_menu":
         return await edit_tasks(update, context)
     
-    task_id = context.user_data['edit_task_id']
-    new_status = int(query.data.split('_')[-1])
+    # set_active_<task_id>_<0|1>
+    task_id, new_status = map(int, query.data.split('_')[-2:])
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
@@ -841,9 +1436,10 @@ async def save_task_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     conn.commit()
     
-    cursor.execute('SELECT description FROM truck_tasks WHERE id = ?', (task_id,))
-    task_description = cursor.fetchone()[0]
+    cursor.execute('SELECT description, truck_id FROM truck_tasks WHERE id = ?', (task_id,))
+    task_description, truck_id = cursor.fetchone()
     conn.close()
+    DRIVER_CACHE.invalidate_truck(truck_id)
     
     status_text = "активна" if new_status else "неактивна"
     await query.edit_message_text(
@@ -908,8 +1504,7 @@ async def confirm_task_deletion(update: Update, context: ContextTypes.DEFAULT_TY
     if query.data == "back_to_delete_menu":
         return await delete_tasks(update, context)
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     if query.data.startswith("delete_all_"):
@@ -920,289 +1515,617 @@ async def confirm_task_deletion(update: Update, context: ContextTypes.DEFAULT_TY
         await query.edit_message_text(f"✅ Все задачи для фуры {truck_number} удалены")
     else:
         task_id = int(query.data.split('_')[-1])
-        cursor.execute('SELECT description FROM truck_tasks WHERE id = ?', (task_id,))
-        task_description = cursor.fetchone()[0]
+        cursor.execute('SELECT description, truck_id FROM truck_tasks WHERE id = ?', (task_id,))
+        task_description, truck_id = cursor.fetchone()
         cursor.execute('DELETE FROM truck_tasks WHERE id = ?', (task_id,))
         await query.edit_message_text(f"✅ Задача удалена: {task_description}")
     
     conn.commit()
     conn.close()
+    DRIVER_CACHE.invalidate_truck(truck_id)
     
     await show_task_menu(update, context)
     return TASK_MENU
 
-async def view_truck_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    trucks = get_trucks()
-    if not trucks:
-        await update.message.reply_text("Нет зарегистрированных фур.")
-        return REPORT_MENU
-    
+async def reply_or_edit(update: Update, text, reply_markup):
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def show_templates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query and update.callback_query.data == "tpl_list":
+        await update.callback_query.answer()
+
+    conn = get_connection()
+    templates = task_templates.get_templates(conn.cursor())
+    conn.close()
+
     keyboard = [
-        [InlineKeyboardButton(f"{truck[1]} ({truck[2]})", callback_data=f"view_truck_{truck[0]}")] 
-        for truck in trucks
+        [InlineKeyboardButton(
+            f"{template.name} ({template.items} задач, {template.trucks} фур)",
+            callback_data=f"tpl_view_{template.id}"
+        )]
+        for template in templates
     ]
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_report_menu")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    if update.message:
-        await update.message.reply_text(
-            "Выберите фуру для просмотра отчетов:",
-            reply_markup=reply_markup
-        )
-    else:
-        await update.callback_query.message.reply_text(
-            "Выберите фуру для просмотра отчетов:",
-            reply_markup=reply_markup
-        )
-    
-    return VIEW_TRUCK_REPORTS
+    keyboard.append([InlineKeyboardButton("➕ Новый шаблон", callback_data="tpl_new")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_task_menu")])
 
-async def show_truck_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = "🧩 Шаблоны задач:" if templates else "Шаблонов пока нет."
+    await reply_or_edit(update, text, InlineKeyboardMarkup(keyboard))
+    return TEMPLATE_MENU
+
+async def view_template(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    logger.info(f"Callback data: {query.data}")
-    
-    truck_id = int(query.data.split('_')[-1])
-    context.user_data['current_truck_id'] = truck_id
-    context.user_data['report_offset'] = 0
-
-    await show_reports_page(update, context)
-    return VIEW_TRUCK_REPORTS_DETAILS
+    template_id = int(query.data.split('_')[-1])
 
-async def show_full_comment(update: Update, context: ContextTypes.DEFAULT_TYPE, report_id: int):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT 
-        cc.comment,
-        cc.voice_message_id,
-        strftime('%d.%m.%Y %H:%M', cc.timestamp, '+6 hours') as formatted_date
-    FROM check_comments cc
-    WHERE cc.check_id = ? AND type = 'comment'
-    ''', (report_id,))
-    
-    comment_data = cursor.fetchone()
+    template = task_templates.get_template(cursor, template_id)
+    items = task_templates.get_template_items(cursor, template_id) if template else []
     conn.close()
-    
-    if not comment_data:
-        await update.callback_query.answer("Комментарий не найден")
-        return
-    
-    message_text = f"💬 Комментарий от {comment_data[2]}:\n\n"
-    
-    if comment_data[0]:
-        message_text += f"📝 Текст: {comment_data[0]}"
-    elif comment_data[1]:
-        message_text += "🎤 Голосовое сообщение"
-    
-    if comment_data[1]:
-        await context.bot.send_voice(
-            chat_id=update.effective_chat.id,
-            voice=comment_data[1]
-        )
 
-async def show_skip_details(update: Update, context: ContextTypes.DEFAULT_TYPE, report_id: int):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT 
-        cc.comment,
-        cc.voice_message_id,
-        strftime('%d.%m.%Y %H:%M', cc.timestamp, '+6 hours') as formatted_date,
-        d.username
-    FROM check_comments cc
-    JOIN drivers d ON cc.driver_id = d.id
-    WHERE cc.check_id = ? AND type = 'skip_reason'
-    ''', (report_id,))
+    if not template:
+        await query.edit_message_text("❌ Шаблон не найден")
+        return await show_templates(update, context)
+
+    lines = [f"🧩 {template.name}", f"Применен к фурам: {template.trucks}", ""]
+    for idx, item in enumerate(items, 1):
+        frequency = f" ({item.frequency})" if item.frequency else ""
+        lines.append(f"{idx}. {item.description}{frequency}")
+    text, _ = fit_caption('\n'.join(lines), MESSAGE_LIMIT)
+
+    keyboard = [
+        [InlineKeyboardButton("🚛 Применить к выбранным фурам", callback_data=f"tpl_pick_{template_id}")],
+        [InlineKeyboardButton("🌐 Применить ко всем фурам", callback_data=f"tpl_all_{template_id}")],
+        [InlineKeyboardButton("✏️ Изменить", callback_data=f"tpl_edit_{template_id}"),
+         InlineKeyboardButton("🗑 Удалить", callback_data=f"tpl_delete_{template_id}")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="tpl_list")]
+    ]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return TEMPLATE_MENU
+
+async def edit_template(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    prompt = (
+        "Отправьте шаблон одним сообщением: в первой строке название, "
+        "далее по строке на задачу в виде «описание; периодичность».\n\n"
+        "Например:\nЕжедневный осмотр\nПроверить давление в шинах; ежедневно\nПроверить уровень масла"
+    )
+    context.user_data.pop('template_id', None)
+    if query.data.startswith('tpl_edit_'):
+        template_id = int(query.data.split('_')[-1])
+        conn = get_connection()
+        cursor = conn.cursor()
+        template = task_templates.get_template(cursor, template_id)
+        items = task_templates.get_template_items(cursor, template_id) if template else []
+        conn.close()
+        if not template:
+            await query.edit_message_text("❌ Шаблон не найден")
+            return await show_templates(update, context)
+
+        context.user_data['template_id'] = template_id
+        prompt = (
+            "Отправьте новый текст шаблона. Изменения сразу применятся ко всем фурам, "
+            "к которым он применен. Текущий шаблон:\n\n"
+            + task_templates.template_text(template.name, items)
+        )
+
+    await query.message.reply_text(
+        fit_caption(prompt, MESSAGE_LIMIT)[0],
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Назад")]], resize_keyboard=True)
+    )
+    return TEMPLATE_EDIT
+
+async def save_template(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    template_id = context.user_data.get('template_id')
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        name, items = task_templates.parse_template_text(update.message.text)
+        template_id, result = task_templates.save_template(cursor, name, items, template_id)
+        conn.commit()
+        DRIVER_CACHE.clear()
+    except ValueError as e:
+        conn.rollback()
+        await update.message.reply_text(f"❌ {e}")
+        return TEMPLATE_EDIT
+    finally:
+        conn.close()
+
+    context.user_data.pop('template_id', None)
+    await update.message.reply_text(
+        f"✅ Шаблон «{name}» сохранен ({len(items)} задач).\n"
+        f"Задачи фур: добавлено {result['added']}, обновлено {result['updated']}, "
+        f"отключено {result['removed']}"
+    )
+    return await show_templates(update, context)
+
+def template_trucks_keyboard(template_id, trucks, selected):
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{'✅' if truck.id in selected else '▫️'} {truck.truck_number} ({truck.model})",
+            callback_data=f"tpl_toggle_{truck.id}"
+        )]
+        for truck in trucks
+    ]
+    keyboard.append([InlineKeyboardButton(f"✅ Применить ({len(selected)})", callback_data=f"tpl_apply_{template_id}")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"tpl_view_{template_id}")])
+    return InlineKeyboardMarkup(keyboard)
+
+# Выбор нескольких фур: нажатие на фуру отмечает или снимает ее
+async def pick_template_trucks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if query.data.startswith('tpl_pick_'):
+        context.user_data['template_id'] = int(query.data.split('_')[-1])
+        context.user_data['template_trucks'] = set()
+    else:
+        selected = context.user_data.setdefault('template_trucks', set())
+        selected ^= {int(query.data.split('_')[-1])}
+
+    template_id = context.user_data.get('template_id')
+    if template_id is None:
+        return await show_templates(update, context)
+
+    trucks = get_trucks()
+    if not trucks:
+        await query.edit_message_text("Нет зарегистрированных фур")
+        return TEMPLATE_MENU
+
+    await query.edit_message_text(
+        "Отметьте фуры, к которым применить шаблон:",
+        reply_markup=template_trucks_keyboard(template_id, trucks, context.user_data['template_trucks'])
+    )
+    return TEMPLATE_MENU
+
+async def apply_template(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    template_id = int(query.data.split('_')[-1])
+
+    truck_ids = None
+    if query.data.startswith('tpl_apply_'):
+        truck_ids = sorted(context.user_data.get('template_trucks', ()))
+        if not truck_ids:
+            await query.answer("Не выбрано ни одной фуры", show_alert=True)
+            return TEMPLATE_MENU
+    await query.answer()
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    result = task_templates.apply_template(cursor, template_id, truck_ids)
+    conn.commit()
+    conn.close()
+    DRIVER_CACHE.clear()
+
+    context.user_data.pop('template_id', None)
+    context.user_data.pop('template_trucks', None)
+    trucks_text = "ко всем фурам" if truck_ids is None else f"к выбранным фурам ({len(truck_ids)})"
+    await query.edit_message_text(
+        f"✅ Шаблон применен {trucks_text}.\n"
+        f"Задач добавлено {result['added']}, обновлено {result['updated']}"
+    )
+    await show_task_menu(update, context)
+    return TASK_MENU
+
+async def delete_template(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    template_id = int(query.data.split('_')[-1])
+
+    if query.data.startswith('tpl_delete_'):
+        keyboard = [
+            [InlineKeyboardButton("✅ Да, удалить", callback_data=f"tpl_confirm_delete_{template_id}")],
+            [InlineKeyboardButton("❌ Нет, отменить", callback_data=f"tpl_view_{template_id}")]
+        ]
+        await query.edit_message_text(
+            "⚠️ Удалить шаблон? Созданные им задачи на фурах будут отключены, "
+            "задачи, добавленные вручную, останутся. Отчеты сохранятся.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return TEMPLATE_MENU
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    removed = task_templates.delete_template(cursor, template_id)
+    conn.commit()
+    conn.close()
+    DRIVER_CACHE.clear()
+
+    await query.message.reply_text(f"✅ Шаблон удален, отключено задач: {removed}")
+    return await show_templates(update, context)
+
+async def view_truck_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    trucks = get_trucks()
+    if not trucks:
+        await update.message.reply_text("Нет зарегистрированных фур.")
+        return REPORT_MENU
     
-    skip_data = cursor.fetchone()
+    keyboard = [
+        [InlineKeyboardButton(f"{truck[1]} ({truck[2]})", callback_data=f"view_truck_{truck[0]}")] 
+        for truck in trucks
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_report_menu")])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    if update.message:
+        await update.message.reply_text(
+            "Выберите фуру для просмотра отчетов:",
+            reply_markup=reply_markup
+        )
+    else:
+        await update.callback_query.message.reply_text(
+            "Выберите фуру для просмотра отчетов:",
+            reply_markup=reply_markup
+        )
+    
+    return VIEW_TRUCK_REPORTS
+
+async def show_truck_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    logger.info(f"Callback data: {query.data}")
+    
+    truck_id = int(query.data.split('_')[-1])
+    await show_reports_page(update, context, truck_id, 0)
+    return VIEW_TRUCK_REPORTS_DETAILS
+
+# Кнопки деталей отчета: <действие>_<id> для отчета в основной базе и
+# <действие>_<id>_a<год> для архивного, чтобы сразу открыть нужный архив
+def report_button(action, report_id, schema, completion_ts):
+    if schema == 'main' or completion_ts is None:
+        return f"{action}_{report_id}"
+    return f"{action}_{report_id}_a{datetime.fromtimestamp(completion_ts, timezone.utc).year}"
+
+def parse_report_button(data):
+    match = re.search(r'_(\d+)(?:_a(\d{4}))?$', data)
+    return int(match.group(1)), match.group(2)
+
+# Комментарий и причина пропуска ищутся там же, где лежит отчет: в основной
+# базе или в архиве
+async def show_full_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    report_id, year = parse_report_button(query.data)
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    comment_data = None
+    schema = find_report_schema(cursor, ARCHIVE_DIR, report_id, year)
+    if schema:
+        cursor.execute(f'''
+        SELECT 
+            cc.comment,
+            cc.voice_message_id,
+            cc.timestamp_ts
+        FROM {schema}.check_comments cc
+        WHERE cc.check_id = ? AND type = 'comment'
+        ''', (report_id,))
+        comment_data = cursor.fetchone()
+    conn.close()
+    
+    if not comment_data:
+        await query.answer("Комментарий не найден")
+        return
+    await query.answer()
+    
+    message_text = f"💬 Комментарий от {format_ts(comment_data[2])}:\n\n"
+    
+    if comment_data[0]:
+        message_text += f"📝 Текст: {comment_data[0]}"
+    elif comment_data[1]:
+        message_text += "🎤 Голосовое сообщение"
+    
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+    if comment_data[1]:
+        await context.bot.send_voice(
+            chat_id=update.effective_chat.id,
+            voice=comment_data[1]
+        )
+
+async def show_skip_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    report_id, year = parse_report_button(query.data)
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    skip_data = None
+    schema = find_report_schema(cursor, ARCHIVE_DIR, report_id, year)
+    if schema:
+        cursor.execute(f'''
+        SELECT 
+            cc.comment,
+            cc.voice_message_id,
+            cc.timestamp_ts,
+            d.username
+        FROM {schema}.check_comments cc
+        JOIN main.drivers d ON cc.driver_id = d.id
+        WHERE cc.check_id = ? AND type = 'skip_reason'
+        ''', (report_id,))
+        skip_data = cursor.fetchone()
     conn.close()
     
     if not skip_data:
-        await update.callback_query.answer("Причина пропуска не указана")
+        await query.answer("Причина пропуска не указана")
         return
+    await query.answer()
     
     message_text = (
-        f"⏭ Причина пропуска от @{skip_data[3]} ({skip_data[2]}):\n\n"
+        f"⏭ Причина пропуска от @{skip_data[3]} ({format_ts(skip_data[2])}):\n\n"
         f"{skip_data[0] if skip_data[0] else '🎤 Голосовое сообщение'}"
     )
     
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
     if skip_data[1]:
         await context.bot.send_voice(
             chat_id=update.effective_chat.id,
             voice=skip_data[1]
         )
 
-def has_comment(report_id):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
+def report_has_comment(cursor, schema, report_id, comment_type):
+    cursor.execute(f'''
     SELECT EXISTS(
-        SELECT 1 FROM check_comments 
-        WHERE check_id = ? AND type = 'comment'
+        SELECT 1 FROM {schema}.check_comments 
+        WHERE check_id = ? AND type = ?
     )
-    ''', (report_id,))
-    result = cursor.fetchone()[0]
-    conn.close()
-    return bool(result)
+    ''', (report_id, comment_type))
+    return bool(cursor.fetchone()[0])
 
-def has_skip_reason(report_id):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+def has_comment_type(report_id, comment_type):
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-    SELECT EXISTS(
-        SELECT 1 FROM check_comments 
-        WHERE check_id = ? AND type = 'skip_reason'
-    )
-    ''', (report_id,))
-    result = cursor.fetchone()[0]
+    schema = find_report_schema(cursor, ARCHIVE_DIR, report_id)
+    result = report_has_comment(cursor, schema, report_id, comment_type) if schema else False
     conn.close()
-    return bool(result)
+    return result
 
-async def show_reports_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    truck_id = context.user_data['current_truck_id']
-    offset = context.user_data.get('report_offset', 0)
-    
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def has_comment(report_id):
+    return has_comment_type(report_id, 'comment')
 
-    cursor.execute('''
+def has_skip_reason(report_id):
+    return has_comment_type(report_id, 'skip_reason')
+
+REPORTS_PAGE_SELECT = '''
     SELECT 
         cc.id, 
         t.truck_number,
         d.first_name,
         d.username,
         tt.description,
-        strftime('%d.%m.%Y %H:%M', cc.completion_date, '+6 hours') as formatted_date,
+        cc.completion_ts,
         cc.status,
-        cc.skipped
-    FROM completed_checks cc
-    JOIN trucks t ON cc.truck_id = t.id
-    JOIN drivers d ON cc.driver_id = d.id
-    JOIN truck_tasks tt ON cc.task_id = tt.id
+        cc.skipped,
+        tt.id AS task_id,
+        '{schema}' AS source,
+        {version} AS version
+    FROM {schema}.completed_checks cc
+    JOIN main.trucks t ON cc.truck_id = t.id
+    JOIN main.drivers d ON cc.driver_id = d.id
+    JOIN main.truck_tasks tt ON cc.task_id = tt.id
     WHERE cc.truck_id = ?
-    ORDER BY tt.id DESC, cc.completion_date DESC
-    LIMIT 5 OFFSET ?
-    ''', (truck_id, offset))
-    
-    reports = cursor.fetchall()
+'''
 
-    reports_data = []
-    for report in reports:
-        report_id = report[0]
-        
-        cursor.execute('''
+# Архивный отчет встанет на страницу раньше ее последнего отчета, только если
+# его задача старше (или та же, но отчет позже). По сводке архивов это видно
+# без подключения архивов; страница, которую основная база не заполнила,
+# дочитывается из архивов, если у фуры они есть
+def page_needs_archives(cursor, truck_id, checks, limit):
+    cursor.execute(
+        'SELECT max_task_id, max_completion_ts FROM archive_summary WHERE truck_id = ?', (truck_id,)
+    )
+    summary = cursor.fetchone()
+    if summary is None:
+        return False
+    if len(checks) < limit:
+        return True
+    last = checks[-1]
+    return summary[0] > last.task_id or (
+        summary[0] == last.task_id and (last.completion_ts is None or summary[1] >= last.completion_ts)
+    )
+
+def fetch_reports_page(cursor, truck_id, offset, limit=5):
+    check_cursor = typed_cursor(cursor.connection, Check)
+    check_cursor.execute(
+        REPORTS_PAGE_SELECT.format(schema='main', version='cc.version') + 'ORDER BY task_id DESC, completion_ts DESC LIMIT ? OFFSET ?',
+        (truck_id, limit, offset)
+    )
+    checks = check_cursor.fetchall()
+
+    # Основная база и архивы сортируются одним запросом, чтобы граница
+    # между ними не нарушала общий порядок страниц
+    if page_needs_archives(cursor, truck_id, checks, limit):
+        schemas = attach_archives(cursor, ARCHIVE_DIR)
+        check_cursor.execute(
+            ' UNION ALL '.join(
+                [REPORTS_PAGE_SELECT.format(schema='main', version='cc.version')]
+                + [REPORTS_PAGE_SELECT.format(schema=schema, version='0') for schema in schemas]
+            )
+            + ' ORDER BY task_id DESC, completion_ts DESC LIMIT ? OFFSET ?',
+            [truck_id] * (1 + len(schemas)) + [limit, offset]
+        )
+        checks = check_cursor.fetchall()
+
+    comment_cursor = typed_cursor(cursor.connection, Comment)
+    media_cursor = typed_cursor(cursor.connection, Media)
+    reports = []
+    for check in checks:
+        comment_cursor.execute(f'''
         SELECT 
             type,
             comment,
             voice_message_id,
-            strftime('%d.%m.%Y %H:%M', timestamp, '+6 hours') as formatted_date
-        FROM check_comments
+            timestamp_ts
+        FROM {check.source}.check_comments
         WHERE check_id = ?
-        ''', (report_id,))
+        ORDER BY timestamp_ts
+        ''', (check.id,))
         
-        comments = {
-            'comment': [],
-            'skip_reason': []
-        }
+        comments = []
+        skip_reasons = []
+        for comment in comment_cursor.fetchall():
+            if comment.type == 'comment':
+                comments.append(comment)
+            elif comment.type == 'skip_reason':
+                skip_reasons.append(comment)
         
-        for comment in cursor.fetchall():
-            comment_type = comment[0]
-            text = comment[1]
-            voice = comment[2]
-            timestamp = comment[3]
-            
-            if comment_type == 'comment':
-                comments['comment'].append({
-                    'text': text,
-                    'voice': voice,
-                    'time': timestamp
-                })
-            elif comment_type == 'skip_reason':
-                comments['skip_reason'].append({
-                    'text': text,
-                    'voice': voice,
-                    'time': timestamp
-                })
-        
-        reports_data.append({
-            'info': report,
-            'comments': comments
-        })
+        reports.append(Report(check, comments, skip_reasons, fetch_report_media(media_cursor, check.id, check.source)))
     
-    conn.close()
+    return reports
 
-    for report in reports_data:
-        report_info = report['info']
-        comments = report['comments']
-        report_id = report_info[0]
-        
-        caption = (
-            f"🚛 Фура: {report_info[1]}\n"
-            f"👤 Водитель: {report_info[2]} (@{report_info[3]})\n"
-            f"📌 Задача: {report_info[4]}\n"
-            f"🕒 Время проверки: {report_info[5]}\n"
-            f"🔮 Статус: {report_info[6].capitalize()}\n"
-        )
-        
-        if comments['comment']:
-            caption += "\n💬 Комментарии:\n"
-            for idx, comment in enumerate(comments['comment'], 1):
-                if comment['text']:
-                    caption += f"{idx}. 📝 {comment['text']} ({comment['time']})\n"
-                elif comment['voice']:
-                    caption += f"{idx}. 🎧 Голосовой комментарий ({comment['time']})\n"
-        
-        if comments['skip_reason']:
-            caption += "\n⏭ Причины пропуска:\n"
-            for idx, reason in enumerate(comments['skip_reason'], 1):
-                if reason['text']:
-                    caption += f"{idx}. 📝 {reason['text']} ({reason['time']})\n"
-                elif reason['voice']:
-                    caption += f"{idx}. 🎧 Голосовое объяснение ({reason['time']})\n"
-
-        media = get_report_media(report_id)
-        
-        if media:
+# Шаблоны подписей - f-строки, которые Python компилирует один раз при
+# загрузке модуля (в 3 раза быстрее str.format); подпись собирается одним join
+def page_caption_header(truck, driver, username, task, time_text, status):
+    return (
+        f"🚛 Фура: {truck}\n"
+        f"👤 Водитель: {driver} (@{username})\n"
+        f"📌 Задача: {task}\n"
+        f"🕒 Время проверки: {time_text}\n"
+        f"🔮 Статус: {status}\n"
+    )
+
+def review_caption_header(truck, driver, username, task, time_text):
+    return (
+        f"🚛 Фура: {truck}\n"
+        f"👤 Водитель: {driver} (@{username})\n"
+        f"📝 Проверка: {task}\n"
+        f"🕒 Дата: {time_text}"
+    )
+
+def comment_line(idx, text, time_text):
+    return f"{idx}. 📝 {text} ({time_text})\n"
+
+def voice_comment_line(idx, time_text):
+    return f"{idx}. 🎧 Голосовой комментарий ({time_text})\n"
+
+def voice_skip_reason_line(idx, time_text):
+    return f"{idx}. 🎧 Голосовое объяснение ({time_text})\n"
+
+CAPTION_CACHE = CaptionCache()
+
+def comment_lines(parts, title, comments, voice_line):
+    if not comments:
+        return
+    parts.append(title)
+    for idx, comment in enumerate(comments, 1):
+        if comment.text:
+            parts.append(comment_line(idx, comment.text, format_ts(comment.timestamp_ts)))
+        elif comment.voice_message_id:
+            parts.append(voice_line(idx, format_ts(comment.timestamp_ts)))
+
+def format_report_caption(report, note=''):
+    check = report.check
+    parts = [
+        page_caption_header(
+            check.truck_number, check.first_name, check.username, check.description,
+            format_ts(check.completion_ts), check.status.capitalize()
+        ),
+        note,
+    ]
+    comment_lines(parts, "\n💬 Комментарии:\n", report.comments, voice_comment_line)
+    comment_lines(parts, "\n⏭ Причины пропуска:\n", report.skip_reasons, voice_skip_reason_line)
+    return ''.join(parts)
+
+def format_single_caption(report, note=''):
+    # Та же шапка, что на странице отчетов, без завершающего перевода строки
+    parts = [page_caption_header(
+        report[1], report[2], report[3], report[4], format_ts(report[5]), report[6].capitalize()
+    )[:-1]]
+    if note:
+        parts.append("\n" + note)
+    return ''.join(parts)
+
+def format_review_caption(report_info, note=''):
+    parts = [review_caption_header(
+        report_info[0], report_info[1], report_info[2], report_info[3], format_ts(report_info[4])
+    )]
+    if note:
+        parts.append("\n" + note)
+    return ''.join(parts)
+
+# Готовая подпись (в пределах лимита) и сообщения с продолжением.
+# Кэш по (вид, id отчета, версия): повторный показ отчета не пересобирает текст.
+# Версия - (completed_checks.version, trucks.reports_version): подпись содержит
+# имя водителя и описание задачи, а их правку отмечают триггеры reports_version.
+def report_caption(view, report_id, version, note, render, limit=CAPTION_LIMIT):
+    return CAPTION_CACHE.get_or_render((view, report_id, version, note, limit), render, limit)
+
+async def send_caption_overflow(context: ContextTypes.DEFAULT_TYPE, chat_id, overflow):
+    for text in overflow:
+        await context.bot.send_message(chat_id=chat_id, text=text)
+
+REPORT_PAGES = ReportPageCache(maxsize=REPORT_PAGE_CACHE_SIZE, max_bytes=REPORT_PAGE_CACHE_BYTES)
+
+def render_report(report):
+    # Подпись собирается без CAPTION_CACHE: повторные показы страницы берутся
+    # из REPORT_PAGES, а version отчета не меняется при новом комментарии
+    note = reused_media_note(report.check.id)
+    caption, overflow = fit_caption(
+        format_report_caption(report, note), CAPTION_LIMIT if report.media else MESSAGE_LIMIT
+    )
+    voices = tuple(
+        (comment.voice_message_id,
+         f"🎧 {comment_type.replace('_', ' ').capitalize()} ({format_ts(comment.timestamp_ts)})")
+        for comment_type, comments in (('comment', report.comments), ('skip_reason', report.skip_reasons))
+        for comment in comments
+        if comment.voice_message_id
+    )
+    return RenderedReport(caption, overflow, tuple(report.media), voices)
+
+# Страница из кэша, если с прошлого показа у фуры не менялись отчеты
+def get_reports_page(truck_id, offset):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT reports_version FROM trucks WHERE id = ?', (truck_id,))
+    row = cursor.fetchone()
+
+    def render():
+        # Шестой отчет только показывает, есть ли следующая страница
+        reports = fetch_reports_page(cursor, truck_id, offset, limit=6)
+        return ReportPage(tuple(render_report(report) for report in reports[:5]), len(reports) > 5)
+
+    try:
+        return REPORT_PAGES.get(truck_id, offset, row[0] if row else None, render)
+    finally:
+        conn.close()
+
+# Фура и смещение страницы передаются в кнопках листания (rp_<truck_id>_<offset>),
+# поэтому нажатие обработает любой процесс бота, даже после перезапуска
+async def show_reports_page(update: Update, context: ContextTypes.DEFAULT_TYPE, truck_id, offset):
+    page = get_reports_page(truck_id, offset)
+
+    for report in page.reports:
+        if report.media:
             media_group = []
-            for idx, media_item in enumerate(media):
-                if idx == 0:
-                    media_group.append(InputMediaPhoto(media=media_item[0], caption=caption) if media_item[1] == 'photo' else InputMediaVideo(media=media_item[0], caption=caption))
-                else:
-                    media_group.append(InputMediaPhoto(media=media_item[0]) if media_item[1] == 'photo' else InputMediaVideo(media=media_item[0]))
+            for idx, media_item in enumerate(report.media):
+                caption = report.caption if idx == 0 else None
+                media_group.append(InputMediaPhoto(media=media_item.file_id, caption=caption) if media_item.file_type == 'photo' else InputMediaVideo(media=media_item.file_id, caption=caption))
             
             await context.bot.send_media_group(
                 chat_id=update.effective_chat.id,
                 media=media_group
             )
             
-        for comment_type in ['comment', 'skip_reason']:
-            for comment in comments[comment_type]:
-                if comment['voice']:
-                    await context.bot.send_voice(
-                        chat_id=update.effective_chat.id,
-                        voice=comment['voice'],
-                        caption=f"🎧 {comment_type.replace('_', ' ').capitalize()} ({comment['time']})"
-                    )
-        else:
-            await context.bot.send_message(
+        for voice, caption in report.voices:
+            await context.bot.send_voice(
                 chat_id=update.effective_chat.id,
-                text=caption
+                voice=voice,
+                caption=caption
             )
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=report.caption
+        )
+        await send_caption_overflow(context, update.effective_chat.id, report.overflow)
 
     nav_buttons = []
     if offset > 0:
-        nav_buttons.append(InlineKeyboardButton("⬅️ Предыдущие", callback_data="prev_page"))
-    if len(reports) == 5:
-        nav_buttons.append(InlineKeyboardButton("Следующие ➡️", callback_data="next_page"))
+        nav_buttons.append(InlineKeyboardButton("⬅️ Предыдущие", callback_data=f"rp_{truck_id}_{max(0, offset - 5)}"))
+    if page.has_next:
+        nav_buttons.append(InlineKeyboardButton("Следующие ➡️", callback_data=f"rp_{truck_id}_{offset + 5}"))
     
     if nav_buttons:
         await context.bot.send_message(
@@ -1214,50 +2137,59 @@ async def show_reports_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return VIEW_TRUCK_REPORTS_DETAILS
 
 async def show_single_report(update: Update, context: ContextTypes.DEFAULT_TYPE, report_id: int):
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute('''
-    SELECT 
-        cc.id, 
-        t.truck_number,
-        d.first_name,
-        d.username,
-        tt.description,
-        strftime('%d.%m.%Y %H:%M', cc.completion_date, '+6 hours') as formatted_date,
-        cc.status,
-        cc.skipped
-    FROM completed_checks cc
-    JOIN trucks t ON cc.truck_id = t.id
-    JOIN drivers d ON cc.driver_id = d.id
-    JOIN truck_tasks tt ON cc.task_id = tt.id
-    WHERE cc.id = ?
-    ''', (report_id,))
-    
-    report = cursor.fetchone()
+    report = None
+    media = []
+    schema = find_report_schema(cursor, ARCHIVE_DIR, report_id)
+    if schema:
+        # У архивных отчетов нет версии - они уже не меняются
+        cursor.execute(f'''
+        SELECT 
+            cc.id, 
+            t.truck_number,
+            d.first_name,
+            d.username,
+            tt.description,
+            cc.completion_ts,
+            cc.status,
+            cc.skipped,
+            {'cc.version' if schema == 'main' else '0'},
+            cc.truck_id,
+            t.reports_version
+        FROM {schema}.completed_checks cc
+        JOIN main.trucks t ON cc.truck_id = t.id
+        JOIN main.drivers d ON cc.driver_id = d.id
+        JOIN main.truck_tasks tt ON cc.task_id = tt.id
+        WHERE cc.id = ?
+        ''', (report_id,))
+        report = cursor.fetchone()
+        media = fetch_report_media(cursor, report_id, schema)
+        commented = report_has_comment(cursor, schema, report_id, 'comment')
     conn.close()
 
     if not report:
         await update.callback_query.answer("Отчет не найден")
         return
 
-    media = get_report_media(report_id)
-    caption = (
-        f"🚛 Фура: {report[1]}\n"
-        f"👤 Водитель: {report[2]} (@{report[3]})\n"
-        f"📌 Задача: {report[4]}\n"
-        f"🕒 Время проверки: {report[5]}\n"
-        f"🔮 Статус: {report[6].capitalize()}"
+    note = reused_media_note(report_id)
+    caption, overflow = report_caption(
+        'single', report_id, (report[8], report[10]), note,
+        lambda: format_single_caption(report, note),
+        CAPTION_LIMIT if media else MESSAGE_LIMIT
     )
 
-    keyboard = []
-    if has_comment(report_id):
-        keyboard.append(InlineKeyboardButton("💬 Показать комментарий", callback_data=f"comment_{report_id}"))
+    details = []
+    if commented:
+        details.append(InlineKeyboardButton(
+            "💬 Показать комментарий", callback_data=report_button('comment', report_id, schema, report[5])))
     if report[7]:
-        keyboard.append(InlineKeyboardButton("⏭ Причина пропуска", callback_data=f"skip_reason_{report_id}"))
+        details.append(InlineKeyboardButton(
+            "⏭ Причина пропуска", callback_data=report_button('skip_reason', report_id, schema, report[5])))
     
-    keyboard.append([InlineKeyboardButton("🔙 К списку отчетов", callback_data="back_to_reports")])
+    keyboard = [details] if details else []
+    keyboard.append([InlineKeyboardButton("🔙 К списку отчетов", callback_data=f"rp_{report[9]}_0")])
 
     if media:
         media_group = []
@@ -1276,11 +2208,12 @@ async def show_single_report(update: Update, context: ContextTypes.DEFAULT_TYPE,
             chat_id=update.effective_chat.id,
             text=caption
         )
+    await send_caption_overflow(context, update.effective_chat.id, overflow)
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Дополнительные действия:",
-        reply_markup=InlineKeyboardMarkup([keyboard])
+        reply_markup=InlineKeyboardMarkup(keyboard)
     )
     return VIEW_TRUCK_REPORTS_DETAILS
 
@@ -1288,59 +2221,160 @@ async def handle_report_details(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    if query.data == "back_to_reports":
-        await show_reports_page(update, context)
-        return VIEW_TRUCK_REPORTS_DETAILS
-    
-    if query.data in ["prev_page", "next_page"]:
-        if query.data == "prev_page":
-            context.user_data['report_offset'] = max(0, context.user_data['report_offset'] - 5)
-        else:
-            context.user_data['report_offset'] += 5
-        
-        await show_reports_page(update, context)
-    
+    # rp_<truck_id>_<offset>
+    truck_id, offset = map(int, query.data.split('_')[-2:])
+    await show_reports_page(update, context, truck_id, offset)
     return VIEW_TRUCK_REPORTS_DETAILS
 
-async def review_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    reports = get_pending_reports()
+async def review_reports(update: Update, context: ContextTypes.DEFAULT_TYPE, notice=''):
+    if update.callback_query and update.callback_query.data in ("rv_list", "back_to_review"):
+        await update.callback_query.answer()
+        if update.callback_query.data == "back_to_review":
+            release_reports(update.effective_user.id)
+    
+    reports = get_pending_reports(REVIEW_PAGE_SIZE, update.effective_user.id)
+    selected = context.user_data.setdefault('review_selected', set())
+    selected &= {report[0] for report in reports}
+    
     if not reports:
-        await update.message.reply_text("Нет отчетов, ожидающих проверки.")
-        return REPORT_MENU
+        text = f"{notice}\n\nНет отчетов, ожидающих проверки." if notice else "Нет отчетов, ожидающих проверки."
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_report_menu")]]
+        await reply_or_edit(update, text, InlineKeyboardMarkup(keyboard))
+        return REVIEW_REPORTS
     
+    # Слева отметка для массовых действий, справа - открыть отчет
     keyboard = []
     for report in reports:
-        keyboard.append([InlineKeyboardButton(
-            f"{report[4].split('.')[0]} - {report[1]} - {report[3]}",
-            callback_data=f"review_report_{report[0]}")
+        keyboard.append([
+            InlineKeyboardButton("☑️" if report[0] in selected else "⬜", callback_data=f"rv_toggle_{report[0]}"),
+            InlineKeyboardButton(
+                f"{format_ts(report[4])} - {report[1]} - {report[3]}",
+                callback_data=f"review_report_{report[0]}")
         ])
     
+    keyboard.append([
+        InlineKeyboardButton("▶️ Следующий отчет", callback_data="rv_next"),
+        InlineKeyboardButton("☑️ Выбрать все", callback_data="rv_select_all")
+    ])
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Одобрить ({len(selected)})", callback_data="rv_approve_sel"),
+            InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data="rv_reject_sel")
+        ])
+    keyboard.append([InlineKeyboardButton("📦 По фурам и дням", callback_data="rv_groups")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_report_menu")])
     
-    await update.message.reply_text(
-        "Отчеты, ожидающие проверки:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    text = "Отчеты, ожидающие проверки:"
+    if notice:
+        text = f"{notice}\n\n{text}"
+    await reply_or_edit(update, text, InlineKeyboardMarkup(keyboard))
     return REVIEW_REPORTS
 
-async def show_report_for_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def toggle_review_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
+    selected = context.user_data.setdefault('review_selected', set())
+    if query.data == "rv_select_all":
+        page_ids = {report[0] for report in get_pending_reports(REVIEW_PAGE_SIZE, update.effective_user.id)}
+        if page_ids <= selected:
+            return REVIEW_REPORTS
+        selected |= page_ids
+    else:
+        selected ^= {int(query.data.split('_')[-1])}
+    return await review_reports(update, context)
+
+async def review_groups(update: Update, context: ContextTypes.DEFAULT_TYPE, notice=''):
+    if update.callback_query.data == "rv_groups":
+        await update.callback_query.answer()
+    
+    groups = get_pending_groups(REVIEW_PAGE_SIZE, update.effective_user.id)
+    keyboard = []
+    for truck_id, truck_number, day, count in groups:
+        label = datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%d.%m.%Y')
+        keyboard.append([
+            InlineKeyboardButton(f"✅ {truck_number} · {label} ({count})", callback_data=f"rv_ga_{truck_id}_{day}"),
+            InlineKeyboardButton("❌", callback_data=f"rv_gr_{truck_id}_{day}")
+        ])
+    keyboard.append([InlineKeyboardButton("🔙 К списку отчетов", callback_data="rv_list")])
+    
+    text = "Одобрить (✅) или отклонить (❌) все отчеты фуры за день:" if groups else "Нет отчетов, ожидающих проверки."
+    if notice:
+        text = f"{notice}\n\n{text}"
+    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return REVIEW_REPORTS
+
+# Одно уведомление на водителя со всеми его отчетами из массового действия
+def notify_drivers(context: ContextTypes.DEFAULT_TYPE, changed, status):
+    status_text = "одобрен" if status == 'approved' else "отклонен"
+    by_driver = {}
+    for driver_id, truck_number, task_description in changed:
+        by_driver.setdefault(driver_id, []).append((truck_number, task_description))
+    
+    notifications = context.application.bot_data['notifications']
+    for driver_id, reports in by_driver.items():
+        if len(reports) == 1:
+            truck_number, task_description = reports[0]
+            text = f"Ваш отчет по фуре {truck_number} ({task_description}) был {status_text} администратором."
+        else:
+            lines = [f"Ваши отчеты ({len(reports)}) были {status_text}ы администратором:"]
+            lines += [f"🚛 {truck_number}: {task_description}" for truck_number, task_description in reports]
+            text = "\n".join(lines)
+        notifications.enqueue(driver_id, text)
+
+async def handle_bulk_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    action = query.data.split('_')[1]
+    status = 'approved' if action in ('approve', 'ga') else 'rejected'
+    
+    if action in ('ga', 'gr'):
+        truck_id, day = map(int, query.data.split('_')[2:])
+        day_start = day * 86400 - report_day_offset()
+        condition = 'truck_id = ? AND completion_ts >= ? AND completion_ts < ?'
+        params = (truck_id, day_start, day_start + 86400)
+    else:
+        report_ids = sorted(context.user_data.get('review_selected', ()))
+        if not report_ids:
+            await query.answer("Не выбрано ни одного отчета", show_alert=True)
+            return REVIEW_REPORTS
+        condition = f"id IN ({','.join('?' * len(report_ids))})"
+        params = report_ids
+    await query.answer()
+    
+    changed = set_reports_status(status, condition, params, update.effective_user.id)
+    notify_drivers(context, changed, status)
+    context.user_data['review_selected'] = set()
+    
+    notice = f"{'✅ Одобрено' if status == 'approved' else '❌ Отклонено'} отчетов: {len(changed)}"
+    if action in ('ga', 'gr'):
+        return await review_groups(update, context, notice=notice)
+    return await review_reports(update, context, notice=notice)
+
+async def show_report_for_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    
     if query.data == "back_to_report_menu":
+        await query.answer()
         await show_report_menu(update, context)
         return REPORT_MENU
     
-    report_id = int(query.data.split('_')[-1])
-    context.user_data['review_report_id'] = report_id
+    # rv_next - следующий свободный отчет, review_report_<id> - выбранный
+    report_id = None if query.data == "rv_next" else int(query.data.split('_')[-1])
+    claimed = claim_report(query.from_user.id, report_id)
+    if not claimed:
+        text = "Нет свободных отчетов" if report_id is None else "Этот отчет уже проверяет другой администратор"
+        await query.answer(text, show_alert=True)
+        return await review_reports(update, context)
+    await query.answer()
+    
+    report_id, version = claimed
     
     media = get_report_media(report_id)
     if not media:
         await query.edit_message_text("Нет медиафайлов для этого отчета.")
         return
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1349,12 +2383,14 @@ async def show_report_for_review(update: Update, context: ContextTypes.DEFAULT_T
         d.first_name,
         d.username,
         tt.description,
-        cc.completion_date,
+        cc.completion_ts,
         cc.skipped,
         cc_skip.comment AS skip_reason_text,
         cc_skip.voice_message_id AS skip_reason_voice,
         cc_comment.comment AS comment_text,
-        cc_comment.voice_message_id AS comment_voice
+        cc_comment.voice_message_id AS comment_voice,
+        cc.version,
+        t.reports_version
     FROM completed_checks cc
     JOIN trucks t ON cc.truck_id = t.id
     JOIN drivers d ON cc.driver_id = d.id
@@ -1373,11 +2409,10 @@ async def show_report_for_review(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text("Отчет не найден")
         return
 
-    caption = (
-        f"🚛 Фура: {report_info[0]}\n"
-        f"👤 Водитель: {report_info[1]} (@{report_info[2]})\n"
-        f"📝 Проверка: {report_info[3]}\n"
-        f"🕒 Дата: {report_info[4].split('.')[0]}"
+    note = reused_media_note(report_id)
+    caption, overflow = report_caption(
+        'review', report_id, (report_info[10], report_info[11]), note,
+        lambda: format_review_caption(report_info, note)
     )
     
     first_media = media[0]
@@ -1394,6 +2429,8 @@ async def show_report_for_review(update: Update, context: ContextTypes.DEFAULT_T
             caption=caption
         )
     
+    await send_caption_overflow(context, query.message.chat_id, overflow)
+    
     for media_item in media[1:]:
         if media_item[1] == 'photo':
             await context.bot.send_photo(
@@ -1407,8 +2444,8 @@ async def show_report_for_review(update: Update, context: ContextTypes.DEFAULT_T
             )
     
     keyboard = [
-        [InlineKeyboardButton("✅ Одобрить", callback_data="approve_report"),
-         InlineKeyboardButton("❌ Отклонить", callback_data="reject_report")],
+        [InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_report_{report_id}_{version}"),
+         InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_report_{report_id}_{version}")],
         [InlineKeyboardButton("🔙 Назад", callback_data="back_to_review")]
     ]
     
@@ -1425,68 +2462,115 @@ async def handle_report_approval(update: Update, context: ContextTypes.DEFAULT_T
     if query.data == "back_to_review":
         return await review_reports(update, context)
     
-    report_id = context.user_data['review_report_id']
-    status = 'approved' if query.data == 'approve_report' else 'rejected'
-    
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    # approve_report_<id>_<version>: версия, которую видел администратор
+    report_id, version = map(int, query.data.split('_')[-2:])
+    status = 'approved' if query.data.startswith('approve_report_') else 'rejected'
     
-    cursor.execute(
-        'UPDATE completed_checks SET status = ? WHERE id = ?',
-        (status, report_id)
+    # Оптимистическая блокировка: решение применяется к той версии отчета,
+    # которую видел администратор
+    changed = set_reports_status(
+        status, 'id = ? AND version IS ?', (report_id, version), query.from_user.id
     )
+    if not changed:
+        return await review_reports(
+            update, context, notice="⚠️ Отчет уже проверен или изменен, решение не сохранено"
+        )
     
+    _, truck_number, task_description = changed[0]
+    notify_drivers(context, changed, status)
+    
+    status_text = "одобрен" if status == 'approved' else "отклонен"
+    return await review_reports(update, context, notice=f"Отчет по {truck_number} ({task_description}) {status_text}")
+
+def collect_new_reports(last_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT MAX(id) FROM completed_checks')
+    max_id = cursor.fetchone()[0] or 0
+
     cursor.execute('''
-    SELECT d.id, t.truck_number, tt.description
+    SELECT cc.truck_id, t.truck_number, COUNT(*), SUM(cc.skipped)
     FROM completed_checks cc
-    JOIN drivers d ON cc.driver_id = d.id
     JOIN trucks t ON cc.truck_id = t.id
-    JOIN truck_tasks tt ON cc.task_id = tt.id
-    WHERE cc.id = ?
-    ''', (report_id,))
-    
-    driver_id, truck_number, task_description = cursor.fetchone()
-    conn.commit()
+    WHERE cc.id > ? AND cc.id <= ?
+    GROUP BY cc.truck_id
+    ORDER BY COUNT(*) DESC, t.truck_number
+    ''', (last_id, max_id))
+
+    trucks = cursor.fetchall()
     conn.close()
-    
-    status_text = "одобрен" if status == 'approved' else "отклонен"
-    await query.edit_message_text(f"Отчет по {truck_number} ({task_description}) {status_text}")
-    
-    try:
-        await context.bot.send_message(
-            chat_id=driver_id,
-            text=f"Ваш отчет по фуре {truck_number} ({task_description}) был {status_text} администратором."
-        )
-    except Exception as e:
-        logger.error(f"Не удалось уведомить водителя {driver_id}: {e}")
-    
-    return await review_reports(update, context)
+    return max_id, trucks
+
+# Раз в DIGEST_INTERVAL секунд все новые отчеты (id выше сохраненной отметки)
+# собираются в одно сообщение на администратора, сгруппированное по фурам
+async def send_report_digest(context: ContextTypes.DEFAULT_TYPE):
+
+    with get_connection(timeout=10) as conn:
+        last_id = get_bot_state(conn.cursor(), 'digest_last_check_id')
+
+    if last_id is None:
+        # Первый запуск: старые отчеты в дайджест не попадают
+        max_id, _ = collect_new_reports(0)
+        with get_connection(timeout=10) as conn:
+            set_bot_state(conn.cursor(), 'digest_last_check_id', max_id)
+        return
+
+    max_id, trucks = collect_new_reports(int(last_id))
+    if max_id <= int(last_id):
+        return
+
+    with get_connection(timeout=10) as conn:
+        set_bot_state(conn.cursor(), 'digest_last_check_id', max_id)
+
+    if not trucks:
+        return
+
+    total = sum(truck[2] for truck in trucks)
+    lines = [f"📥 Новых отчетов: {total}\n"]
+    keyboard = []
+    for truck_id, truck_number, count, skipped in trucks[:DIGEST_MAX_TRUCKS]:
+        line = f"🚛 {truck_number}: {count}"
+        if skipped:
+            line += f" (⏭ пропущено: {skipped})"
+        lines.append(line)
+        keyboard.append([InlineKeyboardButton(
+            f"🚛 {truck_number} ({count})",
+            callback_data=f"digest_truck_{truck_id}")
+        ])
+
+    if len(trucks) > DIGEST_MAX_TRUCKS:
+        lines.append(f"\n...и еще фур: {len(trucks) - DIGEST_MAX_TRUCKS}")
+
+    text = "\n".join(lines)
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    for admin_id in ADMIN_IDS:
+        try:
+            await context.bot.send_message(chat_id=admin_id, text=text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Не удалось отправить дайджест администратору {admin_id}: {e}")
+
+async def open_truck_from_digest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if not is_admin(query.from_user.id):
+        return None
+
+    await show_reports_page(update, context, int(query.data.split('_')[-1]), 0)
+    return VIEW_TRUCK_REPORTS_DETAILS
 
 async def list_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    drivers = get_drivers()
+    drivers = get_drivers_with_trucks()
     if not drivers:
         await update.message.reply_text("Нет зарегистрированных водителей.")
         return DRIVER_MENU
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
     drivers_list = []
     for driver in drivers:
-        cursor.execute('''
-            SELECT t.truck_number 
-            FROM trucks t
-            JOIN drivers d ON t.id = d.current_truck_id
-            WHERE d.id = ?
-        ''', (driver[0],))
-        truck = cursor.fetchone()
-        truck_info = f"🚛 {truck[0]}" if truck else "🚫 Без фуры"
+        truck_info = f"🚛 {driver[3]}" if driver[3] else "🚫 Без фуры"
         drivers_list.append(f"{driver[1]} (@{driver[2]}) - {truck_info}")
     
-    conn.close()
-    
     await update.message.reply_text(
         "Список водителей:\n\n" + "\n".join(drivers_list),
         reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Назад")]], resize_keyboard=True)
@@ -1539,7 +2623,6 @@ async def select_truck_for_driver(update: Update, context: ContextTypes.DEFAULT_
         return DRIVER_MENU
     
     driver_id = int(query.data.split('_')[-1])
-    context.user_data['assign_driver_id'] = driver_id
     
     trucks = get_trucks()
     if not trucks:
@@ -1547,7 +2630,7 @@ async def select_truck_for_driver(update: Update, context: ContextTypes.DEFAULT_
         return DRIVER_MENU
     
     keyboard = [
-        [InlineKeyboardButton(f"{truck[1]} ({truck[2]})", callback_data=f"assign_truck_{truck[0]}")]
+        [InlineKeyboardButton(f"{truck[1]} ({truck[2]})", callback_data=f"assign_truck_{driver_id}_{truck[0]}")]
         for truck in trucks
     ]
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_select_driver")])
@@ -1563,14 +2646,10 @@ async def confirm_truck_assignment(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     
     try:
-        driver_id = context.user_data.get('assign_driver_id')
-        if not driver_id:
-            raise KeyError("Не найден ID водителя")
+        # assign_truck_<driver_id>_<truck_id>
+        driver_id, truck_id = map(int, query.data.split('_')[-2:])
         
-        truck_id = int(query.data.split('_')[-1])
-        
-        db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-        conn = sqlite3.connect(db_path)
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1605,6 +2684,9 @@ async def confirm_truck_assignment(update: Update, context: ContextTypes.DEFAULT
         
         conn.commit()
         conn.close()
+        # Водитель сменил фуру, а сама фура могла стать активной для других водителей
+        DRIVER_CACHE.invalidate(driver_id)
+        DRIVER_CACHE.invalidate_truck(truck_id)
         
         await query.edit_message_text(
             f"✅ Водитель {driver[0]} (@{driver[1]}) назначен на фуру {truck[0]} ({truck[1]})",
@@ -1628,10 +2710,6 @@ async def confirm_truck_assignment(update: Update, context: ContextTypes.DEFAULT
             reply_markup=None
         )
         return await show_driver_management(update, context)
-    
-    finally:
-        if 'assign_driver_id' in context.user_data:
-            del context.user_data['assign_driver_id']
 
 async def confirm_driver_deletion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1660,8 +2738,7 @@ async def complete_driver_deletion(update: Update, context: ContextTypes.DEFAULT
     
     driver_id = int(query.data.split('_')[-1])
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1672,6 +2749,7 @@ async def complete_driver_deletion(update: Update, context: ContextTypes.DEFAULT
     
     conn.commit()
     conn.close()
+    DRIVER_CACHE.invalidate(driver_id)
     
     await query.edit_message_text(f"✅ Привязка к фуре удалена для водителя")
     await show_driver_management(update, context)
@@ -1679,22 +2757,28 @@ async def complete_driver_deletion(update: Update, context: ContextTypes.DEFAULT
 
 async def start_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    tasks = get_driver_tasks(user_id)
+    truck = get_driver_context(user_id)
+    tasks = truck.tasks if truck else ()
     
     if not tasks:
         await update.message.reply_text("✅ Все задачи уже выполнены!")
         return DRIVER_MENU
     
-    context.user_data['tasks'] = tasks
+    # В сессии только id задач, описание читается при показе
+    context.user_data['tasks'] = [task.id for task in tasks]
     context.user_data['current_task'] = 0
     return await ask_for_proof(update, context)
 
 async def ask_for_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    task = context.user_data['tasks'][context.user_data['current_task']]
-    context.user_data['current_report'] = {'task_id': task[0]}
+    task_id = context.user_data['tasks'][context.user_data['current_task']]
+    task = get_task(task_id)
+    if task is None:
+        # Задачу удалили, пока водитель проходил отчет
+        return await next_task(update, context)
+    context.user_data['current_report'] = {'task_id': task_id}
     
     await update.message.reply_text(
-        f"🛠 Задача: {task[1]}\n"
+        f"🛠 Задача: {task.description}\n"
         "Отправьте фото/видео подтверждение или пропустите:",
         reply_markup=ReplyKeyboardMarkup([
             [KeyboardButton("⏭ Пропустить задачу")],
@@ -1703,27 +2787,60 @@ async def ask_for_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return TASK_PROOF
 
+def extract_media(message):
+    if message.photo:
+        return message.photo[-1].file_id, 'photo', message.photo[-1].file_unique_id
+    if message.video:
+        return message.video.file_id, 'video', message.video.file_unique_id
+    return None
+
+async def send_media_group_ack(context: ContextTypes.DEFAULT_TYPE):
+    job = context.job
+    await context.bot.send_message(
+        chat_id=job.chat_id,
+        text=job.data['text'],
+        reply_markup=job.data['reply_markup']
+    )
+
+def cancel_media_group_ack(context: ContextTypes.DEFAULT_TYPE, media_group_id):
+    if not media_group_id:
+        return
+    for job in context.job_queue.get_jobs_by_name(f"media_group_{media_group_id}"):
+        job.schedule_removal()
+
+# Альбом приходит отдельными сообщениями с общим media_group_id.
+# Ответ откладывается на MEDIA_GROUP_DEBOUNCE секунд после последнего файла,
+# поэтому на весь альбом водитель получает одно подтверждение.
+def schedule_media_group_ack(context: ContextTypes.DEFAULT_TYPE, message, text, reply_markup):
+    cancel_media_group_ack(context, message.media_group_id)
+    context.job_queue.run_once(
+        instrument_job(send_media_group_ack),
+        MEDIA_GROUP_DEBOUNCE,
+        chat_id=message.chat_id,
+        name=f"media_group_{message.media_group_id}",
+        data={'text': text, 'reply_markup': reply_markup}
+    )
+
 async def handle_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    file_id = None
-    file_type = None
-    if update.message.photo:
-        file_id = update.message.photo[-1].file_id
-        file_type = 'photo'
-    elif update.message.video:
-        file_id = update.message.video.file_id
-        file_type = 'video'
-    else:
+    media = extract_media(update.message)
+    if not media:
         await update.message.reply_text("❌ Неверный формат. Отправьте фото/видео.")
         return TASK_PROOF
     
-    context.user_data['current_report']['proof'] = (file_id, file_type)
-    await update.message.reply_text(
-        "Добавить комментарий (текст/голос) или пропустить:",
-        reply_markup=ReplyKeyboardMarkup([
-            [KeyboardButton("⏭ Пропустить комментарий")],
-            [KeyboardButton("❌ Отменить отчет")]
-        ], resize_keyboard=True)
-    )
+    report = context.user_data['current_report']
+    report.setdefault('proof', []).append(media)
+    
+    text = "Добавить комментарий (текст/голос) или пропустить:"
+    reply_markup = ReplyKeyboardMarkup([
+        [KeyboardButton("⏭ Пропустить комментарий")],
+        [KeyboardButton("❌ Отменить отчет")]
+    ], resize_keyboard=True)
+    
+    if update.message.media_group_id:
+        report['media_group_id'] = update.message.media_group_id
+        schedule_media_group_ack(context, update.message, text, reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
     return TASK_COMMENT
 
 async def skip_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1761,6 +2878,7 @@ async def handle_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if comment is not None:
         context.user_data['current_report']['comment'] = comment
+    cancel_media_group_ack(context, context.user_data['current_report'].get('media_group_id'))
     await save_report(update, context)
     return await next_task(update, context)
 
@@ -1773,10 +2891,8 @@ async def save_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Ошибка: данные отчета отсутствуют")
         return
 
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    
     try:
-        with sqlite3.connect(db_path, timeout=10) as conn:
+        with get_connection(timeout=10) as conn:
             cursor = conn.cursor()
             
             cursor.execute(
@@ -1790,56 +2906,53 @@ async def save_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
                 
             truck_id = truck_result[0]
+            now_ts = int(time.time())
             
             cursor.execute('''
                 INSERT INTO completed_checks 
-                (truck_id, driver_id, task_id, status, skipped)
-                VALUES (?, ?, ?, 'pending', ?)
+                (truck_id, driver_id, task_id, status, skipped, completion_ts)
+                VALUES (?, ?, ?, 'pending', ?, ?)
             ''', (
                 truck_id,
                 user_id,
                 report.get('task_id'),
-                report.get('skipped', False)
+                report.get('skipped', False),
+                now_ts
             ))
             report_id = cursor.lastrowid
             
-            if 'proof' in report:
-                file_id, file_type = report['proof']
-                cursor.execute('''
-                    INSERT INTO report_media 
-                    (report_id, file_id, file_type)
-                    VALUES (?, ?, ?)
-                ''', (report_id, file_id, file_type))
+            if report.get('proof'):
+                store_report_media(cursor, report_id, report['proof'])
             
             if 'skip_reason' in report and report['skip_reason'] is not None:
                 reason_type, reason_content = report['skip_reason']
                 if reason_type == 'voice':
                     cursor.execute('''
                         INSERT INTO check_comments 
-                        (check_id, driver_id, voice_message_id, type)
-                        VALUES (?, ?, ?, 'skip_reason')
-                    ''', (report_id, user_id, reason_content))
+                        (check_id, driver_id, voice_message_id, type, timestamp_ts)
+                        VALUES (?, ?, ?, 'skip_reason', ?)
+                    ''', (report_id, user_id, reason_content, now_ts))
                 else:
                     cursor.execute('''
                         INSERT INTO check_comments 
-                        (check_id, driver_id, comment, type)
-                        VALUES (?, ?, ?, 'skip_reason')
-                    ''', (report_id, user_id, reason_content))
+                        (check_id, driver_id, comment, type, timestamp_ts)
+                        VALUES (?, ?, ?, 'skip_reason', ?)
+                    ''', (report_id, user_id, reason_content, now_ts))
             
             if 'comment' in report and report['comment'] is not None:
                 comment_type, comment_content = report['comment']
                 if comment_type == 'voice':
                     cursor.execute('''
                         INSERT INTO check_comments 
-                        (check_id, driver_id, voice_message_id, type)
-                        VALUES (?, ?, ?, 'comment')
-                    ''', (report_id, user_id, comment_content))
+                        (check_id, driver_id, voice_message_id, type, timestamp_ts)
+                        VALUES (?, ?, ?, 'comment', ?)
+                    ''', (report_id, user_id, comment_content, now_ts))
                 else:
                     cursor.execute('''
                         INSERT INTO check_comments 
-                        (check_id, driver_id, comment, type)
-                        VALUES (?, ?, ?, 'comment')
-                    ''', (report_id, user_id, comment_content))
+                        (check_id, driver_id, comment, type, timestamp_ts)
+                        VALUES (?, ?, ?, 'comment', ?)
+                    ''', (report_id, user_id, comment_content, now_ts))
             
             conn.commit()
             
@@ -1884,37 +2997,31 @@ async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return TASK_MENU
 
 async def handle_photo_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.message.from_user
-    file_id = None
-    file_type = None
-    
-    if update.message.photo:
-        photo_file = update.message.photo[-1]
-        file_id = photo_file.file_id
-        file_type = 'photo'
-    elif update.message.video:
-        video_file = update.message.video
-        file_id = video_file.file_id
-        file_type = 'video'
-    else:
+    media = extract_media(update.message)
+    if not media:
         await update.message.reply_text("Пожалуйста, отправьте фото или видео.")
         return MULTI_PHOTO_UPLOAD
 
-    context.user_data['report_media'].append((file_id, file_type))
+    context.user_data.setdefault('report_media', []).append(media)
     
-    await update.message.reply_text(
-        "Фото/видео добавлено. Отправьте еще или нажмите 'Завершить загрузку'.",
-        reply_markup=ReplyKeyboardMarkup([
-            [KeyboardButton("✅ Завершить загрузку")],
-            [KeyboardButton("❌ Отменить")]
-        ], resize_keyboard=True)
-    )
+    text = "Фото/видео добавлено. Отправьте еще или нажмите 'Завершить загрузку'."
+    reply_markup = ReplyKeyboardMarkup([
+        [KeyboardButton("✅ Завершить загрузку")],
+        [KeyboardButton("❌ Отменить")]
+    ], resize_keyboard=True)
+    
+    if update.message.media_group_id:
+        context.user_data['upload_media_group_id'] = update.message.media_group_id
+        schedule_media_group_ack(context, update.message, text, reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
     return MULTI_PHOTO_UPLOAD
 
 async def complete_photo_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.user_data.get('report_media'):
         await update.message.reply_text("Вы не добавили ни одного фото/видео. Попробуйте снова.")
         return await start_report(update, context)
+    cancel_media_group_ack(context, context.user_data.pop('upload_media_group_id', None))
     
     await update.message.reply_text(
         "📝 Теперь добавьте комментарий к отчету (текст или голосовое):",
@@ -1933,44 +3040,40 @@ async def save_report_with_media(update: Update, context: ContextTypes.DEFAULT_T
         await update.message.reply_text("❌ Ошибка: задача не найдена.")
         return DRIVER_MENU
     
-    task_id = tasks[current_task_idx][0]
+    task_id = tasks[current_task_idx]
     
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT current_truck_id FROM drivers WHERE id = ?', (user.id,))
     truck_id = cursor.fetchone()[0]
+    now_ts = int(time.time())
     
     cursor.execute('''
     INSERT INTO completed_checks 
-    (truck_id, driver_id, task_id, status)
-    VALUES (?, ?, ?, 'pending')
-    ''', (truck_id, user.id, task_id))
+    (truck_id, driver_id, task_id, status, completion_ts)
+    VALUES (?, ?, ?, 'pending', ?)
+    ''', (truck_id, user.id, task_id, now_ts))
     
     report_id = cursor.lastrowid
     
-    for file_id, file_type in context.user_data['report_media']:
-        cursor.execute('''
-        INSERT INTO report_media (report_id, file_id, file_type)
-        VALUES (?, ?, ?)
-        ''', (report_id, file_id, file_type))
+    store_report_media(cursor, report_id, context.user_data['report_media'])
     
     if update.message.text != "Пропустить комментарий":
         if update.message.voice:
             voice_id = update.message.voice.file_id
             cursor.execute('''
             INSERT INTO check_comments 
-            (check_id, driver_id, voice_message_id)
-            VALUES (?, ?, ?)
-            ''', (report_id, user.id, voice_id))
+            (check_id, driver_id, voice_message_id, type, timestamp_ts)
+            VALUES (?, ?, ?, 'comment', ?)
+            ''', (report_id, user.id, voice_id, now_ts))
         else:
             comment = update.message.text
             cursor.execute('''
             INSERT INTO check_comments 
-            (check_id, driver_id, comment)
-            VALUES (?, ?, ?)
-            ''', (report_id, user.id, comment))
+            (check_id, driver_id, comment, type, timestamp_ts)
+            VALUES (?, ?, ?, 'comment', ?)
+            ''', (report_id, user.id, comment, now_ts))
     
     conn.commit()
     conn.close()
@@ -1979,9 +3082,10 @@ async def save_report_with_media(update: Update, context: ContextTypes.DEFAULT_T
     if next_task_idx < len(tasks):
         context.user_data['current_task'] = next_task_idx
         context.user_data['report_media'] = []
+        next_task_row = get_task(tasks[next_task_idx])
         
         await update.message.reply_text(
-            f"✅ Отчет сохранен! Следующая задача:\n{tasks[next_task_idx][1]}\n\n"
+            f"✅ Отчет сохранен! Следующая задача:\n{next_task_row.description if next_task_row else '—'}\n\n"
             "Отправьте фото/видео выполнения (можно несколько):",
             reply_markup=ReplyKeyboardMarkup([
                 [KeyboardButton("✅ Завершить загрузку")],
@@ -2002,6 +3106,10 @@ async def save_report_with_media(update: Update, context: ContextTypes.DEFAULT_T
 async def cancel_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if 'report_media' in context.user_data:
         del context.user_data['report_media']
+    # Отложенное подтверждение альбома не должно прийти после отмены
+    report = context.user_data.get('current_report') or {}
+    cancel_media_group_ack(context, report.get('media_group_id'))
+    cancel_media_group_ack(context, context.user_data.pop('upload_media_group_id', None))
     
     await update.message.reply_text(
         "Отчет отменен",
@@ -2013,25 +3121,7 @@ async def cancel_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return DRIVER_MENU
 
 async def view_my_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.message.from_user.id
-    
-    db_path = os.path.join(os.path.dirname(__file__), 'data', 'truck_tasks_v2.db')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT cc.id, t.truck_number, tt.description, 
-           cc.completion_date, cc.status
-    FROM completed_checks cc
-    JOIN trucks t ON cc.truck_id = t.id
-    JOIN truck_tasks tt ON cc.task_id = tt.id
-    WHERE cc.driver_id = ?
-    ORDER BY cc.completion_date DESC
-    LIMIT 10
-    ''', (user_id,))
-    
-    reports = cursor.fetchall()
-    conn.close()
+    reports = get_driver_reports(update.message.from_user.id)
     
     if not reports:
         await update.message.reply_text("Вы еще не отправляли отчетов.")
@@ -2041,7 +3131,7 @@ async def view_my_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for report in reports:
         status_icon = "✅" if report[4] == 'approved' else "❌" if report[4] == 'rejected' else "🕒"
         reports_text.append(
-            f"{status_icon} {report[3].split('.')[0]} - {report[1]} - {report[2]}"
+            f"{status_icon} {format_ts(report[3])} - {report[1]} - {report[2]}"
         )
     
     await update.message.reply_text(
@@ -2059,6 +3149,37 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+async def show_sql_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return
+    
+    stats_text = sql_stats.format_stats()
+    if not stats_text:
+        await update.message.reply_text("Запросов к базе еще не было.")
+        return
+    
+    await update.message.reply_text(("📈 Самые затратные запросы:\n\n" + stats_text)[:4096])
+
+async def handle_conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    report = context.user_data.get('current_report') or {}
+    cancel_media_group_ack(context, report.get('media_group_id'))
+    context.user_data.clear()
+    
+    if update.effective_chat:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="⏱ Сессия завершена из-за неактивности. Нажмите /start, чтобы продолжить.",
+            reply_markup=ReplyKeyboardMarkup([[KeyboardButton("/start")]], resize_keyboard=True)
+        )
+
+async def sweep_idle_sessions(context: ContextTypes.DEFAULT_TYPE):
+    stats = sweep_sessions(context.application, SESSION_IDLE_TIMEOUT)
+    if stats['evicted']:
+        logger.info(
+            f"Удалено неактивных сессий: {stats['evicted']}, осталось {stats['sessions']} "
+            f"(~{stats['bytes'] / 1024:.0f} КБ)"
+        )
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling update:", exc_info=context.error)
     
@@ -2067,12 +3188,109 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
             "Произошла ошибка. Пожалуйста, попробуйте ещё раз."
         )
 
-def main():
-    init_db()
-    application = Application.builder().token(BOT_TOKEN).build()
+async def archive_media(context: ContextTypes.DEFAULT_TYPE):
+    archiver = MediaArchiver(DB_PATH, MEDIA_ARCHIVE_DIR, workers=MEDIA_ARCHIVE_WORKERS)
+    
+    async def resolve_url(file_id):
+        telegram_file = await context.bot.get_file(file_id)
+        return telegram_file.file_path
+    
+    await archiver.run(resolve_url)
+
+async def archive_reports(context: ContextTypes.DEFAULT_TYPE):
+    cutoff_ts = int(time.time()) - ARCHIVE_RETENTION_DAYS * 24 * 60 * 60
+    await asyncio.to_thread(
+        archive_old_reports, DB_PATH, ARCHIVE_DIR, cutoff_ts, vacuum_pages=ARCHIVE_VACUUM_PAGES
+    )
+
+async def backup_database(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await asyncio.to_thread(
+            run_backup, DB_PATH, BACKUP_DIR,
+            keep=BACKUP_KEEP,
+            pages_per_step=BACKUP_PAGES_PER_STEP,
+            step_sleep=BACKUP_STEP_SLEEP,
+            max_restarts=BACKUP_MAX_RESTARTS,
+            max_seconds=BACKUP_MAX_SECONDS
+        )
+    except Exception as e:
+        logger.error(f"Ошибка резервного копирования: {e}")
+
+async def on_startup(application: Application):
+    loop_monitor = LoopMonitor(threshold=LOOP_LAG_THRESHOLD)
+    loop_monitor.start()
+    application.bot_data['loop_monitor'] = loop_monitor
+    
+    if METRICS_PORT:
+        application.bot_data['metrics_server'] = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    notifications = NotificationQueue(application.bot, rate=NOTIFY_RATE)
+    notifications.start()
+    application.bot_data['notifications'] = notifications
+
+async def on_shutdown(application: Application):
+    notifications = application.bot_data.get('notifications')
+    if notifications:
+        await notifications.close()
+
+def telegram_request(pool, pool_size):
+    return InstrumentedRequest(
+        pool=pool,
+        connection_pool_size=pool_size,
+        keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        media_write_timeout=TELEGRAM_MEDIA_WRITE_TIMEOUT,
+        http_version='2' if TELEGRAM_HTTP2 else '1.1',
+    )
+
+# Кнопки из других процессов или до перезапуска бота приходят без
+# состояния диалога, поэтому проверка администратора - в самом обработчике
+def admin_only(handler):
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not is_admin(update.effective_user.id):
+            await update.callback_query.answer()
+            return None
+        return await handler(update, context)
+    return wrapper
+
+# Кнопки, у которых все нужное записано в callback_data. Они стоят и в
+# entry_points, и в fallbacks: нажатие сработает из любого состояния диалога,
+# после перезапуска бота и в любом процессе бота
+def stateless_callbacks():
+    return [
+        CallbackQueryHandler(admin_only(handle_report_details), pattern=r"^rp_\d+_\d+$"),
+        CallbackQueryHandler(admin_only(handle_report_approval), pattern=r"^(approve|reject)_report_\d+_\d+$"),
+        CallbackQueryHandler(admin_only(save_task_status), pattern=r"^set_active_\d+_[01]$"),
+        CallbackQueryHandler(admin_only(confirm_assignment), pattern=r"^assign_driver_\d+_\d+$"),
+        CallbackQueryHandler(admin_only(confirm_truck_assignment), pattern=r"^assign_truck_\d+_\d+$"),
+    ]
 
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+# base_url и concurrent_updates нужны нагрузочному тесту (bench/loadtest.py),
+# который запускает бота против локального фейкового Bot API
+def build_application(token=BOT_TOKEN, base_url=None, concurrent_updates=False):
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(telegram_request('send', TELEGRAM_POOL_SIZE))
+        .get_updates_request(telegram_request('polling', TELEGRAM_POLLING_POOL_SIZE))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(concurrent_updates)
+    )
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
+
+    conv_handler = FlowConversationHandler(
+        entry_points=[
+            CommandHandler('start', start),
+            CallbackQueryHandler(open_truck_from_digest, pattern="^digest_truck_"),
+            *stateless_callbacks()
+        ],
         states={
             ADMIN_MENU: [
                 MessageHandler(filters.Regex('^🚛 Управление фурами$'), show_truck_menu),
@@ -2086,8 +3304,13 @@ def main():
                 MessageHandler(filters.Regex('^📋 Список фур$'), list_trucks),
                 MessageHandler(filters.Regex('^👥 Назначить водителя$'), assign_driver),
                 MessageHandler(filters.Regex('^🗑 Удалить фуру$'), delete_truck),
+                MessageHandler(filters.Regex('^📥 Импорт из файла$'), start_fleet_import),
                 MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_menu)
             ],
+            IMPORT_FLEET: [
+                MessageHandler(filters.Document.ALL, handle_fleet_import),
+                MessageHandler(filters.Regex('^🔙 Назад$'), show_truck_menu)
+            ],
             DRIVER_MENU: [
                 MessageHandler(filters.Regex('^📋 Список водителей$'), list_drivers),
                 MessageHandler(filters.Regex('^🚛 Назначить фуру$'), assign_driver),
@@ -2099,10 +3322,26 @@ def main():
                 MessageHandler(filters.Regex('^➕ Добавить задачу$'), add_task),
                 MessageHandler(filters.Regex('^✏️ Редактировать задачи$'), edit_tasks),
                 MessageHandler(filters.Regex('^🗑 Удалить задачи$'), delete_tasks),
+                MessageHandler(filters.Regex('^🧩 Шаблоны задач$'), show_templates),
                 MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_menu)
             ],
+            TEMPLATE_MENU: [
+                CallbackQueryHandler(show_templates, pattern="^tpl_list$"),
+                CallbackQueryHandler(view_template, pattern="^tpl_view_"),
+                CallbackQueryHandler(edit_template, pattern=r"^tpl_(new|edit_\d+)$"),
+                CallbackQueryHandler(pick_template_trucks, pattern="^tpl_(pick|toggle)_"),
+                CallbackQueryHandler(apply_template, pattern="^tpl_(apply|all)_"),
+                CallbackQueryHandler(delete_template, pattern="^tpl_(delete|confirm_delete)_"),
+                CallbackQueryHandler(back_to_task_menu, pattern="^back_to_task_menu$"),
+                MessageHandler(filters.Regex('^🔙 Назад$'), show_task_menu)
+            ],
+            TEMPLATE_EDIT: [
+                MessageHandler(filters.Regex('^🔙 Назад$'), show_task_menu),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, save_template)
+            ],
             REPORT_MENU: [
                 MessageHandler(filters.Regex('^📊 Отчеты по фурам$'), view_truck_reports),
+                MessageHandler(filters.Regex('^📝 Проверка отчетов$'), review_reports),
                 MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_menu)
             ],
             ADD_TRUCK: [
@@ -2111,17 +3350,19 @@ def main():
             ],
             SELECT_DRIVER_FOR_TRUCK: [
                 CallbackQueryHandler(select_truck_for_driver, pattern="^select_driver_"),
+                CallbackQueryHandler(confirm_assignment, pattern=r"^(assign_driver_\d+_\d+|back_to_assign)$"),
                 CallbackQueryHandler(show_driver_management, pattern="^back_to_driver_menu$"),
                 MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_menu)
             ],
             SELECT_TRUCK_FOR_ASSIGNMENT: [
-                CallbackQueryHandler(confirm_truck_assignment, pattern="^assign_truck_"),
+                CallbackQueryHandler(confirm_truck_assignment, pattern=r"^assign_truck_\d+_\d+$"),
+                CallbackQueryHandler(select_driver_for_truck, pattern=r"^(pick_truck_\d+|back_to_truck_menu)$"),
                 CallbackQueryHandler(assign_truck_to_driver, pattern="^back_to_select_driver$"),
                 MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_menu)
             ],
             ADD_TASK: [
                 CallbackQueryHandler(handle_truck_selection_for_task, pattern="^add_task_"),
-                CallbackQueryHandler(show_task_menu, pattern="^back_to_task_menu$")
+                CallbackQueryHandler(back_to_task_menu, pattern="^back_to_task_menu$")
             ],
             TASK_DESCRIPTION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, save_task_description),
@@ -2129,25 +3370,28 @@ def main():
             ],
             EDIT_TASK: [
                 CallbackQueryHandler(handle_truck_selection_for_edit, pattern="^edit_truck_"),
-                CallbackQueryHandler(show_task_menu, pattern="^back_to_task_menu$"),
+                CallbackQueryHandler(back_to_task_menu, pattern="^back_to_task_menu$"),
                 CallbackQueryHandler(edit_task_status, pattern="^edit_task_"),
                 CallbackQueryHandler(edit_tasks, pattern="^back_to_edit_menu$"),
-                CallbackQueryHandler(save_task_status, pattern="^set_active_[01]$")
+                CallbackQueryHandler(save_task_status, pattern=r"^set_active_\d+_[01]$")
             ],
             DELETE_TASK: [
                 CallbackQueryHandler(handle_truck_selection_for_delete, pattern="^delete_truck_"),
-                CallbackQueryHandler(show_task_menu, pattern="^back_to_task_menu$"),
+                CallbackQueryHandler(back_to_task_menu, pattern="^back_to_task_menu$"),
                 CallbackQueryHandler(confirm_task_deletion, pattern="^delete_task_"),
                 CallbackQueryHandler(confirm_task_deletion, pattern="^delete_all_"),
                 CallbackQueryHandler(delete_tasks, pattern="^back_to_delete_menu$")
             ],
             REVIEW_REPORTS: [
-                CallbackQueryHandler(show_report_for_review, pattern="^review_report_"),
+                CallbackQueryHandler(show_report_for_review, pattern="^(review_report_|rv_next$)"),
+                CallbackQueryHandler(toggle_review_selection, pattern=r"^rv_(toggle_\d+|select_all)$"),
+                CallbackQueryHandler(handle_bulk_review, pattern="^rv_(approve_sel|reject_sel|ga_|gr_)"),
+                CallbackQueryHandler(review_groups, pattern="^rv_groups$"),
+                CallbackQueryHandler(review_reports, pattern="^rv_list$"),
                 CallbackQueryHandler(show_report_menu, pattern="^back_to_report_menu$")
             ],
             APPROVE_REPORT: [
-                CallbackQueryHandler(handle_report_approval, pattern="^approve_report$"),
-                CallbackQueryHandler(handle_report_approval, pattern="^reject_report$"),
+                CallbackQueryHandler(handle_report_approval, pattern=r"^(approve|reject)_report_\d+_\d+$"),
                 CallbackQueryHandler(review_reports, pattern="^back_to_review$")
             ],
             DELETE_DRIVER: [
@@ -2188,9 +3432,10 @@ def main():
                 MessageHandler(filters.Regex('^❌ Отменить отчет$'), cancel_report)
             ],
             TASK_COMMENT: [
+                MessageHandler(filters.PHOTO | filters.VIDEO, handle_proof),
+                MessageHandler(filters.Regex('^❌ Отменить отчет$'), cancel_report),
                 MessageHandler(filters.TEXT | filters.VOICE, handle_comment),
-                MessageHandler(filters.Regex('^⏭ Пропустить комментарий$'), handle_comment),
-                MessageHandler(filters.Regex('^❌ Отменить отчет$'), cancel_report)
+                MessageHandler(filters.Regex('^⏭ Пропустить комментарий$'), handle_comment)
             ],
             VIEW_TRUCK_REPORTS: [
                 CallbackQueryHandler(show_truck_reports, pattern="^view_truck_"),
@@ -2198,7 +3443,7 @@ def main():
                 MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_menu)
             ],
             VIEW_TRUCK_REPORTS_DETAILS: [
-                CallbackQueryHandler(handle_report_details, pattern="^(prev_page|next_page|back_to_reports)"),
+                CallbackQueryHandler(handle_report_details, pattern=r"^rp_\d+_\d+$"),
                 CallbackQueryHandler(show_full_comment, pattern="^comment_"),
                 CallbackQueryHandler(show_skip_details, pattern="^skip_reason_"),
                 CallbackQueryHandler(view_truck_reports, pattern="^back_to_report_menu$"),
@@ -2208,16 +3453,45 @@ def main():
                 CallbackQueryHandler(confirm_truck_deletion, pattern="^delete_truck_"),
                 CallbackQueryHandler(show_truck_menu, pattern="^back_to_truck_menu$")
             ],
+            ConversationHandler.TIMEOUT: [
+                TypeHandler(Update, handle_conversation_timeout)
+            ],
             CONFIRM_DELETE_TRUCK: [
                 CallbackQueryHandler(complete_truck_deletion, pattern="^confirm_truck_delete_"),
                 CallbackQueryHandler(show_truck_menu, pattern="^back_to_truck_menu$")
             ]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            CallbackQueryHandler(open_truck_from_digest, pattern="^digest_truck_"),
+            *stateless_callbacks()
+        ],
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        timed_states=TIMED_STATES
     )
     
+    instrument_conversation(conv_handler)
     application.add_error_handler(error_handler)
     application.add_handler(conv_handler)
+    application.add_handler(CommandHandler('sqlstats', show_sql_stats), group=1)
+    application.add_handler(TypeHandler(Update, touch_session), group=-2)
+    
+    if UPDATE_LOG_PATH:
+        recorder = UpdateRecorder(UPDATE_LOG_PATH)
+        application.add_handler(TypeHandler(Update, recorder.record), group=-1)
+        logger.info(f"Входящие апдейты записываются в {UPDATE_LOG_PATH}")
+    application.job_queue.run_repeating(instrument_job(send_report_digest), interval=DIGEST_INTERVAL, first=DIGEST_INTERVAL)
+    application.job_queue.run_repeating(instrument_job(archive_media), interval=MEDIA_ARCHIVE_INTERVAL, first=60)
+    application.job_queue.run_repeating(instrument_job(backfill_epoch_columns), interval=5, first=1)
+    application.job_queue.run_repeating(instrument_job(archive_reports), interval=ARCHIVE_INTERVAL, first=10 * 60)
+    application.job_queue.run_repeating(instrument_job(backup_database), interval=BACKUP_INTERVAL, first=5 * 60)
+    application.job_queue.run_repeating(instrument_job(sweep_idle_sessions), interval=SESSION_SWEEP_INTERVAL, first=SESSION_SWEEP_INTERVAL)
+    return application
+
+def main():
+    sql_stats.configure(SLOW_QUERY_THRESHOLD)
+    init_db()
+    application = build_application()
     application.run_polling()
 
 if __name__ == '__main__':
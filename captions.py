@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+import metrics
+
+# Лимиты Telegram считаются в UTF-16: эмодзи занимают две позиции
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+OVERFLOW_MARK = "\n… (продолжение ниже)"
+
+CAPTION_CACHE_LOOKUPS = metrics.register(metrics.Counter(
+    'bot_caption_cache_total', 'Обращения к кэшу подписей отчетов', ('result',)))
+CAPTION_OVERFLOWS = metrics.register(metrics.Counter(
+    'bot_caption_overflow_total', 'Подписи, не поместившиеся в лимит Telegram'))
+
+
+def telegram_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def cut_line(line, limit):
+    used = 0
+    for idx, char in enumerate(line):
+        used += 2 if ord(char) > 0xFFFF else 1
+        if used > limit:
+            return line[:idx], line[idx:]
+    return line, ''
+
+
+# Делит текст на части не длиннее limit по границам строк;
+# слишком длинная строка режется посередине
+def split_text(text, limit):
+    chunks = []
+    current = []
+    used = 0
+    for line in text.split('\n'):
+        size = telegram_length(line)
+        while size > limit:
+            if current:
+                chunks.append('\n'.join(current))
+                current, used = [], 0
+            head, line = cut_line(line, limit)
+            chunks.append(head)
+            size = telegram_length(line)
+        if current and used + 1 + size > limit:
+            chunks.append('\n'.join(current))
+            current, used = [], 0
+        used += size + (1 if current else 0)
+        current.append(line)
+    if current and any(current):
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+# Возвращает (подпись в пределах limit, кортеж сообщений-продолжений)
+def fit_caption(text, limit=CAPTION_LIMIT):
+    if telegram_length(text) <= limit:
+        return text, ()
+
+    CAPTION_OVERFLOWS.inc()
+    head = split_text(text, limit - telegram_length(OVERFLOW_MARK))[0]
+    rest = text[len(head):].lstrip('\n')
+    return head + OVERFLOW_MARK, tuple(split_text(rest, MESSAGE_LIMIT))
+
+
+# LRU-кэш готовых подписей. Ключ содержит версию отчета, поэтому после
+# изменения отчета старая запись просто перестает запрашиваться и вытесняется.
+class CaptionCache:
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get_or_render(self, key, render, limit):
+        result = self.items.get(key)
+        if result is not None:
+            self.items.move_to_end(key)
+            CAPTION_CACHE_LOOKUPS.inc('hit')
+            return result
+
+        CAPTION_CACHE_LOOKUPS.inc('miss')
+        result = self.items[key] = fit_caption(render(), limit)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return result
@@ -0,0 +1,97 @@
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class BackupRestarting(Exception):
+    pass
+
+
+# Снимок базы через sqlite3 backup API. Страницы копируются порциями по
+# pages_per_step с паузой step_sleep между ними: блокировка на чтение
+# держится только на время одной порции, и бот продолжает писать в базу.
+# Запись из другого соединения между порциями перезапускает копирование
+# с начала. Если перезапусков больше max_restarts или копирование идет
+# дольше max_seconds, база копируется за один шаг: блокировка на чтение
+# держится все время копирования, зато перезапусков больше не будет.
+# Функция блокирующая, из бота ее нужно вызывать через asyncio.to_thread.
+def run_backup(db_path, backup_dir, keep=7, pages_per_step=256, step_sleep=0.05,
+               max_restarts=3, max_seconds=600):
+    os.makedirs(backup_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    tmp_path = os.path.join(backup_dir, f".{name}_{stamp}.db.tmp")
+    backup_path = os.path.join(backup_dir, f"{name}_{stamp}.db.gz")
+
+    started = time.monotonic()
+    total_pages = 0
+    restarts = 0
+    last_remaining = None
+    single_step = False
+
+    # Оставшихся страниц стало больше - копирование началось заново
+    def progress(status, remaining, total):
+        nonlocal total_pages, restarts, last_remaining
+        total_pages = total
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts or time.monotonic() - started > max_seconds:
+                raise BackupRestarting()
+        last_remaining = remaining
+        if remaining:
+            time.sleep(step_sleep)
+
+    try:
+        src = sqlite3.connect(db_path, timeout=30)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            try:
+                src.backup(dst, pages=pages_per_step, progress=progress)
+            except BackupRestarting:
+                logger.warning(
+                    f"Резервное копирование перезапускалось {restarts} раз за "
+                    f"{time.monotonic() - started:.1f} с, копирую базу за один шаг"
+                )
+                single_step = True
+                src.backup(dst)
+                total_pages = src.execute("PRAGMA page_count").fetchone()[0]
+            result = dst.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+
+        if result != 'ok':
+            raise RuntimeError(f"Проверка целостности копии не пройдена: {result}")
+
+        with open(tmp_path, 'rb') as f_in, gzip.open(backup_path, 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    for old_backup in sorted(glob.glob(os.path.join(backup_dir, f"{name}_*.db.gz")), reverse=True)[keep:]:
+        os.remove(old_backup)
+
+    seconds = time.monotonic() - started
+    stats = {
+        'path': backup_path,
+        'pages': total_pages,
+        'seconds': seconds,
+        'pages_per_sec': total_pages / seconds if seconds else 0.0,
+        'size': os.path.getsize(backup_path),
+        'restarts': restarts,
+        'single_step': single_step,
+    }
+    logger.info(
+        f"Резервная копия {backup_path}: {stats['pages']} страниц за {seconds:.1f} с "
+        f"({stats['pages_per_sec']:.0f} стр/с), {stats['size'] / 1024 / 1024:.1f} МБ, "
+        f"перезапусков: {restarts}{', за один шаг' if single_step else ''}"
+    )
+    return stats
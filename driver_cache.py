@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+
+import metrics
+
+DRIVER_CACHE_LOOKUPS = metrics.register(metrics.Counter(
+    'bot_driver_cache_total', 'Обращения к кэшу фуры и задач водителя', ('result',)))
+
+
+# Фура и активные задачи водителя (rows.DriverContext или None, если фуры нет).
+# Сбрасывается явно при назначении фуры и изменении задач; ttl - страховка
+# от правок базы в обход бота. Индекс by_truck нужен, чтобы по изменению
+# задач фуры сбросить только ее водителей.
+class DriverCache:
+    def __init__(self, maxsize=10000, ttl=10 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.by_truck = {}
+
+    def get(self, driver_id, load):
+        entry = self.items.get(driver_id)
+        now = time.monotonic()
+        if entry is not None and entry[0] > now:
+            self.items.move_to_end(driver_id)
+            DRIVER_CACHE_LOOKUPS.inc('hit')
+            return entry[1]
+
+        DRIVER_CACHE_LOOKUPS.inc('miss')
+        value = load(driver_id)
+        self.invalidate(driver_id)
+        self.items[driver_id] = (now + self.ttl, value)
+        if value is not None:
+            self.by_truck.setdefault(value.truck_id, set()).add(driver_id)
+        if len(self.items) > self.maxsize:
+            self.invalidate(next(iter(self.items)))
+        return value
+
+    def invalidate(self, driver_id):
+        entry = self.items.pop(driver_id, None)
+        if entry is not None and entry[1] is not None:
+            drivers = self.by_truck.get(entry[1].truck_id)
+            if drivers:
+                drivers.discard(driver_id)
+                if not drivers:
+                    del self.by_truck[entry[1].truck_id]
+
+    def invalidate_truck(self, truck_id):
+        for driver_id in self.by_truck.pop(truck_id, ()):
+            self.items.pop(driver_id, None)
+
+    def clear(self):
+        self.items.clear()
+        self.by_truck.clear()
@@ -0,0 +1,276 @@
+import codecs
+import csv
+import io
+import logging
+import os
+import sqlite3
+import time
+from datetime import date
+
+import metrics
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+# Порядок столбцов по умолчанию, если в файле нет строки заголовка
+COLUMNS = ('truck_number', 'model', 'year', 'description', 'frequency')
+HEADER_ALIASES = {
+    'номер': 'truck_number', 'номер фуры': 'truck_number', 'фура': 'truck_number',
+    'truck': 'truck_number', 'truck_number': 'truck_number',
+    'модель': 'model', 'model': 'model',
+    'год': 'year', 'year': 'year',
+    'задача': 'description', 'описание': 'description', 'task': 'description', 'description': 'description',
+    'периодичность': 'frequency', 'частота': 'frequency', 'frequency': 'frequency',
+}
+MAX_LENGTHS = {'truck_number': 20, 'model': 100, 'description': 1000, 'frequency': 50}
+MIN_YEAR = 1950
+STAGE_BATCH_SIZE = 5000
+MAX_ERRORS_SHOWN = 10
+
+IMPORT_ROWS = metrics.register(metrics.Counter(
+    'bot_fleet_import_rows_total', 'Строки файлов импорта фур и задач', ('result',)))
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    # Excel отдает целые числа (год, номер) как float
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+# Кодировка CSV: UTF-8 (с BOM или без), иначе cp1251 из русского Excel
+def detect_encoding(data):
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data[:64 * 1024])
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+
+def read_csv(data):
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding=detect_encoding(data), newline='')
+    sample = stream.read(4096)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(stream, dialect)
+
+
+def read_xlsx(data):
+    if openpyxl is None:
+        raise ValueError("Для импорта XLSX на сервере не установлен openpyxl. Сохраните файл как CSV.")
+    # read_only: строки читаются по одной, без загрузки всего листа в память
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_rows(data, filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.xlsx':
+        return read_xlsx(data)
+    if extension in ('.csv', '.txt', ''):
+        return read_csv(data)
+    raise ValueError("Поддерживаются только файлы CSV и XLSX")
+
+
+# Строка заголовка определяет порядок столбцов; без заголовка - COLUMNS
+def header_columns(values):
+    names = [HEADER_ALIASES.get(value.lower()) for value in values]
+    if 'truck_number' not in names:
+        return None
+    return names
+
+
+def validate_row(row):
+    if not row['truck_number']:
+        raise ValueError("не указан номер фуры")
+    for name, max_length in MAX_LENGTHS.items():
+        if len(row[name]) > max_length:
+            raise ValueError(f"слишком длинное поле «{name}» (больше {max_length} символов)")
+
+    year = None
+    if row['year']:
+        if not row['year'].isdigit() or not MIN_YEAR <= int(row['year']) <= date.today().year + 1:
+            raise ValueError(f"некорректный год «{row['year']}»")
+        year = int(row['year'])
+
+    return (
+        row['truck_number'], row['model'] or None, year,
+        row['description'] or None, row['frequency'] or None,
+    )
+
+
+# Разбирает файл построчно и складывает проверенные строки во временную таблицу
+def stage_rows(cursor, rows, max_rows):
+    cursor.execute('''
+    CREATE TEMP TABLE import_rows (
+        truck_number TEXT NOT NULL,
+        model TEXT,
+        year INTEGER,
+        description TEXT,
+        frequency TEXT
+    )
+    ''')
+
+    columns = COLUMNS
+    batch = []
+    accepted = 0
+    errors = []
+    rejected = 0
+    for line, values in enumerate(rows, 1):
+        values = [cell_text(value) for value in values]
+        if not any(values):
+            continue
+        if line == 1:
+            header = header_columns(values)
+            if header:
+                columns = header
+                continue
+
+        if accepted + rejected >= max_rows:
+            raise ValueError(f"В файле больше {max_rows} строк. Разбейте его на части.")
+
+        row = dict.fromkeys(COLUMNS, '')
+        for name, value in zip(columns, values):
+            if name:
+                row[name] = value
+        try:
+            batch.append(validate_row(row))
+            accepted += 1
+        except ValueError as e:
+            rejected += 1
+            if len(errors) < MAX_ERRORS_SHOWN:
+                errors.append(f"строка {line}: {e}")
+            continue
+
+        if len(batch) >= STAGE_BATCH_SIZE:
+            cursor.executemany('INSERT INTO import_rows VALUES (?, ?, ?, ?, ?)', batch)
+            batch = []
+
+    if batch:
+        cursor.executemany('INSERT INTO import_rows VALUES (?, ?, ?, ?, ?)', batch)
+    return accepted, rejected, errors
+
+
+def upsert_trucks(cursor):
+    cursor.execute('''
+    CREATE TEMP TABLE import_trucks AS
+    SELECT truck_number, MAX(model) AS model, MAX(year) AS year
+    FROM import_rows GROUP BY truck_number
+    ''')
+
+    cursor.execute('''
+    SELECT
+        SUM(t.id IS NULL),
+        SUM(t.id IS NOT NULL AND (
+            (it.model IS NOT NULL AND it.model IS NOT t.model) OR
+            (it.year IS NOT NULL AND it.year IS NOT t.year)
+        ))
+    FROM import_trucks it
+    LEFT JOIN trucks t ON t.truck_number = it.truck_number
+    ''')
+    created, updated = (count or 0 for count in cursor.fetchone())
+
+    # WHERE true нужен SQLite, чтобы отличить ON CONFLICT от JOIN ... ON
+    cursor.execute('''
+    INSERT INTO trucks (truck_number, model, year)
+    SELECT truck_number, model, year FROM import_trucks WHERE true
+    ON CONFLICT(truck_number) DO UPDATE SET
+        model = COALESCE(excluded.model, trucks.model),
+        year = COALESCE(excluded.year, trucks.year)
+    ''')
+    return created, updated
+
+
+# Задача определяется парой (фура, описание): существующая обновляется
+# и снова включается, новая добавляется. Повторы в файле схлопываются.
+def upsert_tasks(cursor):
+    cursor.execute('''
+    CREATE TEMP TABLE import_tasks (
+        truck_id INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        frequency TEXT,
+        PRIMARY KEY (truck_id, description)
+    )
+    ''')
+    cursor.execute('''
+    INSERT INTO import_tasks (truck_id, description, frequency)
+    SELECT t.id, r.description, MAX(r.frequency)
+    FROM import_rows r
+    JOIN trucks t ON t.truck_number = r.truck_number
+    WHERE r.description IS NOT NULL
+    GROUP BY t.id, r.description
+    ''')
+
+    cursor.execute('''
+    UPDATE truck_tasks SET
+        is_active = 1,
+        frequency = COALESCE((
+            SELECT it.frequency FROM import_tasks it
+            WHERE it.truck_id = truck_tasks.truck_id AND it.description = truck_tasks.description
+        ), frequency)
+    WHERE EXISTS (
+        SELECT 1 FROM import_tasks it
+        WHERE it.truck_id = truck_tasks.truck_id AND it.description = truck_tasks.description
+          AND (truck_tasks.is_active IS NOT 1
+               OR (it.frequency IS NOT NULL AND it.frequency IS NOT truck_tasks.frequency))
+    )
+    ''')
+    updated = cursor.rowcount
+
+    cursor.execute('''
+    INSERT INTO truck_tasks (truck_id, description, frequency)
+    SELECT it.truck_id, it.description, it.frequency
+    FROM import_tasks it
+    WHERE NOT EXISTS (
+        SELECT 1 FROM truck_tasks tt
+        WHERE tt.truck_id = it.truck_id AND tt.description = it.description
+    )
+    ''')
+    return cursor.rowcount, updated
+
+
+# Импорт фур и задач из CSV/XLSX одной транзакцией. Ошибка формата файла
+# (ValueError) откатывает все; некорректные строки пропускаются и попадают в отчет.
+def import_fleet(db_path, data, filename, max_rows=50000):
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            accepted, rejected, errors = stage_rows(cursor, read_rows(data, filename), max_rows)
+            trucks_created, trucks_updated = upsert_trucks(cursor)
+            tasks_created, tasks_updated = upsert_tasks(cursor)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    IMPORT_ROWS.inc('accepted', amount=accepted)
+    IMPORT_ROWS.inc('rejected', amount=rejected)
+    result = {
+        'rows': accepted,
+        'rejected': rejected,
+        'errors': errors,
+        'trucks_created': trucks_created,
+        'trucks_updated': trucks_updated,
+        'tasks_created': tasks_created,
+        'tasks_updated': tasks_updated,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"Импорт {filename}: {result}")
+    return result
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = metrics.register(metrics.Histogram(
+    'event_loop_lag_seconds', 'Задержка event loop относительно ожидаемого пробуждения'))
+LOOP_LAG_QUANTILES = metrics.register(metrics.Gauge(
+    'event_loop_lag_quantile_seconds', 'Перцентили задержки event loop', ('quantile',)))
+LOOP_BLOCKS = metrics.register(metrics.Counter(
+    'event_loop_blocked_total', 'Блокировки event loop дольше порога', ('handler', 'state')))
+LOOP_BLOCKED_SECONDS = metrics.register(metrics.Counter(
+    'event_loop_blocked_seconds_total', 'Суммарное время блокировок event loop', ('handler', 'state')))
+
+
+# Корутина в event loop просыпается каждые interval секунд и считает опоздание.
+# Отдельный поток следит за ее отметками: если отметки нет дольше threshold,
+# значит loop занят синхронным кодом, и поток снимает стек потока loop'а
+# вместе с именем обработчика задачи, которая сейчас выполняется в loop.
+class LoopMonitor:
+    def __init__(self, interval=0.1, threshold=0.25, samples=3000):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=samples)
+        self.heartbeat = time.monotonic()
+        self.loop = None
+        self.loop_thread_id = None
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = self.loop.create_task(self.measure())
+        self.thread = threading.Thread(target=self.watch, name='loop-monitor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+
+    async def measure(self):
+        ticks = 0
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            lag = max(0.0, now - expected)
+            self.lags.append(lag)
+            LOOP_LAG.observe(value=lag)
+
+            ticks += 1
+            if ticks % 50 == 0:
+                for quantile, value in self.percentiles().items():
+                    LOOP_LAG_QUANTILES.set(quantile, value=value)
+
+    def percentiles(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        return {
+            q: lags[min(len(lags) - 1, int(len(lags) * float(q)))]
+            for q in ('0.5', '0.9', '0.99', '1.0')
+        }
+
+    def watch(self):
+        reported_heartbeat = None
+        blocked_handler = None
+        while not self.stopped.wait(self.interval / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+
+            if stalled < self.threshold:
+                if reported_heartbeat is not None and heartbeat != reported_heartbeat:
+                    # Блокировка закончилась: учитываем ее полную длительность
+                    handler, state = blocked_handler
+                    LOOP_BLOCKED_SECONDS.inc(handler, state, amount=heartbeat - reported_heartbeat - self.interval)
+                    reported_heartbeat = None
+                continue
+
+            if reported_heartbeat == heartbeat:
+                continue
+
+            reported_heartbeat = heartbeat
+            task = asyncio.current_task(self.loop)
+            active = metrics.ACTIVE_TASKS.get(task)
+            blocked_handler = (active[0], active[1]) if active else ('-', '-')
+            LOOP_BLOCKS.inc(*blocked_handler)
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            logger.warning(
+                f"Event loop заблокирован уже {stalled:.2f} с; обработчик: {blocked_handler[0]} "
+                f"(состояние {blocked_handler[1]}, update {active[2] if active else '-'}, "
+                f"задача {task.get_name() if task else '-'})\n{stack}"
+            )
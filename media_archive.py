@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+import uuid
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Недокачанный файл старше этого считается брошенным: свежий может
+# прямо сейчас писать другой запуск (например, из командной строки)
+STALE_TMP_SECONDS = 60 * 60
+# Источники file_id: (таблица, столбец)
+SOURCES = (('report_media', 'file_id'), ('check_comments', 'voice_message_id'))
+# Ссылка на файл Bot API содержит токен: https://api.telegram.org/file/bot<TOKEN>/...
+BOT_TOKEN_IN_URL = re.compile(r'/bot[^/\s]+/')
+
+
+def redact_token(text):
+    return BOT_TOKEN_IN_URL.sub('/bot***/', text)
+
+
+# Локальный архив медиа из отчетов. Файлы хранятся по sha256 содержимого
+# (data/media/ab/abcdef...), поэтому одинаковые файлы лежат на диске один раз.
+# Что уже скачано, записано в таблице media_archive, так что после
+# перезапуска архиватор продолжает с того места, где остановился.
+class MediaArchiver:
+    def __init__(self, db_path, archive_dir, workers=4, batch_size=200):
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+        self.tmp_dir = os.path.join(archive_dir, 'tmp')
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def init_db(self):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        # Недокачанные файлы прошлых запусков скачиваются заново
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        with sqlite3.connect(self.db_path, timeout=10) as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS media_archive (
+                file_id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                local_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_media_archive_sha ON media_archive(sha256)')
+
+    # Очередные batch_size строк таблицы после after_id (keyset по id):
+    # каждая строка за проход читается один раз, без повторного полного скана.
+    # Возвращает (последний прочитанный id или None, если строк нет, неархивированные file_id).
+    def pending_files(self, table, column, after_id):
+        with sqlite3.connect(self.db_path, timeout=10) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+            SELECT t.id, t.{column}, ma.file_id IS NULL
+            FROM {table} t
+            LEFT JOIN media_archive ma ON ma.file_id = t.{column}
+            WHERE t.id > ?
+            ORDER BY t.id
+            LIMIT ?
+            ''', (after_id, self.batch_size))
+            rows = cursor.fetchall()
+        if not rows:
+            return None, []
+        file_ids = list(dict.fromkeys(row[1] for row in rows if row[1] and row[2]))
+        return rows[-1][0], file_ids
+
+    def record(self, file_id, sha256, local_path, size):
+        with sqlite3.connect(self.db_path, timeout=10) as conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO media_archive (file_id, sha256, local_path, size)
+            VALUES (?, ?, ?, ?)
+            ''', (file_id, sha256, local_path, size))
+
+    async def download(self, client, url):
+        tmp_path = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with client.stream('GET', url) as response:
+                response.raise_for_status()
+                # Запись на диск - в потоке, чтобы не останавливать цикл событий бота
+                f = await asyncio.to_thread(open, tmp_path, 'wb')
+                try:
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        digest.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                        size += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        sha256 = digest.hexdigest()
+        local_path = os.path.join(self.archive_dir, sha256[:2], sha256)
+        await asyncio.to_thread(self.store, tmp_path, local_path)
+        return sha256, local_path, size
+
+    def store(self, tmp_path, local_path):
+        if os.path.exists(local_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            os.replace(tmp_path, local_path)
+
+    # resolve_url(file_id) -> URL для скачивания (в боте это bot.get_file)
+    async def run(self, resolve_url):
+        await asyncio.to_thread(self.init_db)
+        stats = {'files': 0, 'bytes': 0, 'errors': 0}
+        done = set()
+        started = time.monotonic()
+
+        async with httpx.AsyncClient(timeout=60) as client:
+            for table, column in SOURCES:
+                after_id = 0
+                while True:
+                    after_id, file_ids = await asyncio.to_thread(self.pending_files, table, column, after_id)
+                    if after_id is None:
+                        break
+                    # Файл, уже скачанный или не скачавшийся за этот проход, не повторяется
+                    file_ids = [file_id for file_id in file_ids if file_id not in done]
+                    done.update(file_ids)
+                    await self.archive_batch(client, resolve_url, file_ids, stats)
+
+        stats['seconds'] = time.monotonic() - started
+        stats['mb_per_sec'] = stats['bytes'] / 1024 / 1024 / stats['seconds'] if stats['seconds'] else 0.0
+        if stats['files'] or stats['errors']:
+            logger.info(
+                f"Архив медиа: {stats['files']} файлов, {stats['bytes'] / 1024 / 1024:.1f} МБ "
+                f"за {stats['seconds']:.1f} с ({stats['mb_per_sec']:.2f} МБ/с), ошибок: {stats['errors']}"
+            )
+        return stats
+
+    async def archive_batch(self, client, resolve_url, file_ids, stats):
+        queue = asyncio.Queue()
+        for file_id in file_ids:
+            queue.put_nowait(file_id)
+
+        async def worker():
+            while True:
+                try:
+                    file_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    url = await resolve_url(file_id)
+                    sha256, local_path, size = await self.download(client, url)
+                    await asyncio.to_thread(self.record, file_id, sha256, local_path, size)
+                    stats['files'] += 1
+                    stats['bytes'] += size
+                # Текст ошибок httpx содержит URL файла, а в нем токен бота
+                except httpx.HTTPStatusError as e:
+                    logger.error(f"Не удалось архивировать файл {file_id}: HTTP {e.response.status_code}")
+                    stats['errors'] += 1
+                except Exception as e:
+                    logger.error(f"Не удалось архивировать файл {file_id}: {redact_token(str(e))}")
+                    stats['errors'] += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+
+# Запуск без бота, например против локального файлового сервера:
+#   python -m http.server 8081 --directory ./files
+#   python media_archive.py --db data/truck_tasks_v2.db --base-url http://127.0.0.1:8081/
+# Файл с file_id X скачивается по адресу <base-url>X.
+def main():
+    parser = argparse.ArgumentParser(description="Архивирование медиа из отчетов")
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--dir', default=os.path.join(os.path.dirname(__file__), 'data', 'media'))
+    parser.add_argument('--base-url', required=True)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    async def resolve_url(file_id):
+        return args.base_url + file_id
+
+    archiver = MediaArchiver(args.db, args.dir, workers=args.workers)
+    asyncio.run(archiver.run(resolve_url))
+
+
+if __name__ == '__main__':
+    main()
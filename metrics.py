@@ -0,0 +1,297 @@
+import asyncio
+import functools
+import importlib.util
+import logging
+import sqlite3
+import time
+from bisect import bisect_left
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+import sql_stats
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+# Счетчик и гистограмма хранят значения в словаре по кортежу меток:
+# запись события - это один поиск в словаре и пара сложений
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *label_values, value):
+        self.values[label_values] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, *label_values, value):
+        series = self.values.get(label_values)
+        if series is None:
+            # [счетчики по корзинам..., +Inf, сумма]
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self.values.items():
+            names = self.labels + ('le',)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(names, label_values + (bound,))} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+HANDLER_SECONDS = register(Histogram(
+    'bot_handler_seconds', 'Время выполнения обработчиков', ('handler', 'state')))
+HANDLER_ERRORS = register(Counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках', ('handler', 'state')))
+API_SECONDS = register(Histogram(
+    'telegram_api_seconds', 'Время запросов к Telegram Bot API', ('method',)))
+API_ERRORS = register(Counter(
+    'telegram_api_errors_total', 'Ошибки запросов к Telegram Bot API', ('method',)))
+API_POOL_WAIT_SECONDS = register(Histogram(
+    'telegram_api_pool_wait_seconds', 'Ожидание свободного соединения в пуле Bot API', ('pool',)))
+API_POOL_IN_USE = register(Gauge(
+    'telegram_api_pool_in_use', 'Занятые соединения пула Bot API', ('pool',)))
+API_POOL_TIMEOUTS = register(Counter(
+    'telegram_api_pool_timeouts_total', 'Запросы, не дождавшиеся свободного соединения', ('pool',)))
+DB_SECONDS = register(Histogram(
+    'db_query_seconds', 'Время выполнения SQL-запросов', ('kind',)))
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Задача asyncio -> (обработчик, состояние, update_id), который в ней выполняется.
+# Обработчики разных апдейтов и задания JobQueue идут в разных задачах и
+# чередуются на каждом await, поэтому одна глобальная переменная не говорит,
+# кто занял loop. loop_monitor берет задачу, которая выполняется в loop
+# в момент блокировки (asyncio.current_task), и ищет ее здесь.
+ACTIVE_TASKS = {}
+
+
+async def run_tracked(callback, args, name, state, update_id=None):
+    task = asyncio.current_task()
+    previous = ACTIVE_TASKS.get(task)
+    ACTIVE_TASKS[task] = (name, state, update_id)
+    started = time.perf_counter()
+    try:
+        return await callback(*args)
+    except Exception:
+        HANDLER_ERRORS.inc(name, state)
+        raise
+    finally:
+        HANDLER_SECONDS.observe(name, state, value=time.perf_counter() - started)
+        if previous is None:
+            ACTIVE_TASKS.pop(task, None)
+        else:
+            ACTIVE_TASKS[task] = previous
+
+
+def instrument_handler(callback, name, state):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        return await run_tracked(callback, (update, context), name, state, getattr(update, 'update_id', None))
+    return wrapper
+
+
+# Задания JobQueue учитываются как обработчики с именем job:<имя> и состоянием job
+def instrument_job(callback):
+    @functools.wraps(callback)
+    async def wrapper(context):
+        return await run_tracked(callback, (context,), f"job:{callback.__name__}", 'job')
+    return wrapper
+
+
+# Оборачивает callback у всех обработчиков ConversationHandler
+def instrument_conversation(conv_handler):
+    groups = [('entry', conv_handler.entry_points), ('fallback', conv_handler.fallbacks)]
+    groups += [(str(state), handlers) for state, handlers in conv_handler.states.items()]
+    for state, handlers in groups:
+        for handler in handlers:
+            handler.callback = instrument_handler(handler.callback, handler.callback.__name__, state)
+
+
+# HTTP-клиент бота, который замеряет каждый вызов Bot API (send_message,
+# send_media_group, get_updates и т.д.) по имени метода. У каждого пула
+# соединений свой клиент (pool - имя пула в метриках). Семафор размером
+# с пул пропускает в httpx не больше запросов, чем в пуле соединений:
+# так видно, сколько запрос ждал свободного соединения.
+class InstrumentedRequest(HTTPXRequest):
+    def __init__(self, pool='send', connection_pool_size=1, keepalive_expiry=5.0,
+                 pool_timeout=1.0, http_version='1.1', **kwargs):
+        if http_version == '2' and importlib.util.find_spec('h2') is None:
+            logger.warning(f"Пул {pool}: HTTP/2 недоступен без пакета h2, используется HTTP/1.1")
+            http_version = '1.1'
+        limits = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=connection_pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        super().__init__(
+            connection_pool_size=connection_pool_size, pool_timeout=pool_timeout,
+            http_version=http_version, httpx_kwargs={'limits': limits}, **kwargs
+        )
+        self.pool = pool
+        self.pool_timeout = pool_timeout
+        self.slots = asyncio.Semaphore(connection_pool_size)
+        self.in_use = 0
+
+    async def acquire(self, pool_timeout):
+        if pool_timeout is BaseRequest.DEFAULT_NONE:
+            pool_timeout = self.pool_timeout
+        started = time.perf_counter()
+        try:
+            if self.slots.locked():
+                await asyncio.wait_for(self.slots.acquire(), pool_timeout)
+            else:
+                await self.slots.acquire()
+        except asyncio.TimeoutError:
+            API_POOL_TIMEOUTS.inc(self.pool)
+            raise TimedOut(
+                f"Pool timeout: все {self.in_use} соединений пула {self.pool} заняты, "
+                f"запрос не отправлен в Telegram"
+            ) from None
+        finally:
+            API_POOL_WAIT_SECONDS.observe(self.pool, value=time.perf_counter() - started)
+        self.in_use += 1
+        API_POOL_IN_USE.set(self.pool, value=self.in_use)
+
+    def release(self):
+        self.in_use -= 1
+        API_POOL_IN_USE.set(self.pool, value=self.in_use)
+        self.slots.release()
+
+    async def do_request(self, url, method, *args, pool_timeout=BaseRequest.DEFAULT_NONE, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        await self.acquire(pool_timeout)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, pool_timeout=pool_timeout, **kwargs)
+        except Exception:
+            API_ERRORS.inc(api_method)
+            raise
+        finally:
+            API_SECONDS.observe(api_method, value=time.perf_counter() - started)
+            self.release()
+
+
+def statement_kind(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_SECONDS.observe(statement_kind(sql), value=elapsed)
+            sql_stats.record(self.connection, sql, parameters, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_SECONDS.observe(statement_kind(sql), value=elapsed)
+            sql_stats.record(self.connection, sql, (), elapsed, many=True)
+
+
+# Используется как factory= в sqlite3.connect
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+async def handle_metrics_request(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else '/'
+        if path == '/metrics':
+            body = render_metrics().encode()
+            status = '200 OK'
+        else:
+            body = b'not found\n'
+            status = '404 Not Found'
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Ошибка при отдаче метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port):
+    server = await asyncio.start_server(handle_metrics_request, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
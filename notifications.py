@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+import metrics
+from captions import MESSAGE_LIMIT, split_text
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS_QUEUED = metrics.register(metrics.Gauge(
+    'bot_notifications_queued', 'Чаты с неотправленными уведомлениями'))
+NOTIFICATIONS_SENT = metrics.register(metrics.Counter(
+    'bot_notifications_sent_total', 'Отправленные уведомления водителям', ('result',)))
+NOTIFICATIONS_COALESCED = metrics.register(metrics.Counter(
+    'bot_notifications_coalesced_total', 'Уведомления, объединенные с уже ожидающими в очереди'))
+
+
+# Очередь уведомлений с ограничением скорости (Telegram допускает около
+# 30 сообщений в секунду на бота). Тексты для одного чата, которые еще не
+# ушли, объединяются в одно сообщение.
+class NotificationQueue:
+    def __init__(self, bot, rate=25.0, max_retries=3):
+        self.bot = bot
+        self.interval = 1.0 / rate
+        self.max_retries = max_retries
+        self.pending = {}
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self, timeout=5.0):
+        if not self.task:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено уведомлений при остановке: {len(self.pending)}")
+        self.task.cancel()
+
+    def enqueue(self, chat_id, text):
+        if chat_id in self.pending:
+            self.pending[chat_id].append(text)
+            NOTIFICATIONS_COALESCED.inc()
+            return
+        self.pending[chat_id] = [text]
+        self.queue.put_nowait(chat_id)
+        NOTIFICATIONS_QUEUED.set(value=len(self.pending))
+
+    async def run(self):
+        while True:
+            chat_id = await self.queue.get()
+            try:
+                texts = self.pending.pop(chat_id)
+                NOTIFICATIONS_QUEUED.set(value=len(self.pending))
+                for chunk in split_text('\n\n'.join(texts), MESSAGE_LIMIT):
+                    await self.send(chat_id, chunk)
+                    await asyncio.sleep(self.interval)
+            except Exception as e:
+                logger.error(f"Ошибка очереди уведомлений: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def send(self, chat_id, text):
+        for _ in range(self.max_retries):
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                NOTIFICATIONS_SENT.inc('ok')
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                NOTIFICATIONS_SENT.inc('retry')
+                await asyncio.sleep(retry_after)
+            except Exception as e:
+                logger.error(f"Не удалось уведомить пользователя {chat_id}: {e}")
+                break
+        NOTIFICATIONS_SENT.inc('failed')
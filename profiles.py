@@ -0,0 +1,43 @@
+import metrics
+
+PROFILE_SAVES = metrics.register(metrics.Counter(
+    'bot_profile_saves_total', 'Сохранение профиля пользователя при /start', ('result',)))
+
+# id пользователя -> (first_name, username), совпадающие с записью в drivers.
+# Имя и username меняет только save_profile, а строки водителей не удаляются,
+# поэтому запись в кэше остается верной до следующего изменения профиля.
+PROFILES = {}
+
+
+def profile_cached(user):
+    if PROFILES.get(user.id) == (user.first_name, user.username):
+        PROFILE_SAVES.inc('cached')
+        return True
+    return False
+
+
+# Записывает профиль, только если он отличается от сохраненного.
+# Без изменений обходится одним SELECT и не берет блокировку записи.
+def save_profile(conn, user):
+    profile = (user.first_name, user.username)
+    cursor = conn.cursor()
+    cursor.execute('SELECT first_name, username, status FROM drivers WHERE id = ?', (user.id,))
+    row = cursor.fetchone()
+
+    if row and (row[0], row[1]) == profile and row[2] == 'active':
+        PROFILE_SAVES.inc('unchanged')
+    else:
+        cursor.execute('''
+        INSERT INTO drivers (id, first_name, username, status) VALUES (?, ?, ?, 'active')
+        ON CONFLICT(id) DO UPDATE SET
+            first_name = excluded.first_name,
+            username = excluded.username,
+            status = 'active'
+        WHERE drivers.first_name IS NOT excluded.first_name
+           OR drivers.username IS NOT excluded.username
+           OR drivers.status IS NOT 'active'
+        ''', (user.id, *profile))
+        conn.commit()
+        PROFILE_SAVES.inc('written')
+
+    PROFILES[user.id] = profile
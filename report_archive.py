@@ -0,0 +1,208 @@
+import glob
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, строки которых переносятся в архив, и столбец связи с отчетом
+ARCHIVE_TABLES = (
+    ('completed_checks', 'id'),
+    ('check_comments', 'check_id'),
+    ('report_media', 'report_id'),
+)
+
+# SQLite по умолчанию позволяет подключить не больше 10 баз к одному соединению
+MAX_ATTACHED_ARCHIVES = 9
+
+
+# Старые отчеты хранятся в отдельных файлах по годам: reports_2024.db и т.д.
+def archive_path(archive_dir, year):
+    return os.path.join(archive_dir, f"reports_{year}.db")
+
+
+def list_archives(archive_dir):
+    return sorted(glob.glob(os.path.join(archive_dir, 'reports_*.db')), reverse=True)
+
+
+def table_columns(cursor, schema, table):
+    cursor.execute(f"PRAGMA {schema}.table_info({table})")
+    return [(column[1], column[2]) for column in cursor.fetchall()]
+
+
+# Создает в архиве таблицы с теми же столбцами, что и в основной базе,
+# и добавляет столбцы, появившиеся в основной базе позже
+def prepare_archive_schema(cursor, schema):
+    for table, _ in ARCHIVE_TABLES:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{table} AS SELECT * FROM main.{table} WHERE 0")
+        archived = {name for name, _ in table_columns(cursor, schema, table)}
+        for name, column_type in table_columns(cursor, 'main', table):
+            if name not in archived:
+                cursor.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {column_type}")
+
+    cursor.execute(f'''
+    CREATE INDEX IF NOT EXISTS {schema}.idx_completed_checks_truck_ts
+    ON completed_checks(truck_id, completion_ts)
+    ''')
+    cursor.execute(f'''
+    CREATE INDEX IF NOT EXISTS {schema}.idx_check_comments_check_ts
+    ON check_comments(check_id, timestamp_ts)
+    ''')
+    cursor.execute(f'''
+    CREATE INDEX IF NOT EXISTS {schema}.idx_report_media_report
+    ON report_media(report_id)
+    ''')
+
+
+# Сводка архивов по фурам в основной базе: самая старшая задача и самое
+# позднее время среди архивных отчетов фуры. По ней страница отчетов
+# понимает, что архивные отчеты не попадут на нее, и не подключает архивы.
+# При первом создании сводка заполняется по уже существующим архивам.
+def prepare_archive_summary(cursor, archive_dir):
+    cursor.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'archive_summary'")
+    if cursor.fetchone():
+        return
+    cursor.execute('''
+    CREATE TABLE main.archive_summary (
+        truck_id INTEGER PRIMARY KEY,
+        max_task_id INTEGER NOT NULL,
+        max_completion_ts INTEGER
+    )
+    ''')
+    for path in list_archives(archive_dir):
+        cursor.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            update_archive_summary(cursor, 'archive.completed_checks', '1')
+        finally:
+            cursor.execute("DETACH DATABASE archive")
+
+
+def update_archive_summary(cursor, source, condition, params=()):
+    cursor.execute(f'''
+    INSERT INTO main.archive_summary (truck_id, max_task_id, max_completion_ts)
+    SELECT truck_id, MAX(task_id), MAX(completion_ts) FROM {source}
+    WHERE {condition}
+    GROUP BY truck_id
+    ON CONFLICT(truck_id) DO UPDATE SET
+        max_task_id = MAX(max_task_id, excluded.max_task_id),
+        max_completion_ts = MAX(IFNULL(max_completion_ts, 0), IFNULL(excluded.max_completion_ts, 0))
+    ''', params)
+
+
+def move_batch(cursor, report_ids):
+    placeholders = ','.join('?' * len(report_ids))
+    update_archive_summary(cursor, 'main.completed_checks', f"id IN ({placeholders})", report_ids)
+    for table, key in ARCHIVE_TABLES:
+        columns = ', '.join(name for name, _ in table_columns(cursor, 'main', table))
+        cursor.execute(f'''
+        INSERT INTO archive.{table} ({columns})
+        SELECT {columns} FROM main.{table} WHERE {key} IN ({placeholders})
+        ''', report_ids)
+    for table, key in reversed(ARCHIVE_TABLES):
+        cursor.execute(f"DELETE FROM main.{table} WHERE {key} IN ({placeholders})", report_ids)
+
+
+# Переносит проверенные отчеты старше cutoff_ts (вместе с комментариями и
+# медиа) в архивные файлы. Ожидающие проверки отчеты остаются в основной базе.
+def archive_old_reports(db_path, archive_dir, cutoff_ts, batch_size=1000, vacuum_pages=1000):
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = 0
+
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    cursor = conn.cursor()
+    try:
+        prepare_archive_summary(cursor, archive_dir)
+        cursor.execute('''
+        SELECT DISTINCT strftime('%Y', completion_ts, 'unixepoch')
+        FROM completed_checks
+        WHERE completion_ts < ? AND status != 'pending'
+        ''', (cutoff_ts,))
+        years = [row[0] for row in cursor.fetchall()]
+
+        for year in years:
+            start_ts = f"{year}-01-01"
+            cursor.execute("ATTACH DATABASE ? AS archive", (archive_path(archive_dir, year),))
+            try:
+                prepare_archive_schema(cursor, 'archive')
+                while True:
+                    cursor.execute('''
+                    SELECT id FROM completed_checks
+                    WHERE completion_ts < ? AND status != 'pending'
+                      AND completion_ts >= CAST(strftime('%s', ?) AS INTEGER)
+                      AND completion_ts < CAST(strftime('%s', ?, '+1 year') AS INTEGER)
+                    LIMIT ?
+                    ''', (cutoff_ts, start_ts, start_ts, batch_size))
+                    report_ids = [row[0] for row in cursor.fetchall()]
+                    if not report_ids:
+                        break
+
+                    cursor.execute("BEGIN IMMEDIATE")
+                    try:
+                        move_batch(cursor, report_ids)
+                        cursor.execute("COMMIT")
+                    except Exception:
+                        cursor.execute("ROLLBACK")
+                        raise
+                    moved += len(report_ids)
+            finally:
+                cursor.execute("DETACH DATABASE archive")
+
+        if moved:
+            # Освобожденные страницы возвращаются порциями, без полного VACUUM.
+            # Прагма освобождает по одной странице на каждый шаг и отдает строки
+            # без столбцов, на которых курсор sqlite3 останавливается после
+            # первого шага (и execute, и fetchall освобождают одну страницу).
+            # executescript выполняет прагму до конца
+            cursor.execute("PRAGMA freelist_count")
+            free_before = cursor.fetchone()[0]
+            conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+            cursor.execute("PRAGMA freelist_count")
+            free_after = cursor.fetchone()[0]
+            logger.info(
+                f"В архив перенесено отчетов: {moved}, "
+                f"свободных страниц: {free_before} -> {free_after}"
+            )
+            if free_before and free_after >= free_before:
+                logger.warning("incremental_vacuum не освободил страницы: проверьте, что auto_vacuum = INCREMENTAL")
+    finally:
+        conn.close()
+
+    return moved
+
+
+# Подключает архивы к соединению, от новых к старым, и возвращает имена схем
+# Подключает архивы для запроса по всем ним сразу. Больше
+# MAX_ATTACHED_ARCHIVES подключить нельзя - самые старые в выборку не попадут
+def attach_archives(cursor, archive_dir):
+    paths = list_archives(archive_dir)
+    if len(paths) > MAX_ATTACHED_ARCHIVES:
+        logger.warning(
+            f"Архивов {len(paths)}, подключено только {MAX_ATTACHED_ARCHIVES} самых новых: "
+            f"не видны {', '.join(os.path.basename(path) for path in paths[MAX_ATTACHED_ARCHIVES:])}"
+        )
+    schemas = []
+    for idx, path in enumerate(paths[:MAX_ATTACHED_ARCHIVES]):
+        schema = f"archive_{idx}"
+        cursor.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        schemas.append(schema)
+    return schemas
+
+
+# Возвращает схему, в которой лежит отчет: 'main' или 'archive' (подключенный
+# архив с этим отчетом), None - отчета нет нигде. Архивы подключаются по
+# одному; year - год архива из кнопки отчета, его архив проверяется первым
+def find_report_schema(cursor, archive_dir, report_id, year=None):
+    cursor.execute('SELECT 1 FROM main.completed_checks WHERE id = ?', (report_id,))
+    if cursor.fetchone():
+        return 'main'
+    paths = list_archives(archive_dir)
+    if year is not None:
+        hint = archive_path(archive_dir, year)
+        paths = [hint] + [path for path in paths if path != hint] if hint in paths else paths
+    for path in paths:
+        cursor.execute("ATTACH DATABASE ? AS archive", (path,))
+        cursor.execute('SELECT 1 FROM archive.completed_checks WHERE id = ?', (report_id,))
+        if cursor.fetchone():
+            return 'archive'
+        cursor.execute("DETACH DATABASE archive")
+    return None
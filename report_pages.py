@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+import metrics
+
+REPORT_PAGE_LOOKUPS = metrics.register(metrics.Counter(
+    'bot_report_page_cache_total', 'Обращения к кэшу страниц отчетов', ('result',)))
+REPORT_PAGE_EVICTIONS = metrics.register(metrics.Counter(
+    'bot_report_page_cache_evictions_total', 'Страницы, вытесненные из кэша', ('reason',)))
+REPORT_PAGE_BYTES = metrics.register(metrics.Gauge(
+    'bot_report_page_cache_bytes', 'Примерный объем текста страниц в кэше'))
+
+
+# Примерный размер страницы: подписи, продолжения и file_id вложений
+def page_size(page):
+    size = 0
+    for report in page.reports:
+        size += len(report.caption) + sum(len(text) for text in report.overflow)
+        size += sum(len(media.file_id) for media in report.media)
+        size += sum(len(file_id) + len(caption) for file_id, caption in report.voices)
+    return size
+
+
+# LRU-кэш готовых страниц отчетов фуры (rows.ReportPage). Ключ -
+# (truck_id, offset, version), где version - trucks.reports_version, который
+# триггеры увеличивают при новом отчете, комментарии, вложении, смене статуса,
+# удалении или переименовании задачи и смене имени водителя.
+# Записи фуры с другой версией устарели и удаляются при сохранении новой.
+class ReportPageCache:
+    def __init__(self, maxsize=1000, max_bytes=16 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.by_truck = {}
+        self.bytes = 0
+
+    def get(self, truck_id, offset, version, render):
+        key = (truck_id, offset, version)
+        entry = self.items.get(key)
+        if entry is not None:
+            self.items.move_to_end(key)
+            REPORT_PAGE_LOOKUPS.inc('hit')
+            return entry[1]
+
+        REPORT_PAGE_LOOKUPS.inc('miss')
+        page = render()
+        for stale in [k for k in self.by_truck.get(truck_id, ()) if k[2] != version]:
+            self.discard(stale)
+            REPORT_PAGE_EVICTIONS.inc('stale')
+
+        size = page_size(page)
+        self.items[key] = (size, page)
+        self.by_truck.setdefault(truck_id, set()).add(key)
+        self.bytes += size
+        while len(self.items) > self.maxsize or (self.bytes > self.max_bytes and len(self.items) > 1):
+            self.discard(next(iter(self.items)))
+            REPORT_PAGE_EVICTIONS.inc('size')
+        REPORT_PAGE_BYTES.set(value=self.bytes)
+        return page
+
+    def discard(self, key):
+        entry = self.items.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry[0]
+        keys = self.by_truck.get(key[0])
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self.by_truck[key[0]]
+
+    def clear(self):
+        self.items.clear()
+        self.by_truck.clear()
+        self.bytes = 0
+        REPORT_PAGE_BYTES.set(value=0)
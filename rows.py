@@ -0,0 +1,92 @@
+from collections import namedtuple
+from functools import lru_cache
+
+# Типы строк из базы. Это подклассы tuple без __dict__ (__slots__ = ()):
+# по памяти они не больше обычного кортежа, а старый код с индексами
+# (truck[1], report[0]) продолжает работать рядом с новым (truck.truck_number).
+
+
+class Truck(namedtuple('Truck', 'id truck_number model year status')):
+    __slots__ = ()
+
+
+class Driver(namedtuple('Driver', 'id first_name username truck_number')):
+    __slots__ = ()
+
+
+class Task(namedtuple('Task', 'id description is_active')):
+    __slots__ = ()
+
+
+class TaskTemplate(namedtuple('TaskTemplate', 'id name items trucks')):
+    __slots__ = ()
+
+
+class TemplateItem(namedtuple('TemplateItem', 'id description frequency')):
+    __slots__ = ()
+
+
+class DriverTask(namedtuple('DriverTask', 'id description truck_number')):
+    __slots__ = ()
+
+
+# Фура водителя с ее активными задачами (кортеж DriverTask)
+class DriverContext(namedtuple('DriverContext', 'truck_id truck_number model tasks')):
+    __slots__ = ()
+
+
+# Строка страницы отчетов (REPORTS_PAGE_SELECT)
+class Check(namedtuple('Check', 'id truck_number first_name username description completion_ts '
+                                'status skipped task_id source version')):
+    __slots__ = ()
+
+
+class Comment(namedtuple('Comment', 'type text voice_message_id timestamp_ts')):
+    __slots__ = ()
+
+
+class Media(namedtuple('Media', 'file_id file_type file_unique_id', defaults=(None,))):
+    __slots__ = ()
+
+
+# Отчет на странице вместе с комментариями и вложениями
+class Report:
+    __slots__ = ('check', 'comments', 'skip_reasons', 'media')
+
+    def __init__(self, check, comments, skip_reasons, media):
+        self.check = check
+        self.comments = comments
+        self.skip_reasons = skip_reasons
+        self.media = media
+
+
+# Готовый к отправке отчет страницы: подпись с продолжениями,
+# вложения (кортеж Media) и голосовые (кортеж пар file_id, подпись)
+class RenderedReport(namedtuple('RenderedReport', 'caption overflow media voices')):
+    __slots__ = ()
+
+
+class ReportPage(namedtuple('ReportPage', 'reports has_next')):
+    __slots__ = ()
+
+
+# tuple.__new__ вместо конструктора namedtuple: без разбора именованных
+# аргументов на каждую строку. Недостающие в запросе столбцы - None.
+@lru_cache(maxsize=None)
+def factory(row_type):
+    size = len(row_type._fields)
+    padding = (None,) * size
+    new = tuple.__new__
+
+    def row_factory(cursor, row):
+        if len(row) < size:
+            row += padding[len(row):]
+        return new(row_type, row)
+    return row_factory
+
+
+# Отдельный курсор на соединении, чтобы row_factory не влиял на другие запросы
+def typed_cursor(connection, row_type):
+    cursor = connection.cursor()
+    cursor.row_factory = factory(row_type)
+    return cursor
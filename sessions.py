@@ -0,0 +1,88 @@
+import logging
+import sys
+import time
+
+from telegram.ext import ConversationHandler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LAST_SEEN_KEY = 'session_last_seen'
+
+SESSIONS = metrics.register(metrics.Gauge(
+    'bot_sessions', 'Пользователи с данными сессии в памяти'))
+SESSION_BYTES = metrics.register(metrics.Gauge(
+    'bot_session_bytes', 'Примерный размер данных сессий в памяти', ('stat',)))
+SESSIONS_EVICTED = metrics.register(metrics.Counter(
+    'bot_sessions_evicted_total', 'Сессии, удаленные после простоя'))
+
+
+# Примерный размер структуры: getsizeof по всем вложенным контейнерам.
+# Общие объекты (интернированные строки, маленькие числа) считаются каждый раз.
+def approx_size(obj, seen=None):
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(key, seen) + approx_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(approx_size(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+# ConversationHandler с таймаутом только в состояниях timed_states - там,
+# где пользователь на середине отчета или правки и в user_data лежит черновик.
+# В меню таймаут не ставится: сбрасывать там нечего, а завершенный разговор
+# отключил бы кнопки меню до /start. Память молчащих пользователей
+# освобождает sweep_sessions.
+class FlowConversationHandler(ConversationHandler):
+    def __init__(self, *args, timed_states=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timed_states = frozenset(timed_states)
+
+    def _schedule_job(self, new_state, *args, **kwargs):
+        if new_state not in self.timed_states:
+            return None
+        return super()._schedule_job(new_state, *args, **kwargs)
+
+
+# TypeHandler в самой ранней группе: отмечает время последнего апдейта пользователя
+async def touch_session(update, context):
+    if update.effective_user:
+        context.bot_data.setdefault(LAST_SEEN_KEY, {})[update.effective_user.id] = time.time()
+
+
+# Удаляет user_data и chat_data пользователей, которые молчат дольше idle_timeout.
+# idle_timeout должен быть больше conversation_timeout: к этому моменту
+# ConversationHandler уже закрыл незавершенные отчеты и правки, а обработчики
+# меню данных сессии не читают.
+def sweep_sessions(application, idle_timeout, now=None):
+    now = now or time.time()
+    last_seen = application.bot_data.setdefault(LAST_SEEN_KEY, {})
+    cutoff = now - idle_timeout
+
+    evicted = 0
+    for user_id in list(application.user_data):
+        if last_seen.get(user_id, 0) < cutoff:
+            application.drop_user_data(user_id)
+            # В личном чате chat_id совпадает с id пользователя
+            application.drop_chat_data(user_id)
+            last_seen.pop(user_id, None)
+            evicted += 1
+    for user_id in [user_id for user_id, seen in last_seen.items() if seen < cutoff]:
+        del last_seen[user_id]
+
+    sizes = [approx_size(data) for data in application.user_data.values() if data]
+    SESSIONS.set(value=len(sizes))
+    SESSION_BYTES.set('total', value=sum(sizes))
+    SESSION_BYTES.set('avg', value=sum(sizes) / len(sizes) if sizes else 0)
+    SESSION_BYTES.set('max', value=max(sizes, default=0))
+    if evicted:
+        SESSIONS_EVICTED.inc(amount=evicted)
+
+    return {'evicted': evicted, 'sessions': len(sizes), 'bytes': sum(sizes)}
@@ -0,0 +1,102 @@
+import logging
+import sqlite3
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_THRESHOLD = 0.05
+
+
+class StatementStats:
+    __slots__ = ('sql', 'count', 'total', 'max', 'slow', 'plan', 'full_scan')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.plan = None
+        self.full_scan = False
+
+
+# Статистика по каждому тексту запроса (без лишних пробелов)
+STATS = {}
+
+
+def configure(slow_query_threshold):
+    global SLOW_QUERY_THRESHOLD
+    SLOW_QUERY_THRESHOLD = slow_query_threshold
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    return ' '.join(sql.split())
+
+
+def param_shape(parameters):
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return tuple(type(value).__name__ for value in parameters)
+
+
+def explain(connection, sql, parameters):
+    # Обычный курсор, чтобы сам EXPLAIN не попал в статистику
+    cursor = sqlite3.Cursor(connection)
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+        details = [row[3] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        return [f"EXPLAIN не выполнен: {e}"], False
+    finally:
+        cursor.close()
+    # "SCAN t" без индекса - полный просмотр таблицы
+    full_scan = any(
+        detail.startswith('SCAN ') and 'INDEX' not in detail and 'CONSTANT ROW' not in detail
+        for detail in details
+    )
+    return details, full_scan
+
+
+def record(connection, sql, parameters, seconds, many=False):
+    key = normalize_sql(sql)
+    stats = STATS.get(key)
+    if stats is None:
+        stats = STATS[key] = StatementStats(key)
+    stats.count += 1
+    stats.total += seconds
+    if seconds > stats.max:
+        stats.max = seconds
+
+    if seconds < SLOW_QUERY_THRESHOLD:
+        return
+
+    stats.slow += 1
+    if stats.plan is None and not many and key.split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'):
+        stats.plan, stats.full_scan = explain(connection, sql, parameters)
+
+    logger.warning(
+        f"Медленный запрос {seconds * 1000:.1f} мс: {key[:300]} "
+        f"параметры={'executemany' if many else param_shape(parameters)}"
+        + (f" план={stats.plan}" if stats.plan else "")
+        + (" [ПОЛНЫЙ ПРОСМОТР ТАБЛИЦЫ]" if stats.full_scan else "")
+    )
+
+
+def top_statements(limit=10):
+    return sorted(STATS.values(), key=lambda stats: stats.total, reverse=True)[:limit]
+
+
+def format_stats(limit=10):
+    lines = []
+    for stats in top_statements(limit):
+        line = (
+            f"• {stats.total * 1000:.0f} мс всего, {stats.count} раз, "
+            f"ср. {stats.total / stats.count * 1000:.2f} мс, макс. {stats.max * 1000:.1f} мс"
+        )
+        if stats.slow:
+            line += f", медленных: {stats.slow}"
+        if stats.full_scan:
+            line += " ⚠️ полный просмотр"
+        lines.append(f"{line}\n  {stats.sql[:150]}")
+    return "\n".join(lines)
@@ -0,0 +1,212 @@
+import logging
+
+from rows import TaskTemplate, TemplateItem, typed_cursor
+
+logger = logging.getLogger(__name__)
+
+MAX_NAME_LENGTH = 100
+MAX_DESCRIPTION_LENGTH = 1000
+
+
+# Текст шаблона: первая строка - название, далее по строке на задачу
+# в виде "описание; периодичность" (периодичность можно не указывать)
+def parse_template_text(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) < 2:
+        raise ValueError("Нужно название шаблона и хотя бы одна задача")
+
+    name = lines[0]
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f"Название шаблона длиннее {MAX_NAME_LENGTH} символов")
+
+    items = {}
+    for line in lines[1:]:
+        description, _, frequency = line.partition(';')
+        description = description.strip()
+        if len(description) > MAX_DESCRIPTION_LENGTH:
+            raise ValueError(f"Описание задачи длиннее {MAX_DESCRIPTION_LENGTH} символов")
+        if description:
+            items[description] = frequency.strip() or None
+    if not items:
+        raise ValueError("В шаблоне нет ни одной задачи")
+    return name, list(items.items())
+
+
+def template_text(name, items):
+    lines = [name]
+    for item in items:
+        lines.append(f"{item.description}; {item.frequency}" if item.frequency else item.description)
+    return '\n'.join(lines)
+
+
+def get_templates(cursor):
+    cursor = typed_cursor(cursor.connection, TaskTemplate)
+    cursor.execute('''
+    SELECT t.id, t.name,
+           (SELECT COUNT(*) FROM task_template_items i WHERE i.template_id = t.id),
+           (SELECT COUNT(*) FROM truck_templates tt WHERE tt.template_id = t.id)
+    FROM task_templates t
+    ORDER BY t.name
+    ''')
+    return cursor.fetchall()
+
+
+def get_template(cursor, template_id):
+    cursor = typed_cursor(cursor.connection, TaskTemplate)
+    cursor.execute('''
+    SELECT t.id, t.name,
+           (SELECT COUNT(*) FROM task_template_items i WHERE i.template_id = t.id),
+           (SELECT COUNT(*) FROM truck_templates tt WHERE tt.template_id = t.id)
+    FROM task_templates t WHERE t.id = ?
+    ''', (template_id,))
+    return cursor.fetchone()
+
+
+def get_template_items(cursor, template_id):
+    cursor = typed_cursor(cursor.connection, TemplateItem)
+    cursor.execute('''
+    SELECT id, description, frequency FROM task_template_items
+    WHERE template_id = ? ORDER BY id
+    ''', (template_id,))
+    return cursor.fetchall()
+
+
+# Приводит задачи всех фур шаблона к его текущему составу. Каждый шаг -
+# один запрос по всем фурам сразу, а не обновление задач по одной.
+def sync_template(cursor, template_id):
+    # Задачи, добавленные вручную с тем же описанием, переходят под шаблон.
+    # Их прежняя активность запоминается, чтобы вернуть ее, когда задача
+    # уйдет из шаблона (release_template_tasks)
+    cursor.execute('''
+    UPDATE truck_tasks SET template_id = ?, adopted_active = is_active, is_active = 1, frequency = (
+        SELECT i.frequency FROM task_template_items i
+        WHERE i.template_id = ? AND i.description = truck_tasks.description
+    )
+    WHERE template_id IS NULL
+      AND truck_id IN (SELECT truck_id FROM truck_templates WHERE template_id = ?)
+      AND description IN (SELECT description FROM task_template_items WHERE template_id = ?)
+    ''', (template_id, template_id, template_id, template_id))
+    adopted = cursor.rowcount
+
+    cursor.execute('''
+    UPDATE truck_tasks SET frequency = (
+        SELECT i.frequency FROM task_template_items i
+        WHERE i.template_id = truck_tasks.template_id AND i.description = truck_tasks.description
+    )
+    WHERE template_id = ? AND EXISTS (
+        SELECT 1 FROM task_template_items i
+        WHERE i.template_id = truck_tasks.template_id AND i.description = truck_tasks.description
+          AND i.frequency IS NOT truck_tasks.frequency
+    )
+    ''', (template_id,))
+    updated = cursor.rowcount
+
+    cursor.execute('''
+    INSERT INTO truck_tasks (truck_id, description, frequency, template_id)
+    SELECT tt.truck_id, i.description, i.frequency, i.template_id
+    FROM truck_templates tt
+    JOIN trucks t ON t.id = tt.truck_id
+    JOIN task_template_items i ON i.template_id = tt.template_id
+    WHERE tt.template_id = ? AND NOT EXISTS (
+        SELECT 1 FROM truck_tasks task
+        WHERE task.truck_id = tt.truck_id AND task.description = i.description
+    )
+    ''', (template_id,))
+    added = cursor.rowcount
+
+    removed = release_template_tasks(cursor, template_id, '''
+    AND description NOT IN (SELECT description FROM task_template_items WHERE template_id = ?)
+    ''', (template_id,))
+
+    result = {'added': added, 'updated': updated + adopted, 'removed': removed}
+    logger.info(f"Шаблон {template_id} синхронизирован: {result}")
+    return result
+
+
+# Отвязывает от шаблона задачи, подходящие под условие condition.
+# Задачи, созданные шаблоном, выключаются, а не удаляются: на них ссылаются
+# уже сданные отчеты. Задачи, добавленные вручную до шаблона, остаются на фуре
+# с той активностью, что была у них до перехода под шаблон.
+# Одно описание может быть в нескольких шаблонах фуры, а задача принадлежит
+# тому, что применен первым. Поэтому после отвязки остальные шаблоны этих фур
+# синхронизируются заново и забирают свои задачи обратно.
+# Возвращает число задач, которые остались выключенными.
+def release_template_tasks(cursor, template_id, condition='', params=()):
+    cursor.execute(f'''
+    SELECT id, truck_id FROM truck_tasks WHERE template_id = ? {condition}
+    ''', (template_id, *params))
+    released = cursor.fetchall()
+    if not released:
+        return 0
+    task_ids = [task_id for task_id, _ in released]
+    truck_ids = sorted({truck_id for _, truck_id in released})
+
+    cursor.execute(f'''
+    UPDATE truck_tasks SET is_active = 0, template_id = NULL
+    WHERE template_id = ? AND adopted_active IS NULL {condition}
+    ''', (template_id, *params))
+    cursor.execute(f'''
+    UPDATE truck_tasks SET is_active = adopted_active, template_id = NULL, adopted_active = NULL
+    WHERE template_id = ? AND adopted_active IS NOT NULL {condition}
+    ''', (template_id, *params))
+
+    cursor.execute(f'''
+    SELECT DISTINCT template_id FROM truck_templates
+    WHERE template_id != ? AND truck_id IN ({','.join('?' * len(truck_ids))})
+    ''', (template_id, *truck_ids))
+    for (other_id,) in cursor.fetchall():
+        sync_template(cursor, other_id)
+
+    cursor.execute(f'''
+    SELECT COUNT(*) FROM truck_tasks WHERE is_active = 0 AND id IN ({','.join('?' * len(task_ids))})
+    ''', task_ids)
+    return cursor.fetchone()[0]
+
+
+# Создает шаблон (или заменяет состав шаблона template_id) и сразу
+# синхронизирует фуры, к которым он применен
+def save_template(cursor, name, items, template_id=None):
+    cursor.execute('SELECT id FROM task_templates WHERE name = ?', (name,))
+    existing = cursor.fetchone()
+    if existing and existing[0] != template_id:
+        raise ValueError(f"Шаблон «{name}» уже существует")
+    if template_id is None:
+        cursor.execute('INSERT INTO task_templates (name) VALUES (?)', (name,))
+        template_id = cursor.lastrowid
+    else:
+        cursor.execute('UPDATE task_templates SET name = ? WHERE id = ?', (name, template_id))
+
+    descriptions = [description for description, _ in items]
+    cursor.execute(f'''
+    DELETE FROM task_template_items
+    WHERE template_id = ? AND description NOT IN ({','.join('?' * len(descriptions))})
+    ''', (template_id, *descriptions))
+    cursor.executemany('''
+    INSERT INTO task_template_items (template_id, description, frequency) VALUES (?, ?, ?)
+    ON CONFLICT(template_id, description) DO UPDATE SET frequency = excluded.frequency
+    ''', [(template_id, description, frequency) for description, frequency in items])
+
+    return template_id, sync_template(cursor, template_id)
+
+
+# truck_ids=None - все активные фуры
+def apply_template(cursor, template_id, truck_ids=None):
+    if truck_ids is None:
+        cursor.execute('''
+        INSERT OR IGNORE INTO truck_templates (truck_id, template_id)
+        SELECT id, ? FROM trucks WHERE status = 'active'
+        ''', (template_id,))
+    else:
+        cursor.executemany(
+            'INSERT OR IGNORE INTO truck_templates (truck_id, template_id) VALUES (?, ?)',
+            [(truck_id, template_id) for truck_id in truck_ids]
+        )
+    return sync_template(cursor, template_id)
+
+
+def delete_template(cursor, template_id):
+    removed = release_template_tasks(cursor, template_id)
+    cursor.execute('DELETE FROM truck_templates WHERE template_id = ?', (template_id,))
+    cursor.execute('DELETE FROM task_template_items WHERE template_id = ?', (template_id,))
+    cursor.execute('DELETE FROM task_templates WHERE id = ?', (template_id,))
+    return removed
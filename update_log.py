@@ -0,0 +1,68 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Поля с личными данными, которые заменяются псевдонимами
+ANONYMIZED_FIELDS = ('first_name', 'last_name', 'username', 'phone_number', 'title')
+
+
+# HMAC со случайным ключом, а не простой хэш: по простому хэшу имя легко
+# подобрать перебором известных имен (например, из таблицы drivers).
+# Ключ живет только в памяти записывающего процесса и в лог не попадает.
+def pseudonym(field, value, key):
+    digest = hmac.new(key, f"{field}:{value}".encode(), hashlib.sha256).hexdigest()[:10]
+    return f"{field}_{digest}"
+
+
+# В пределах одного ключа пользователь всегда получает одинаковый псевдоним,
+# поэтому последовательности действий в записи сохраняются
+def anonymize(data, key):
+    if isinstance(data, dict):
+        return {
+            name: pseudonym(name, value, key) if name in ANONYMIZED_FIELDS and isinstance(value, str)
+            else anonymize(value, key)
+            for name, value in data.items()
+        }
+    if isinstance(data, list):
+        return [anonymize(item, key) for item in data]
+    return data
+
+
+# Пишет входящие апдейты в NDJSON: {"ts": время получения, "update": {...}}.
+# Подключается TypeHandler'ом в группе -1, до всех обработчиков бота.
+# Ключ псевдонимов свой у каждого запуска: после перезапуска бота тот же
+# пользователь в дописанной части лога получит другой псевдоним.
+class UpdateRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.key = os.urandom(32)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+        self.recorded = 0
+
+    async def record(self, update, context):
+        try:
+            line = json.dumps(
+                {'ts': round(time.time(), 3), 'update': anonymize(update.to_dict(), self.key)},
+                ensure_ascii=False, separators=(',', ':')
+            )
+            self.file.write(line + '\n')
+            self.recorded += 1
+        except Exception as e:
+            logger.error(f"Не удалось записать апдейт {update.update_id}: {e}")
+
+    def close(self):
+        self.file.close()
+
+
+def read_updates(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry['ts'], entry['update']